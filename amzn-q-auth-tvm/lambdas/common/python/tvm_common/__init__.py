@@ -0,0 +1,3 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Helpers shared by the TVM issuer and authorizer Lambdas."""
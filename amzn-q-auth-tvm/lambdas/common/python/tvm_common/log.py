@@ -0,0 +1,150 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Structured JSON line logging for the request path of the TVM Lambdas.
+
+    log = RequestLogger(__name__, 'issuer')
+    log.start_request(event, context)
+    log.info('Token minted', path=path, clientId=client_id)
+    log.payload('Request event', event)
+
+Nothing is serialized unless the entry is emitted: the level is checked
+before the entry is built and fields are only formatted by the handler.
+Field values may be callables, they are then called at formatting time.
+
+Emitted entries carry the correlation id of the request. That is the
+X-Correlation-Id header when the caller sends one, else the API Gateway
+request id, which the authorizer and the issuer both see. Emails are masked
+(j***@example.com) and Authorization headers, secrets and tokens are
+replaced by "***".
+
+Verbose payloads such as the whole event are logged at DEBUG, or at any level
+for the fraction LOG_SAMPLE_RATE of the requests (e.g. 0.01), so a sample of
+full requests is kept without paying for all of them.
+"""
+import os
+import re
+import sys
+import json
+import random
+import logging
+import datetime
+import threading
+
+EMAIL = re.compile(r'([A-Za-z0-9._%+-])[A-Za-z0-9._%+-]*@([A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+)')
+# Compared lower-cased, their values are never logged
+SECRET_KEYS = frozenset(('authorization', 'client_secret', 'clientsecret', 'secret', 'id_token', 'token', 'tokens',
+                         'cookie', 'x-api-key', 'webidentitytoken', 'sessiontoken', 'secretaccesskey'))
+CORRELATION_HEADER = 'x-correlation-id'
+
+
+def redact(value, key=None):
+    """Return `value` with secrets replaced and emails masked, walking dicts, lists and JSON strings."""
+    if key is not None and key.lower() in SECRET_KEYS:
+        return '***'
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        if value[:1] in ('{', '[') and key == 'body':
+            # Request bodies are JSON, redact their keys too
+            try:
+                return redact(json.loads(value))
+            except ValueError:
+                pass
+        return EMAIL.sub(r'\1***@\2', value) if '@' in value else value
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'service': self.service,
+            'message': record.getMessage()
+        }
+        correlation_id = getattr(record, 'correlation_id', None)
+        if correlation_id:
+            entry['correlationId'] = correlation_id
+        for key, value in (getattr(record, 'fields', None) or {}).items():
+            entry[key] = redact(value() if callable(value) else value, key)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestLogger:
+    def __init__(self, name, service, level=None, sample_rate=None, stream=None):
+        """
+        Args:
+            name: Name of the underlying logging.Logger
+            service: Value of the "service" key of every entry, e.g. "issuer"
+            level: Minimum level (default: LOG_LEVEL or INFO)
+            sample_rate: Fraction of requests whose payloads are logged at any level (default: LOG_SAMPLE_RATE or 0)
+            stream: Where entries are written (default: stdout, which Lambda ships to CloudWatch Logs)
+        """
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(level or os.environ.get('LOG_LEVEL', 'INFO'))
+        self.sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', '0')) if sample_rate is None else sample_rate
+        handler = logging.StreamHandler(stream or sys.stdout)
+        handler.setFormatter(JsonFormatter(service))
+        self.logger.handlers = [handler]
+        # Not passed on to the Lambda runtime's root handler, which would log it a second time
+        self.logger.propagate = False
+        # Per thread, the standalone server handles requests on several threads
+        self._request = threading.local()
+
+    def start_request(self, event, context=None):
+        """Take the correlation id of the request and decide whether its payloads are sampled."""
+        headers = event.get('headers') or {}
+        correlation_id = None
+        for name, value in headers.items():
+            if name.lower() == CORRELATION_HEADER:
+                correlation_id = value
+                break
+        self._request.correlation_id = correlation_id or (event.get('requestContext') or {}).get('requestId') \
+            or getattr(context, 'aws_request_id', None)
+        self._request.sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @property
+    def correlation_id(self):
+        return getattr(self._request, 'correlation_id', None)
+
+    def _log(self, level, message, fields, exc_info=None):
+        # Built directly, the caller's file and line are not logged and looking them up is the costliest step
+        record = self.logger.makeRecord(self.logger.name, level, '(unknown file)', 0, message, None, exc_info, extra={
+            'fields': fields,
+            'correlation_id': getattr(self._request, 'correlation_id', None)
+        })
+        self.logger.handle(record)
+
+    def debug(self, message, **fields):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self._log(logging.DEBUG, message, fields)
+
+    def info(self, message, **fields):
+        if self.logger.isEnabledFor(logging.INFO):
+            self._log(logging.INFO, message, fields)
+
+    def warning(self, message, **fields):
+        if self.logger.isEnabledFor(logging.WARNING):
+            self._log(logging.WARNING, message, fields)
+
+    def error(self, message, exc_info=None, **fields):
+        if self.logger.isEnabledFor(logging.ERROR):
+            if exc_info is True:
+                exc_info = sys.exc_info()
+            self._log(logging.ERROR, message, fields, exc_info)
+
+    def payload(self, message, payload):
+        """Log a verbose payload at DEBUG, or at the logger's level when the request is sampled."""
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self._log(logging.DEBUG, message, {'payload': payload})
+        elif getattr(self._request, 'sampled', False):
+            self._log(self.logger.getEffectiveLevel(), message, {'payload': payload, 'sampled': True})
@@ -0,0 +1,137 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Per-phase latency and cache metrics in CloudWatch Embedded Metric Format (EMF).
+
+A handler calls `metrics.start_request()`, times its phases with
+`metrics.timer('PrivateKeyFetch')`, counts events with
+`metrics.count('SigningKeyCacheHit')` and calls `metrics.flush()` at the end of
+the request, which prints a single EMF line that CloudWatch Logs turns into
+metrics. Metrics are dimensioned by service, and by service and start type
+("cold" for the first request of the execution environment, "warm" after).
+
+Requests are tracked per thread, so concurrent requests of a threaded server
+(standalone/server.py) each flush their own line. Values recorded on a thread
+outside of a request, such as the init-phase prefetch, are added to the next
+line flushed.
+
+Metrics are only collected when TVM_METRICS is "true". When disabled, `timer`
+returns a shared no-op context manager and `count` returns right away.
+"""
+import os
+import json
+import time
+import threading
+import contextlib
+
+_NOOP = contextlib.nullcontext()
+
+
+class _Timer:
+    __slots__ = ('_metrics', '_name', '_start')
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics.record(self._name, (time.perf_counter() - self._start) * 1000, 'Milliseconds')
+        return False
+
+
+def _append(values, name, value, unit):
+    entry = values.get(name)
+    if entry is None:
+        values[name] = (unit, [value])
+    else:
+        entry[1].append(value)
+
+
+class Metrics:
+    def __init__(self, service, namespace=None, enabled=None):
+        """
+        Args:
+            service: Value of the Service dimension, e.g. "issuer"
+            namespace: CloudWatch namespace (default: TVM_METRICS_NAMESPACE or "TVM")
+            enabled: Collect metrics (default: TVM_METRICS == "true")
+        """
+        self.service = service
+        self.namespace = namespace or os.environ.get('TVM_METRICS_NAMESPACE', 'TVM')
+        self.enabled = os.environ.get('TVM_METRICS', 'false') == 'true' if enabled is None else enabled
+        self._cold_start = True
+        # Values and properties of the request running on each thread
+        self._request = threading.local()
+        # Values recorded outside of a request, e.g. by init-phase prefetch threads
+        self._background = {}
+        self._lock = threading.Lock()
+
+    def start_request(self):
+        """Start collecting the values of a request on the current thread."""
+        if self.enabled:
+            self._request.values = {}
+            self._request.properties = {}
+
+    def timer(self, name):
+        """Context manager recording the duration of its block in milliseconds under `name`."""
+        if not self.enabled:
+            return _NOOP
+        return _Timer(self, name)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.record(name, value, 'Count')
+
+    def record(self, name, value, unit='None'):
+        if not self.enabled:
+            return
+        values = getattr(self._request, 'values', None)
+        if values is None:
+            with self._lock:
+                _append(self._background, name, value, unit)
+        else:
+            _append(values, name, value, unit)
+
+    def set_property(self, name, value):
+        """Attach a searchable, non-metric value to the EMF line of the request, e.g. the route."""
+        if self.enabled:
+            properties = getattr(self._request, 'properties', None)
+            if properties is not None:
+                properties[name] = value
+
+    def flush(self):
+        """Print the metrics of the request on the current thread as one EMF line and end the request."""
+        if not self.enabled:
+            return
+        values = getattr(self._request, 'values', None) or {}
+        properties = getattr(self._request, 'properties', None) or {}
+        self._request.values = self._request.properties = None
+        with self._lock:
+            start = 'cold' if self._cold_start else 'warm'
+            self._cold_start = False
+            background, self._background = self._background, {}
+        for name, (unit, samples) in background.items():
+            for value in samples:
+                _append(values, name, value, unit)
+        if not values:
+            return
+
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Service'], ['Service', 'Start']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (unit, _) in values.items()]
+                }]
+            },
+            'Service': self.service,
+            'Start': start
+        }
+        document.update(properties)
+        for name, (_, samples) in values.items():
+            document[name] = samples[0] if len(samples) == 1 else samples
+        print(json.dumps(document))
@@ -4,8 +4,10 @@
 import json
 import boto3
 import os
+import time
 import uuid
-from cryptography.hazmat.primitives.asymmetric import rsa
+import datetime
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 
@@ -18,55 +20,203 @@ logger.setLevel(log_level)
 ssm_client = boto3.client('ssm')
 sts = boto3.client('sts')
 
+# JWS algorithms the key pair can be generated for
+SUPPORTED_ALGS = ('RS256', 'ES256', 'EdDSA')
+DEFAULT_ALG = os.environ.get('SIGNING_ALG', 'RS256')
+
+# Versioned key storage: every key pair lives under KEY_PARAM_PREFIX/<kid>/ and the
+# manifest lists the published keys, newest first
+KEY_MANIFEST_PARAM = os.environ.get('KEY_MANIFEST_PARAM', '/oidc/key_manifest')
+KEY_PARAM_PREFIX = os.environ.get('KEY_PARAM_PREFIX', '/oidc/keys')
+# Number of keys kept in the JWKS, the newest one plus previous ones still validating tokens
+DEFAULT_RETAINED_KEYS = 2
+# A rotated key is published this long before the issuer signs with it, so that
+# cached JWKS documents (max-age + issuer cache TTL) already contain it
+DEFAULT_ACTIVATION_DELAY = 3900
+
+# Parameters written by earlier versions of this function
+LEGACY_PARAMS = [
+    '/oidc/public_key',
+    '/oidc/private_key',
+    '/oidc/client_id',
+    '/oidc/client_secret'
+]
+
+def generate_private_key(alg):
+    """Generate a private key suitable for signing with the given JWS algorithm."""
+    if alg == 'RS256':
+        return rsa.generate_private_key(
+            public_exponent=65537,
+            key_size=2048,
+            backend=default_backend()
+        )
+    if alg == 'ES256':
+        return ec.generate_private_key(ec.SECP256R1(), backend=default_backend())
+    if alg == 'EdDSA':
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"Unsupported signing algorithm {alg}, expected one of {SUPPORTED_ALGS}")
+
+def get_signing_alg(properties):
+    return (properties or {}).get('SigningAlgorithm', DEFAULT_ALG)
+
+def get_rotation_id(properties):
+    return (properties or {}).get('RotationId', '')
+
+def private_key_param(kid):
+    return f"{KEY_PARAM_PREFIX}/{kid}/private_key"
+
+def public_key_param(kid):
+    return f"{KEY_PARAM_PREFIX}/{kid}/public_key"
+
+def load_manifest():
+    """Return the published keys, newest first, or an empty list before the first key exists."""
+    try:
+        response = ssm_client.get_parameter(Name=KEY_MANIFEST_PARAM)
+    except ssm_client.exceptions.ParameterNotFound:
+        return []
+    return json.loads(response['Parameter']['Value'])['keys']
+
+def save_manifest(keys):
+    ssm_client.put_parameter(
+        Name=KEY_MANIFEST_PARAM,
+        Value=json.dumps({'keys': keys}),
+        Type='String',
+        Overwrite=True
+    )
+
+def delete_parameters(names):
+    # DeleteParameters accepts at most 10 names per call
+    for i in range(0, len(names), 10):
+        ssm_client.delete_parameters(Names=names[i:i + 10])
+
+def create_key_pair(signing_alg):
+    """Generate a key pair, store it under a new kid and return that kid."""
+    kid = f"{datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+    logger.info(f"Generating {signing_alg} private key {kid}...")
+    private_key = generate_private_key(signing_alg)
+
+    # Serialize private key, RSA keeps the PKCS#1 format the issuer has always used
+    logger.info("Encrypting private key...")
+    private_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL if signing_alg == 'RS256' else serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+    # Serialize public key
+    logger.info("Generating public key for private key...")
+    public_key = private_key.public_key()
+    public_pem = public_key.public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    # Store the private key in SSM Parameter Store (encrypted)
+    logger.info("Storing encrypted private key into SSM Parameter store...")
+    ssm_client.put_parameter(
+        Name=private_key_param(kid),
+        Value=private_pem.decode('utf-8'),
+        Type='SecureString',
+        Overwrite=True
+    )
+
+    # The public key is published in the JWKS, no need to encrypt it
+    logger.info("Storing public key into SSM Parameter store...")
+    ssm_client.put_parameter(
+        Name=public_key_param(kid),
+        Value=public_pem.decode('utf-8'),
+        Type='String',
+        Overwrite=True
+    )
+    return kid
+
+def split_retired(keys, retained_keys, now):
+    """
+    Split the manifest (newest first) into the keys to keep and the keys to retire.
+    Keys not activated yet are always kept and do not count toward `retained_keys`,
+    so the key currently signing (the newest activated one, as the issuer picks it)
+    is never retired while its successor is still pending.
+    """
+    kept, retired = [], []
+    activated = 0
+    for key in keys:
+        if key.get('activates_at', 0) > now:
+            kept.append(key)
+        elif activated < retained_keys:
+            kept.append(key)
+            activated += 1
+        else:
+            retired.append(key)
+    return kept, retired
+
+def rotate_keys(signing_alg, retained_keys, activation_delay):
+    """
+    Add a new key pair in front of the manifest and drop the activated keys beyond
+    `retained_keys`. The new key only becomes the signing key after
+    `activation_delay` seconds, while the previous keys keep validating.
+    """
+    keys = load_manifest()
+    kid = create_key_pair(signing_alg)
+    now = int(time.time())
+    # The very first key has nothing to overlap with and is used right away
+    activates_at = now + (activation_delay if keys else 0)
+    keys.insert(0, {'kid': kid, 'alg': signing_alg, 'activates_at': activates_at})
+
+    save_retained(keys, retained_keys, now)
+    return kid
+
+def save_retained(keys, retained_keys, now):
+    """
+    Save the manifest without the activated keys beyond `retained_keys`, then
+    delete the retired key pairs. Issuers still holding the previous manifest
+    skip the kids whose public key is gone until their cache expires.
+    Returns the retired kids.
+    """
+    keys, retired = split_retired(keys, retained_keys, now)
+    save_manifest(keys)
+
+    if retired:
+        logger.info(f"Retiring keys {[key['kid'] for key in retired]}")
+        delete_parameters([name for key in retired for name in (private_key_param(key['kid']), public_key_param(key['kid']))])
+    return [key['kid'] for key in retired]
+
 def lambda_handler(event, context):
     logger.debug(json.dumps(event))
 
     request_type = event['RequestType']
+    properties = event.get('ResourceProperties') or {}
+    signing_alg = get_signing_alg(properties)
+    retained_keys = max(int(properties.get('RetainedKeys', DEFAULT_RETAINED_KEYS)), 1)
+    activation_delay = int(properties.get('ActivationDelaySeconds', DEFAULT_ACTIVATION_DELAY))
 
-    if request_type == "Create":   
+    # Rotate on update only when asked to (new RotationId) or when the signing algorithm changed,
+    # a changed RetainedKeys alone is applied to the existing keys
+    if request_type == "Update":
+        old_properties = event.get('OldResourceProperties')
+        unchanged = signing_alg == get_signing_alg(old_properties) and get_rotation_id(properties) == get_rotation_id(old_properties)
+        keys = load_manifest() if unchanged else []
+        if keys:
+            logger.info(f"Signing algorithm ({signing_alg}) and rotation id unchanged, keeping existing keys.")
+            try:
+                now = int(time.time())
+                if split_retired(keys, retained_keys, now)[1]:
+                    save_retained(keys, retained_keys, now)
+            except Exception as e:
+                return {
+                    'statusCode': 500,
+                    'body': json.dumps(f'Error retiring keys: {str(e)}')
+                }
+            return {
+                'statusCode': 200,
+                'body': json.dumps('Key pair unchanged.')
+            }
+
+    # "Rotate" can be sent by a direct or scheduled invocation outside of CloudFormation
+    if request_type in ("Create", "Update", "Rotate"):
         try:
-            logger.info("Generating private key...")
-            # Generate RSA Private Key
-            private_key = rsa.generate_private_key(
-                public_exponent=65537,
-                key_size=2048,
-                backend=default_backend()
-            )
-
-            # Serialize private key
-            logger.info("Encrypting private key...")
-            private_pem = private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.TraditionalOpenSSL,
-                encryption_algorithm=serialization.NoEncryption()
-            )
-
-            # Serialize public key
-            logger.info("Generating public key for private key...")
-            public_key = private_key.public_key()
-            public_pem = public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            )
-
-            # Store the private key in SSM Parameter Store (encrypted)
-            logger.info("Storing encrypted private key into SSM Parameter store...")
-            ssm_client.put_parameter(
-                Name='/oidc/private_key',
-                Value=private_pem.decode('utf-8'),
-                Type='SecureString',
-                Overwrite=True
-            )
-
-            # Store the public key in SSM Parameter Store (encrypted)
-            logger.info("Storing public key into SSM Parameter store...")
-            ssm_client.put_parameter(
-                Name='/oidc/public_key',
-                Value=public_pem.decode('utf-8'),
-                Type='SecureString',
-                Overwrite=True
-            )
-            
+            kid = rotate_keys(signing_alg, retained_keys, activation_delay)
+
             # account_id = sts.get_caller_identity()['Account']
             # client_id = f"oidc-tvm-{account_id}"
             # client_secret = uuid.uuid4().hex
@@ -88,10 +238,10 @@ def lambda_handler(event, context):
             #     Overwrite=True
             # )
 
-            logger.info('RSA key pair successfully generated and stored in SSM.')
+            logger.info(f'{signing_alg} key pair {kid} successfully generated and stored in SSM.')
             return {
                 'statusCode': 200,
-                'body': json.dumps('RSA key pair successfully generated and stored in SSM.')
+                'body': json.dumps(f'{signing_alg} key pair {kid} successfully generated and stored in SSM.')
             }
 
         except Exception as e:
@@ -99,20 +249,14 @@ def lambda_handler(event, context):
                 'statusCode': 500,
                 'body': json.dumps(f'Error generating or storing key: {str(e)}')
             }
-    
+
     if request_type == "Delete":
-        try:            
-            ssm_client.delete_parameters(
-                    Names=[
-                        '/oidc/public_key',
-                        '/oidc/private_key',
-                        '/oidc/client_id',
-                        '/oidc/client_secret'
-                    ]
-                )
-            logger.info('RSA key pair, client ID, and secret successfully deleted from SSM.')
+        try:
+            key_params = [name for key in load_manifest() for name in (private_key_param(key['kid']), public_key_param(key['kid']))]
+            delete_parameters(key_params + [KEY_MANIFEST_PARAM] + LEGACY_PARAMS)
+            logger.info('Signing keys, client ID, and secret successfully deleted from SSM.')
         except Exception as e:
             return {
                 'statusCode': 500,
                 'body': json.dumps(f'Error deleting key in parameter store: {str(e)}')
-            }
\ No newline at end of file
+            }
@@ -3,76 +3,289 @@
 
 import os
 import json
-import boto3
+import time
+import hmac
 import base64
-import logging
+import hashlib
+import threading
+from origin_matcher import OriginMatcher
+from tvm_common.log import RequestLogger
+from tvm_common.metrics import Metrics
 
-log_level = os.environ.get('LOG_LEVEL', 'DEBUG')
-logger = logging.getLogger(__name__)
-logger.setLevel(log_level)
+# JSON lines at LOG_LEVEL (default INFO), full events only at DEBUG or for LOG_SAMPLE_RATE of the requests
+log = RequestLogger(__name__, 'authorizer')
 
-ssm_client = boto3.client('ssm')
+# boto3 is the slowest import, it is imported when the first SSM call is made
+ssm_client = None
+_ssm_client_lock = threading.Lock()
+
+# Per-phase latencies and cache hits, emitted as CloudWatch EMF when TVM_METRICS is 'true'
+metrics = Metrics('authorizer')
 
 # SSM Parameter Name
 ALLOW_LIST_PARAM = os.getenv('OIDC_ALLOW_LIST')
+# SSM path holding the allow-list split over numbered parameters (<path>/0, <path>/1, ...), used instead of
+# OIDC_ALLOW_LIST when set so the list is not bound by the size of a single parameter
+ALLOW_LIST_PATH = os.getenv('OIDC_ALLOW_LIST_PATH')
 CLIENT_ID_PARAM = os.getenv("CLIENT_ID_PARAM")
 CLIENT_SECRET_PARAM = os.getenv("CLIENT_SECRET_PARAM")
+# JSON registry of backend clients with hashed secrets, replaces the single client id/secret pair when set
+CLIENT_REGISTRY_PARAM = os.getenv("CLIENT_REGISTRY_PARAM")
+# 'method' grants only the invoked method ARN, 'stage' grants every method of the API stage so
+# API Gateway can reuse a cached decision across routes (use with a resultsCacheTtl)
+POLICY_SCOPE = os.getenv('POLICY_SCOPE', 'method')
+# Seconds SSM values are reused across warm invocations before being refreshed
+CONFIG_CACHE_TTL = int(os.getenv('CONFIG_CACHE_TTL', '300'))
+# Fetch the client credentials and the allow-list concurrently during the init phase
+PREFETCH_ON_INIT = os.getenv('PREFETCH_ON_INIT', 'true') == 'true'
+# Seconds the init phase waits for the prefetch, Lambda allows 10 seconds of init
+PREFETCH_TIMEOUT = float(os.getenv('PREFETCH_TIMEOUT', '3'))
+
+# SSM values kept across warm invocations: {name: (value, expires_at)}, value None for a missing parameter
+_config_cache = {}
+_config_lock = threading.Lock()
+# Compiled allow-list as (SSM version, OriginMatcher, expires_at)
+_allow_list_cache = (None, None, 0.0)
+_allow_list_lock = threading.Lock()
+# Parsed client registry as (raw parameter value, {client_id: client})
+_client_registry_cache = (None, {})
+
+def get_ssm_client():
+    global ssm_client
+    if ssm_client is None:
+        with _ssm_client_lock:
+            if ssm_client is None:
+                import boto3
+                ssm_client = boto3.client('ssm')
+    return ssm_client
+
+def _fetch_parameters(names):
+    """Fetch `names` with a single GetParameters call and store them in the cache."""
+    with metrics.timer('SsmFetch'):
+        response = get_ssm_client().get_parameters(Names=list(names), WithDecryption=True)
+    expires_at = time.monotonic() + CONFIG_CACHE_TTL
+    for param in response['Parameters']:
+        _config_cache[param['Name']] = (param['Value'], expires_at)
+    if response.get('InvalidParameters'):
+        log.error('SSM parameters not found', parameters=response['InvalidParameters'])
+        # Cached as missing for the same TTL, so a missing parameter is not fetched on every request
+        for name in response['InvalidParameters']:
+            _config_cache[name] = (None, expires_at)
+
+def get_parameters(names):
+    """
+    Return {name: value} for `names` from the in-memory cache. Missing values are
+    fetched with one GetParameters call. Expired values are refreshed by a single
+    caller while concurrent callers keep using the previous value, which is also
+    kept if the refresh fails. Parameters SSM does not have are left out of the
+    result, and are only looked up again once their cache entry expires.
+    """
+    now = time.monotonic()
+    missing = [name for name in names if name not in _config_cache]
+    expired = [name for name in names if name in _config_cache and now >= _config_cache[name][1]]
+    metrics.count('ConfigCacheMiss' if missing or expired else 'ConfigCacheHit')
+
+    if missing:
+        with _config_lock:
+            missing = [name for name in names if name not in _config_cache]
+            if missing:
+                _fetch_parameters(missing + expired)
+    elif expired and _config_lock.acquire(blocking=False):
+        try:
+            _fetch_parameters(expired)
+        except Exception as e:
+            log.error('Error refreshing SSM parameters, serving cached values', error=str(e))
+        finally:
+            _config_lock.release()
+
+    return {name: _config_cache[name][0] for name in names if _config_cache.get(name, (None,))[0] is not None}
 
 def get_client_credentials():
-    client_id = ssm_client.get_parameter(Name=CLIENT_ID_PARAM)['Parameter']['Value']
-    client_secret = ssm_client.get_parameter(Name=CLIENT_SECRET_PARAM, WithDecryption=True)['Parameter']['Value']
-    return client_id, client_secret
+    """Return (client_id, client_secret), None for a parameter SSM did not return."""
+    values = get_parameters([CLIENT_ID_PARAM, CLIENT_SECRET_PARAM])
+    return values.get(CLIENT_ID_PARAM), values.get(CLIENT_SECRET_PARAM)
+
+def hash_client_secret(secret, salt=None):
+    """Return a registry secret hash in the form sha256$<salt hex>$<HMAC-SHA256(salt, secret) hex>."""
+    salt = salt or os.urandom(16).hex()
+    digest = hmac.new(bytes.fromhex(salt), secret.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"sha256${salt}${digest}"
+
+def get_client_registry():
+    """
+    Return {client_id: client} parsed from the registry parameter, re-parsed only
+    when the parameter value changes. The parameter holds
+    {"clients": {"<client_id>": {"secret_hash": "sha256$...", "allowed_email_domains": [...]}}}
+    Returns None when SSM did not return the parameter.
+    """
+    global _client_registry_cache
+    raw = get_parameters([CLIENT_REGISTRY_PARAM]).get(CLIENT_REGISTRY_PARAM)
+    if raw is None:
+        return None
+    cached_raw, registry = _client_registry_cache
+    if raw != cached_raw:
+        registry = {}
+        for client_id, client in json.loads(raw)['clients'].items():
+            # A malformed entry only denies that client
+            try:
+                _, salt, digest = client['secret_hash'].split('$')
+                registry[client_id] = {
+                    'salt': bytes.fromhex(salt),
+                    'digest': bytes.fromhex(digest),
+                    'allowed_email_domains': client.get('allowed_email_domains') or []
+                }
+            except (KeyError, TypeError, AttributeError, ValueError) as e:
+                log.error('Skipping malformed client registry entry', clientId=client_id, error=str(e))
+        _client_registry_cache = (raw, registry)
+    return registry
+
+def verify_client(client_id, client_secret):
+    """Return the registered client matching the credentials, or None. Secrets are compared in constant time."""
+    if not CLIENT_REGISTRY_PARAM:
+        stored_client_id, stored_client_secret = get_client_credentials()
+        if stored_client_id is None or stored_client_secret is None:
+            return None
+        if hmac.compare_digest(client_id.encode('utf-8'), stored_client_id.encode('utf-8')) and \
+                hmac.compare_digest(client_secret.encode('utf-8'), stored_client_secret.encode('utf-8')):
+            return {'allowed_email_domains': []}
+        return None
+
+    registry = get_client_registry()
+    if registry is None:
+        return None
+    client = registry.get(client_id)
+    if client is None:
+        return None
+    digest = hmac.new(client['salt'], client_secret.encode('utf-8'), hashlib.sha256).digest()
+    return client if hmac.compare_digest(digest, client['digest']) else None
+
+def _fetch_allow_list():
+    """Return (version, origin patterns) of the allow-list stored in SSM."""
+    if not ALLOW_LIST_PATH:
+        try:
+            param = get_ssm_client().get_parameter(Name=ALLOW_LIST_PARAM)['Parameter']
+        except get_ssm_client().exceptions.ParameterNotFound:
+            # Cached as an empty allow-list, like any fetched value
+            log.error('SSM parameters not found', parameters=[ALLOW_LIST_PARAM])
+            return None, []
+        return param['Version'], param['Value'].split(',')
+
+    chunks = []
+    kwargs = {'Path': ALLOW_LIST_PATH, 'Recursive': False}
+    while True:
+        response = get_ssm_client().get_parameters_by_path(**kwargs)
+        chunks.extend(response['Parameters'])
+        if not response.get('NextToken'):
+            break
+        kwargs['NextToken'] = response['NextToken']
+    chunks.sort(key=lambda param: int(param['Name'].rsplit('/', 1)[1]))
+    version = tuple((param['Name'], param['Version']) for param in chunks)
+    return version, [origin for param in chunks for origin in param['Value'].split(',')]
 
 # Fetch the allow-listed domains from SSM
 def get_allow_list():
+    """
+    Return the OriginMatcher for the allow-list, refreshed every CONFIG_CACHE_TTL
+    seconds and only recompiled when the SSM version changes. As for other
+    parameters, a single caller refreshes while the others keep the previous matcher.
+    """
+    global _allow_list_cache
+    version, matcher, expires_at = _allow_list_cache
+    if matcher is not None and time.monotonic() < expires_at:
+        metrics.count('AllowListCacheHit')
+        return matcher
+    metrics.count('AllowListCacheMiss')
+    if not _allow_list_lock.acquire(blocking=matcher is None):
+        return matcher
+
     try:
-        response = ssm_client.get_parameter(Name=ALLOW_LIST_PARAM)
-        allow_list = response['Parameter']['Value'].split(',')
-        return [domain.strip() for domain in allow_list]
-    except Exception as e:
-        logger.error(f"Error fetching allow-list: {str(e)}")
-        return []
+        version, matcher, expires_at = _allow_list_cache
+        if matcher is not None and time.monotonic() < expires_at:
+            return matcher
+        try:
+            with metrics.timer('AllowListFetch'):
+                new_version, patterns = _fetch_allow_list()
+        except Exception as e:
+            log.error('Error fetching allow-list', error=str(e))
+            return matcher or OriginMatcher()
+
+        if matcher is None or new_version != version:
+            matcher = OriginMatcher(patterns)
+            log.info('Compiled allow-list', entries=len(matcher))
+        _allow_list_cache = (new_version, matcher, time.monotonic() + CONFIG_CACHE_TTL)
+        return matcher
+    finally:
+        _allow_list_lock.release()
 
 def lambda_handler(event, context):
-    logger.debug(json.dumps(event))
+    log.start_request(event, context)
+    metrics.start_request()
+    try:
+        with metrics.timer('Request'):
+            return authorize(event)
+    finally:
+        metrics.flush()
+
+def authorize(event):
+    log.payload('Request event', event)
     method_arn = event['methodArn']
     # path = event['requestContext']['resourcePath']
     headers = event.get('headers', {})
     origin = headers.get('origin')  # Get the Origin header
     auth_header = headers.get('Authorization')  # Get the Authorization header
-    
-    logger.info(f"Request origin: {origin}")
 
-    if event['httpMethod'] == 'OPTIONS':
-        return generate_policy("Allow", method_arn)
+    resource = get_policy_resource(method_arn)
 
-    allow_list = get_allow_list()
-    stored_client_id, stored_client_secret = get_client_credentials()
+    if event['httpMethod'] == 'OPTIONS':
+        return generate_policy("Allow", resource, "preflight", {'callerType': 'preflight'})
 
-    if origin in allow_list:
+    if origin in get_allow_list():
         # Scenario 1: Allow-listed origin, allow the request without checking credentials
-        logger.info("Request from authorized domain...")
-        return generate_policy("Allow", method_arn)
+        log.info('Allowed origin', origin=origin)
+        return generate_policy("Allow", resource, f"origin:{origin}", {'callerType': 'origin', 'origin': origin})
 
     elif auth_header and auth_header.startswith("Basic "):
         # Scenario 2: Backend caller with client ID and secret in the header
-        logger.info("Request from unauthorized domain...checking client ID and secret")
-        encoded_credentials = auth_header.split(' ')[1]
-        decoded_credentials = base64.b64decode(encoded_credentials).decode('utf-8')
-        client_id, client_secret = decoded_credentials.split(':')
+        try:
+            encoded_credentials = auth_header.split(' ')[1]
+            decoded_credentials = base64.b64decode(encoded_credentials).decode('utf-8')
+            client_id, client_secret = decoded_credentials.split(':', 1)
+        except ValueError:
+            log.info('Malformed Basic authorization header', origin=origin)
+            return generate_policy("Deny", resource)
 
-        if client_id == stored_client_id and client_secret == stored_client_secret:
-            return generate_policy("Allow", method_arn)
+        # Credentials are only looked up when a Basic header is present
+        with metrics.timer('ClientVerify'):
+            client = verify_client(client_id, client_secret)
+        if client is not None:
+            caller = {'callerType': 'client', 'clientId': client_id}
+            if client['allowed_email_domains']:
+                # Enforced by the issuer, the authorizer does not see the request body
+                caller['allowedEmailDomains'] = ','.join(client['allowed_email_domains'])
+            log.info('Allowed client', clientId=client_id, origin=origin)
+            return generate_policy("Allow", resource, f"client:{client_id}", caller)
         else:
-            return generate_policy("Deny", method_arn)
+            log.info('Denied client', clientId=client_id, origin=origin)
+            return generate_policy("Deny", resource)
 
     # Deny the request if neither allow-listed origin nor valid credentials are provided
-    return generate_policy("Deny", method_arn)
+    log.info('Denied request', origin=origin)
+    return generate_policy("Deny", resource)
 
-def generate_policy(effect, resource):
-    """Generate an IAM policy."""
+def get_policy_resource(method_arn):
+    """
+    Resource the policy applies to. methodArn looks like
+    arn:aws:execute-api:{region}:{account}:{api_id}/{stage}/{verb}/{path}
+    """
+    if POLICY_SCOPE == 'stage':
+        api_arn, stage = method_arn.split('/')[:2]
+        return f"{api_arn}/{stage}/*"
+    return method_arn
+
+def generate_policy(effect, resource, principal_id="user", context=None):
+    """Generate an IAM policy, `context` is passed to the integration as requestContext.authorizer."""
     policy = {
-        "principalId": "user",
+        "principalId": principal_id,
         "policyDocument": {
             "Version": "2012-10-17",
             "Statement": [
@@ -84,4 +297,33 @@ def generate_policy(effect, resource):
             ]
         }
     }
-    return policy
\ No newline at end of file
+    if context:
+        policy["context"] = context
+    return policy
+
+def _prefetch_client_credentials():
+    try:
+        with metrics.timer('Prefetch'):
+            get_parameters([CLIENT_REGISTRY_PARAM] if CLIENT_REGISTRY_PARAM else [CLIENT_ID_PARAM, CLIENT_SECRET_PARAM])
+    except Exception as e:
+        log.warning('Client credentials prefetch failed', error=str(e))
+
+def prefetch():
+    """
+    Fetch the client credentials (or registry) and the allow-list into the warm
+    caches concurrently, and wait for both before the init phase ends: Lambda
+    freezes the environment after init, a fetch still running would only resume
+    with the first request. Waits at most PREFETCH_TIMEOUT seconds, requests
+    arriving before a slower fetch completes wait on the cache locks.
+    """
+    fetches = [threading.Thread(target=target, daemon=True) for target in (_prefetch_client_credentials, get_allow_list)]
+    for fetch in fetches:
+        fetch.start()
+    deadline = time.monotonic() + PREFETCH_TIMEOUT
+    for fetch in fetches:
+        fetch.join(max(deadline - time.monotonic(), 0))
+    if any(fetch.is_alive() for fetch in fetches):
+        log.warning('Prefetch still running at the end of init', timeout=PREFETCH_TIMEOUT)
+
+if PREFETCH_ON_INIT:
+    prefetch()
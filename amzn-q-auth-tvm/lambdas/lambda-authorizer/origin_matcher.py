@@ -0,0 +1,67 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import re
+from urllib.parse import urlsplit
+
+# Host names and an optional port, as browsers serialize them in the Origin header
+_HOST = re.compile(r'[a-z0-9-]+(\.[a-z0-9-]+)*(:[0-9]+)?')
+
+class OriginMatcher:
+    """
+    Precompiled allow-list of request origins.
+
+    Exact entries such as `https://www.example.com` go in a hash set. Wildcard
+    entries such as `https://*.customer.example.com` are stored as
+    (scheme, `.customer.example.com`) pairs and matched by looking up each
+    parent domain of the request host, so a lookup costs one hash probe per
+    label of the origin no matter how many entries the allow-list has. A
+    wildcard matches subdomains at any depth but not the bare domain itself,
+    and a port in the pattern must match the port of the origin. Only origins
+    made of a scheme and a plain host name (no userinfo, path, query or
+    fragment) are matched against wildcards, so `https://evil.com/.x.example.com`
+    does not match `https://*.x.example.com`.
+    """
+
+    def __init__(self, patterns=()):
+        self._exact = set()
+        self._wildcards = set()
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern):
+        pattern = pattern.strip().rstrip('/').lower()
+        if not pattern:
+            return
+        scheme, _, host = pattern.partition('://')
+        if host.startswith('*.'):
+            self._wildcards.add((scheme, host[1:]))
+        else:
+            self._exact.add(pattern)
+
+    def matches(self, origin):
+        if not origin:
+            return False
+        origin = origin.lower()
+        if origin in self._exact:
+            return True
+        if not self._wildcards:
+            return False
+
+        try:
+            parts = urlsplit(origin)
+        except ValueError:
+            return False
+        if parts.path or parts.query or parts.fragment or not _HOST.fullmatch(parts.netloc):
+            return False
+        scheme, host = parts.scheme, parts.netloc
+        dot = host.find('.')
+        while dot != -1:
+            if (scheme, host[dot:]) in self._wildcards:
+                return True
+            dot = host.find('.', dot + 1)
+        return False
+
+    __contains__ = matches
+
+    def __len__(self):
+        return len(self._exact) + len(self._wildcards)
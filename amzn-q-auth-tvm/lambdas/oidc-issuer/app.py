@@ -3,40 +3,183 @@
 
 import json
 import os
-import boto3
+import time
+import hashlib
+import threading
+import collections
 import datetime
-import logging
-from authlib.jose import jwt, JsonWebKey
+from tvm_common.log import RequestLogger
+from tvm_common.metrics import Metrics
 
-log_level = os.environ.get('LOG_LEVEL', 'DEBUG')
-logger = logging.getLogger(__name__)
-logger.setLevel(log_level)
+# JSON lines at LOG_LEVEL (default INFO), full events only at DEBUG or for LOG_SAMPLE_RATE of the requests
+log = RequestLogger(__name__, 'issuer')
 
 # Fetch environment variables
-PRIVATE_KEY_PARAM = os.getenv('PRIVATE_KEY_PARAM')
-PUBLIC_KEY_PARAM = os.getenv('PUBLIC_KEY_PARAM')
-KID = os.getenv('KID')
+KEY_MANIFEST_PARAM = os.getenv('KEY_MANIFEST_PARAM', '/oidc/key_manifest')
+KEY_PARAM_PREFIX = os.getenv('KEY_PARAM_PREFIX', '/oidc/keys')
 REGION = os.getenv('REGION')
 AUDIENCE = os.getenv('AUDIENCE')
+# Fixed issuer URL, e.g. behind a load balancer; by default it is derived from the API Gateway domain and stage
+ISSUER_URL = os.getenv('ISSUER_URL')
+# Seconds the key manifest and a parsed signing key are reused before being re-read from SSM (0 disables caching)
+KEY_CACHE_TTL = int(os.getenv('KEY_CACHE_TTL', '300'))
+# Maximum number of emails accepted by a single /token/batch request
+BATCH_TOKEN_LIMIT = int(os.getenv('BATCH_TOKEN_LIMIT', '100'))
+# Cache-Control max-age advertised for the discovery and JWKS documents
+WELL_KNOWN_MAX_AGE = int(os.getenv('WELL_KNOWN_MAX_AGE', '3600'))
+# Load the signing key during the init phase, overlapping with the authlib import, so the first request does not wait for SSM
+PREFETCH_ON_INIT = os.getenv('PREFETCH_ON_INIT', 'true') == 'true'
+# Seconds the init phase waits for the prefetch, Lambda allows 10 seconds of init
+PREFETCH_TIMEOUT = float(os.getenv('PREFETCH_TIMEOUT', '3'))
 
-ssm_client = boto3.client('ssm')
+# boto3 and authlib are the slowest imports, they are imported on first use (see get_ssm_client and get_jose)
+ssm_client = None
+_ssm_client_lock = threading.Lock()
+_jose = None
+
+# Per-phase latencies and cache hits, emitted as CloudWatch EMF when TVM_METRICS is 'true'
+metrics = Metrics('issuer')
+
+SigningKey = collections.namedtuple('SigningKey', ['kid', 'alg', 'key'])
+
+# Key manifest kept across warm invocations: (keys, version, expires_at)
+_manifest_cache = (None, None, 0.0)
+_manifest_lock = threading.Lock()
+
+# Parsed signing key kept across warm invocations: (signing_key, expires_at)
+_signing_key_cache = (None, 0.0)
+_signing_key_lock = threading.Lock()
+
+# Rendered well-known documents as (body, etag); JWKS is keyed by manifest version
+_discovery_cache = {}
+_jwks_cache = (None, None, None)
+
+def get_ssm_client():
+    global ssm_client
+    if ssm_client is None:
+        with _ssm_client_lock:
+            if ssm_client is None:
+                import boto3
+                ssm_client = boto3.client('ssm')
+    return ssm_client
+
+def get_jose():
+    """authlib.jose, imported on first use."""
+    global _jose
+    if _jose is None:
+        from authlib import jose
+        _jose = jose
+    return _jose
+
+def get_key_manifest():
+    """
+    Return the published keys (newest first) and the SSM version of the
+    manifest written by key-gen, cached for KEY_CACHE_TTL.
+    """
+    global _manifest_cache
+    keys, version, expires_at = _manifest_cache
+    if keys is not None and time.monotonic() < expires_at:
+        metrics.count('KeyManifestCacheHit')
+        return keys, version
+
+    with _manifest_lock:
+        keys, version, expires_at = _manifest_cache
+        if keys is not None and time.monotonic() < expires_at:
+            metrics.count('KeyManifestCacheHit')
+            return keys, version
+
+        metrics.count('KeyManifestCacheMiss')
+        with metrics.timer('KeyManifestFetch'):
+            response = get_ssm_client().get_parameter(Name=KEY_MANIFEST_PARAM)
+        keys = json.loads(response['Parameter']['Value'])['keys']
+        version = response['Parameter']['Version']
+        _manifest_cache = (keys, version, time.monotonic() + KEY_CACHE_TTL)
+        return keys, version
+
+def get_active_kid(keys):
+    """Newest key whose activation time has passed; rotated keys are published before they sign."""
+    now = time.time()
+    for key in keys:
+        if key.get('activates_at', 0) <= now:
+            return key['kid']
+    return keys[-1]['kid']
 
 # Fetch private and public keys from SSM
-def get_private_key():
-    response = ssm_client.get_parameter(Name=PRIVATE_KEY_PARAM, WithDecryption=True)
+def get_private_key(kid):
+    # SSM read and KMS decryption of the SecureString
+    with metrics.timer('PrivateKeyFetch'):
+        response = get_ssm_client().get_parameter(Name=f"{KEY_PARAM_PREFIX}/{kid}/private_key", WithDecryption=True)
     return response['Parameter']['Value']
 
-def get_public_key():
-    response = ssm_client.get_parameter(Name=PUBLIC_KEY_PARAM, WithDecryption=True)
-    return response['Parameter']['Value']
+def get_public_keys(kids):
+    """Return {kid: public key PEM} for all `kids` with a single SSM call."""
+    names = {f"{KEY_PARAM_PREFIX}/{kid}/public_key": kid for kid in kids}
+    with metrics.timer('PublicKeysFetch'):
+        response = get_ssm_client().get_parameters(Names=list(names))
+    return {names[param['Name']]: param['Value'] for param in response['Parameters']}
+
+def get_signing_alg(key):
+    """Map an imported key to the JWS algorithm it signs with."""
+    if key.kty == 'RSA':
+        return 'RS256'
+    if key.kty == 'EC' and key.tokens.get('crv') == 'P-256':
+        return 'ES256'
+    if key.kty == 'OKP' and key.tokens.get('crv') == 'Ed25519':
+        return 'EdDSA'
+    raise ValueError(f"Unsupported signing key type {key.kty}")
+
+def get_signing_key(kid=None):
+    """
+    Return the imported private key for `kid` (the active key by default),
+    served from the in-memory cache while it is younger than KEY_CACHE_TTL.
+    A different `kid`, e.g. after a rotation, forces a reload.
+    """
+    global _signing_key_cache
+    if kid is None:
+        kid = get_active_kid(get_key_manifest()[0])
+
+    signing_key, expires_at = _signing_key_cache
+    if signing_key is not None and signing_key.kid == kid and time.monotonic() < expires_at:
+        metrics.count('SigningKeyCacheHit')
+        return signing_key
+
+    with _signing_key_lock:
+        # Another thread may have refreshed the key while we waited on the lock
+        signing_key, expires_at = _signing_key_cache
+        if signing_key is not None and signing_key.kid == kid and time.monotonic() < expires_at:
+            metrics.count('SigningKeyCacheHit')
+            return signing_key
+
+        metrics.count('SigningKeyCacheMiss')
+        log.info('Loading signing key from SSM', kid=kid)
+        private_key = get_private_key(kid)
+        with metrics.timer('SigningKeyImport'):
+            key = get_jose().JsonWebKey.import_key(private_key, {'kid': kid})
+        signing_key = SigningKey(kid, get_signing_alg(key), key)
+        _signing_key_cache = (signing_key, time.monotonic() + KEY_CACHE_TTL)
+        return signing_key
 
 def lambda_handler(event, context):    
+    log.start_request(event, context)
+    metrics.start_request()
+    try:
+        with metrics.timer('Request'):
+            return route(event)
+    finally:
+        metrics.flush()
+
+def route(event):
     path = event['requestContext']['resourcePath']
-    logger.info(f"Endpoint: {path}")
-    logger.debug(json.dumps(event))
+    metrics.set_property('Path', path)
+    # Context returned by the Lambda authorizer, absent on the public well-known routes
+    caller = event['requestContext'].get('authorizer') or {}
+    log.info('Request', path=path, callerType=caller.get('callerType'), clientId=caller.get('clientId'))
+    log.payload('Request event', event)
 
     if path == '/token':
         return handle_token(event)
+    elif path == '/token/batch':
+        return handle_token_batch(event)
     elif path == '/.well-known/openid-configuration':
         return handle_openid_configuration(event)
     elif path == '/.well-known/jwks.json':
@@ -48,13 +191,16 @@ def lambda_handler(event, context):
         }
 
 def handle_token(event):
-    try:                
-        body = json.loads(event['body'])
+    try:
+        body = _parse_body(event)
+        if body is None:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'request body must be a JSON object'})
+            }
         email = body.get('email')
 
-        domain = event['requestContext']['domainName']
-        stage = event['requestContext']['stage']
-        issuer_url = f"https://{domain}/{stage}"
+        issuer_url = get_issuer_url(event)
 
         if not email:
             return {
@@ -62,31 +208,76 @@ def handle_token(event):
                 'body': json.dumps({'error': 'email parameter is required'})
             }
 
-        private_key = get_private_key()
-
-        # Create token claims
-        claims = {
-            "sub": email,
-            "aud": AUDIENCE,
-            "iss": issuer_url,
-            "iat": datetime.datetime.now(datetime.timezone.utc),
-            "exp": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1),
-            "email": email,
-            "https://aws.amazon.com/tags": {
-                "principal_tags": {
-                    "Email": [email]
-                }
+        if not is_email_allowed(email, get_allowed_email_domains(event)):
+            return {
+                'statusCode': 403,
+                'body': json.dumps({'error': 'email domain is not allowed for this client'})
             }
+
+        signing_key = get_signing_key()
+        token = mint_token(email, issuer_url, signing_key)
+        return {
+            'isBase64Encoded': False,
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': '*',
+                'Access-Control-Allow-Methods': '*',
+                'Content-Type': 'application/json'
+            },
+            'body': json.dumps({'id_token': token})
         }
 
-        # Encode JWT with RS256
-        header = {
-            "alg": "RS256",
-            "kid": KID,
-            "typ": "JWS"
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
         }
 
-        token = jwt.encode(header=header, payload=claims, key=private_key)
+def handle_token_batch(event):
+    try:
+        body = _parse_body(event)
+        if body is None:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'request body must be a JSON object'})
+            }
+        emails = body.get('emails')
+
+        issuer_url = get_issuer_url(event)
+
+        if not emails or not isinstance(emails, list):
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'emails parameter must be a non-empty list'})
+            }
+        if len(emails) > BATCH_TOKEN_LIMIT:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': f'at most {BATCH_TOKEN_LIMIT} emails are allowed per batch'})
+            }
+
+        # One key load for the whole batch
+        signing_key = get_signing_key()
+        allowed_domains = get_allowed_email_domains(event)
+        tokens = {}
+        errors = {}
+        for email in emails:
+            if not email or not isinstance(email, str):
+                errors[str(email)] = 'email must be a non-empty string'
+                continue
+            if email in tokens:
+                continue
+            if not is_email_allowed(email, allowed_domains):
+                errors[email] = 'email domain is not allowed for this client'
+                continue
+            try:
+                tokens[email] = mint_token(email, issuer_url, signing_key)
+            except Exception as e:
+                log.error('Failed to mint token in batch', email=email, error=str(e))
+                errors[email] = str(e)
+
+        log.info('Batch minted', tokens=len(tokens), errors=len(errors))
         return {
             'isBase64Encoded': False,
             'statusCode': 200,
@@ -96,7 +287,7 @@ def handle_token(event):
                 'Access-Control-Allow-Methods': '*',
                 'Content-Type': 'application/json'
             },
-            'body': json.dumps({'id_token': token.decode('utf-8')})
+            'body': json.dumps({'tokens': tokens, 'errors': errors})
         }
 
     except Exception as e:
@@ -105,46 +296,187 @@ def handle_token(event):
             'body': json.dumps({'error': str(e)})
         }
 
-def handle_openid_configuration(event):
+def _parse_body(event):
+    """Return the JSON object sent as the request body, or None when the body is missing, invalid or not an object."""
+    try:
+        body = json.loads(event.get('body') or '')
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+def get_issuer_url(event):
+    if ISSUER_URL:
+        return ISSUER_URL
     domain = event['requestContext']['domainName']
     stage = event['requestContext']['stage']
-    issuer_url = f"https://{domain}/{stage}"
-
-    openid_config = {
-        "issuer": issuer_url,  # Dynamic issuer
-        "jwks_uri": f"{issuer_url}/.well-known/jwks.json",  # JWKS URI
-        "response_types_supported": ["id_token"],
-        "subject_types_supported": ["public"],
-        "id_token_signing_alg_values_supported": ["RS256"]
+    return f"https://{domain}/{stage}"
+
+def get_allowed_email_domains(event):
+    """Email domains the calling client is restricted to, as set by the Lambda authorizer, or None."""
+    caller = event['requestContext'].get('authorizer') or {}
+    domains = caller.get('allowedEmailDomains')
+    if not domains:
+        return None
+    return {domain.strip().lower() for domain in domains.split(',')}
+
+def is_email_allowed(email, allowed_domains):
+    if allowed_domains is None:
+        return True
+    return email.rpartition('@')[2].lower() in allowed_domains
+
+def mint_token(email, issuer_url, signing_key):
+    """Sign an ID token for `email` with a SigningKey and return it as a string."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    # Create token claims
+    claims = {
+        "sub": email,
+        "aud": AUDIENCE,
+        "iss": issuer_url,
+        "iat": now,
+        "exp": now + datetime.timedelta(hours=1),
+        "email": email,
+        "https://aws.amazon.com/tags": {
+            "principal_tags": {
+                "Email": [email]
+            }
+        }
     }
-    return {
-        'isBase64Encoded': False,
-        'statusCode': 200,
-        'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': '*',
-            'Access-Control-Allow-Methods': '*',
-            'Content-Type': 'application/json'
-        },
-        'body': json.dumps(openid_config)
+
+    # Sign with the algorithm matching the stored key type
+    header = {
+        "alg": signing_key.alg,
+        "kid": signing_key.kid,
+        "typ": "JWS"
     }
 
+    with metrics.timer('TokenSigning'):
+        token = get_jose().jwt.encode(header=header, payload=claims, key=signing_key.key)
+    return token.decode('utf-8')
+
+def handle_openid_configuration(event):
+    issuer_url = get_issuer_url(event)
+
+    # Advertise every algorithm still published, a key rotation may switch algorithms
+    keys, _ = get_key_manifest()
+    algs = tuple(sorted({key['alg'] for key in keys}))
+
+    # The document only depends on the issuer URL and algorithms, so it is rendered once per pair
+    cached = _discovery_cache.get((issuer_url, algs))
+    if cached is None:
+        openid_config = {
+            "issuer": issuer_url,  # Dynamic issuer
+            "jwks_uri": f"{issuer_url}/.well-known/jwks.json",  # JWKS URI
+            "response_types_supported": ["id_token"],
+            "subject_types_supported": ["public"],
+            "id_token_signing_alg_values_supported": list(algs)
+        }
+        cached = _render_document(openid_config)
+        _discovery_cache[(issuer_url, algs)] = cached
+
+    body, etag = cached
+    return _well_known_response(event, body, etag)
+
 def handle_jwks(event):
-    public_key = get_public_key()
-    
-    # Convert public key to JWKS format
-    jwk = JsonWebKey.import_key(public_key, {'kid': KID, 'alg': 'RS256', 'use': 'sig'})
-    jwks = {
-        "keys": [jwk.as_dict()]
+    global _jwks_cache
+    keys, version = get_key_manifest()
+    cached_version, body, etag = _jwks_cache
+    # Only re-import and re-serialize when key-gen published a new manifest
+    if body is None or cached_version != version:
+        metrics.count('JwksCacheMiss')
+        log.info('Rendering JWKS', manifestVersion=version)
+        public_keys = get_public_keys([key['kid'] for key in keys])
+
+        # Convert public keys to JWKS format, newest key first
+        jwks = {"keys": []}
+        for key in keys:
+            # key-gen deletes retired keys right after saving the manifest, a cached manifest may still list them
+            if key['kid'] not in public_keys:
+                log.warning('Public key not found, skipping it in the JWKS', kid=key['kid'], manifestVersion=version)
+                continue
+            jwk = get_jose().JsonWebKey.import_key(public_keys[key['kid']], {'kid': key['kid'], 'use': 'sig'})
+            jwks["keys"].append(dict(jwk.as_dict(), alg=key['alg']))
+        body, etag = _render_document(jwks)
+        _jwks_cache = (version, body, etag)
+    else:
+        metrics.count('JwksCacheHit')
+
+    return _well_known_response(event, body, etag)
+
+def _render_document(document):
+    """Serialize a well-known document once and derive its strong ETag."""
+    body = json.dumps(document)
+    etag = '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+    return body, etag
+
+def _get_header(event, name):
+    """Case-insensitive lookup of a request header."""
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+def _etag_matches(if_none_match, etag):
+    """
+    Whether an If-None-Match header matches `etag`: the header is a comma-separated
+    list or '*', and tags are compared weakly, so W/"..." from proxies and CDNs matches.
+    """
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in candidates or etag.removeprefix('W/') in candidates
+
+def _well_known_response(event, body, etag):
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Headers': '*',
+        'Access-Control-Allow-Methods': '*',
+        'Content-Type': 'application/json',
+        'Cache-Control': f'public, max-age={WELL_KNOWN_MAX_AGE}',
+        'ETag': etag
     }
+
+    if _etag_matches(_get_header(event, 'If-None-Match'), etag):
+        return {
+            'isBase64Encoded': False,
+            'statusCode': 304,
+            'headers': headers,
+            'body': ''
+        }
+
     return {
         'isBase64Encoded': False,
         'statusCode': 200,
-        'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': '*',
-            'Access-Control-Allow-Methods': '*',
-            'Content-Type': 'application/json'
-        },
-        'body': json.dumps(jwks)
+        'headers': headers,
+        'body': body
     }
+
+def _prefetch_signing_key():
+    try:
+        with metrics.timer('Prefetch'):
+            get_signing_key()
+    except Exception as e:
+        # The first request fetches the key again and reports the error
+        log.warning('Signing key prefetch failed', error=str(e))
+
+def prefetch():
+    """
+    Fetch the key manifest and the active signing key into the warm caches while
+    authlib is imported, and wait for both before the init phase ends: Lambda
+    freezes the environment after init, a fetch still running would only resume
+    with the first request. Waits at most PREFETCH_TIMEOUT seconds, requests
+    arriving before a slower fetch completes wait on the cache locks.
+    """
+    # Imports hold the GIL, only the SSM round trips overlap with the authlib import,
+    # so boto3 is imported before the fetch starts
+    get_ssm_client()
+    fetch = threading.Thread(target=_prefetch_signing_key, daemon=True)
+    fetch.start()
+    get_jose()
+    fetch.join(PREFETCH_TIMEOUT)
+    if fetch.is_alive():
+        log.warning('Signing key prefetch still running at the end of init', timeout=PREFETCH_TIMEOUT)
+
+if PREFETCH_ON_INIT:
+    prefetch()
@@ -1,276 +1,391 @@
 import time      
+import json
 import logging
 import os
 import boto3
 import cfnresponse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from checkpoint import ProvisioningCheckpoint
+from poller import deadline_from_context, poll_until_terminal
+from taskgraph import TaskGraph, TaskGraphError
+from sync_monitor import SyncJobMonitor, emit_metrics
 
 qbusiness_client = boto3.client('qbusiness') 
+ssm_client = boto3.client('ssm')
 logger = logging.getLogger(__name__)   
+log_level = os.environ.get('LOG_LEVEL', 'INFO')
+logger.setLevel(log_level)
+# Polling progress, time-to-ACTIVE and step durations are logged by these modules
+logging.getLogger('poller').setLevel(log_level)
+logging.getLogger('taskgraph').setLevel(log_level)
 
-MAX_RETRIES=25
-DELAY=25
+# SSM path under which the progress of each provisioning request is checkpointed
+CHECKPOINT_PARAM_PREFIX = os.environ.get('CHECKPOINT_PARAM_PREFIX', '/q-biz/provisioning')
+# 'true' when a CDK Provider isComplete handler finishes the waits: invocations poll each
+# resource once instead of blocking until it is ACTIVE
+ASYNC_COMPLETION = os.environ.get('Q_BIZ_ASYNC_COMPLETION', 'false') == 'true'
+# 'true' to follow the initial syncs and emit their ingestion throughput as CloudWatch metrics
+MONITOR_SYNC = os.environ.get('Q_BIZ_MONITOR_SYNC', 'false') == 'true'
 
-def wait_for_all_data_sources(application_id, index_id, data_sources):          
-  max_retries=MAX_RETRIES 
-  delay=DELAY
+# Adaptive polling: first check after POLL_INITIAL_DELAY seconds, backing off up to POLL_MAX_DELAY
+POLL_INITIAL_DELAY=float(os.environ.get('POLL_INITIAL_DELAY', '2'))
+POLL_MAX_DELAY=float(os.environ.get('POLL_MAX_DELAY', '30'))
+# Seconds kept before the Lambda timeout to report the result to CloudFormation
+DEADLINE_MARGIN=float(os.environ.get('DEADLINE_MARGIN', '30'))
 
-  def wait_for_data_source(data_source_id):
-    for attempt in range(max_retries):
+def wait_for_data_source(application_id, index_id, data_source_id, deadline):
+  return poll_until_terminal(
+      lambda: qbusiness_client.get_data_source(
+          applicationId=application_id,
+          indexId=index_id,
+          dataSourceId=data_source_id
+      )['status'],
+      f"Data source {data_source_id}",
+      deadline,
+      initial_delay=POLL_INITIAL_DELAY,
+      max_delay=POLL_MAX_DELAY
+  )
+
+
+def wait_for_index_completion(application_id, index_id, deadline):          
+  return poll_until_terminal(
+      lambda: qbusiness_client.get_index(applicationId=application_id, indexId=index_id)['status'],
+      f"Index {index_id}",
+      deadline,
+      initial_delay=POLL_INITIAL_DELAY,
+      max_delay=POLL_MAX_DELAY
+  )
+
+def s3_data_source_config(bucket_name):
+    return {
+        "type": "S3",
+        "syncMode": "FULL_CRAWL",
+        "connectionConfiguration": {
+            "repositoryEndpointMetadata": {
+                "BucketName": bucket_name
+            }
+        },
+        "repositoryConfigurations": {
+            "document": {
+                "fieldMappings": [
+                  {
+                    "indexFieldName": "document_content",
+                    "indexFieldType": "STRING",
+                    "dataSourceFieldName": "content"
+                  }
+                ]
+            }
+        }
+    }
+
+def webcrawler_data_source_config(seed_urls):
+    seedUrls = [{"seedUrl": i} for i in seed_urls]
+    return {
+          "type": "WEBCRAWLERV2",
+          "syncMode": "FULL_CRAWL",
+          "connectionConfiguration": {
+            "repositoryEndpointMetadata": {      
+              "seedUrlConnections": seedUrls,
+              "authentication": "NoAuthentication"
+            }
+          },
+          "repositoryConfigurations": {
+            "webPage": {
+              "fieldMappings": [
+                {
+                  "indexFieldName": "title",
+                  "indexFieldType": "STRING",
+                  "dataSourceFieldName": "page_title",
+                  "dateFieldFormat": "yyyy-MM-dd'T'HH:mm:ss'Z'"
+                }
+              ]
+            },
+            "attachment": {
+              "fieldMappings": [
+                {
+                  "indexFieldName": "attachment_title",
+                  "indexFieldType": "STRING",
+                  "dataSourceFieldName": "attachment_name",
+                  "dateFieldFormat": "yyyy-MM-dd'T'HH:mm:ss'Z'"
+                }
+              ]
+            }
+          },
+          "additionalProperties": {
+            "rateLimit": "300",
+            "maxFileSize": "50",
+            "crawlDepth": "1",
+            "maxLinksPerUrl": "1",
+            "crawlSubDomain": "true",
+            "crawlAllDomain": "true",
+            "honorRobots": "true"
+          }
+        }
+
+def get_data_sources():
+    """
+    Data sources to create, as a list of {"name", "configuration", "syncSchedule"}.
+    Q_BIZ_DATA_SOURCES holds that list as JSON, otherwise an S3 source over
+    Q_BIZ_S3_SOURCE_BKT and a web crawler over Q_BIZ_SEED_URL are created.
+    """
+    configured = os.environ.get('Q_BIZ_DATA_SOURCES', '')
+    if configured:
+        return json.loads(configured)
+
+    data_sources = []
+    s3_bucket_name = os.environ.get('Q_BIZ_S3_SOURCE_BKT', '')
+    if s3_bucket_name:
+        data_sources.append({'name': 'S3DataSource', 'configuration': s3_data_source_config(s3_bucket_name)})
+    webcrawler_seed_urls = [url for url in os.environ.get('Q_BIZ_SEED_URL', '').split(",") if url]
+    if webcrawler_seed_urls:
+        data_sources.append({'name': 'WebCrawlerDataSource', 'configuration': webcrawler_data_source_config(webcrawler_seed_urls)})
+    return data_sources
+
+def create_application(application_name, client_token):
+    iam_idp_provier_arn = os.environ.get('IAM_PROVIDER_ARN', '')
+    iam_idp_client_ids = os.environ.get('IAM_PROVIDER_AUDIENCE', '')
+    create_app_response = qbusiness_client.create_application(
+        displayName=application_name,
+        identityType= 'AWS_IAM_IDP_OIDC',
+        iamIdentityProviderArn=iam_idp_provier_arn,
+        clientIdsForOIDC=[iam_idp_client_ids],
+        attachmentsConfiguration={
+            'attachmentsControlMode': 'DISABLED'
+        },
+        qAppsConfiguration={
+            'qAppsControlMode': 'DISABLED'
+        },
+        clientToken=client_token
+    )
+    application_id = create_app_response['applicationId']
+    logger.info(f'Application created with ID: {application_id}')
+    return application_id
+
+def enable_creator_mode(application_id):
+    logger.info(f'Turning on creator mode for application : {application_id}')
+    # This ensures auto subscription
+    qbusiness_client.update_chat_controls_configuration(
+        applicationId=application_id,
+        creatorModeConfiguration={
+            'creatorModeControl': 'ENABLED'
+        }
+    )
+
+def enable_auto_subscription(application_id):
+    logger.info(f'Turning on auto subscription for application : {application_id}')
+    # Ensures auto subscription is turned on for OIDC users
+    qbusiness_client.update_application(
+        applicationId=application_id,
+        autoSubscriptionConfiguration={
+            'autoSubscribe': 'ENABLED',
+            'defaultSubscriptionType': 'Q_BUSINESS'
+        }
+    )
+
+def create_index(application_id, client_token):
+    response_index = qbusiness_client.create_index(
+        applicationId=application_id,
+        displayName='amzn-q-biz-index',
+        type='ENTERPRISE',
+        capacityConfiguration={
+            'units': 1
+        },
+        clientToken=client_token
+    )
+    return response_index['indexId']
+
+def create_retriever(application_id, index_id, client_token):
+    retriever_response = qbusiness_client.create_retriever(
+        applicationId=application_id,
+        type='NATIVE_INDEX',
+        displayName='q-business-native-inex-retriever',
+        configuration={
+            'nativeIndexConfiguration': {
+                'indexId': index_id
+            }
+        },
+        clientToken=client_token
+    )
+    logger.info(f"Successfully created retriever: {retriever_response['retrieverId']}")
+    return retriever_response['retrieverId']
+
+def create_data_source(application_id, index_id, data_source, client_token):
+    response = qbusiness_client.create_data_source(
+        applicationId=application_id,
+        indexId=index_id,
+        displayName=data_source['name'],
+        configuration=data_source['configuration'],
+        syncSchedule=data_source.get('syncSchedule', ''),
+        roleArn=os.environ.get('DATA_SOURCE_ROLE', ''),
+        clientToken=client_token
+    )
+    data_source_id = response['dataSourceId']
+    logger.info(f"{data_source['name']} created with ID: {data_source_id}")
+    return data_source_id
+
+def start_sync(application_id, index_id, data_source_id):
+    """Start the sync job and return its execution id, None when a sync was already running."""
+    try:
+        response = qbusiness_client.start_data_source_sync_job(
+            dataSourceId=data_source_id,
+            applicationId=application_id,
+            indexId=index_id
+        )
+    except qbusiness_client.exceptions.ConflictException:
+        # The step is replayed when its checkpoint was not saved, the sync it started is still running
+        logger.info(f"Sync already running for: {data_source_id}")
+        return None
+    logger.info(f"Started sync for: {data_source_id}")
+    return response.get('executionId')
+
+def monitor_sync(name, application_id, index_id, data_source_id, execution_id, deadline):
+    """
+    Follow the sync job until it ends or the deadline passes and emit its throughput
+    metrics, return its status. Never fails the step: ingestion of a large corpus
+    outlasts any deployment, so a sync still running is reported with its progress
+    so far and the resource completes without waiting for it.
+    """
+    monitor = SyncJobMonitor(qbusiness_client, application_id, index_id, POLL_INITIAL_DELAY, POLL_MAX_DELAY)
+    try:
+        metrics = monitor.wait(name, data_source_id, execution_id, deadline)
+    except Exception as e:
+        logger.warning(f"Could not follow the sync of {name}: {e}")
+        return "UNKNOWN"
+    if metrics['status'] == "TIMEOUT":
+        logger.info(f"Sync of {name} still running, progress so far: {metrics}")
+    emit_metrics(metrics)
+    return metrics['status']
+
+class StepPending(Exception):
+    """A resource is still being created, a later invocation resumes from the checkpoint."""
+
+def require_active(name, status):
+    if status == "TIMEOUT" and ASYNC_COMPLETION:
+        raise StepPending(f"{name} is not ACTIVE yet")
+    if status != "ACTIVE":
+        raise Exception(f"{name} creation failed with status : {status}")
+
+def build_provisioning_graph(application_name, data_sources, deadline, client_token):
+    """
+    Provisioning steps and their dependencies. Chat controls and auto subscription
+    only need the application and run while the index is created. Once the index
+    is ACTIVE the retriever and every data source are created in parallel, and each
+    source starts syncing as soon as it is ACTIVE. Create calls pass an idempotency
+    token derived from the step, `client_token(step)`.
+    """
+    graph = TaskGraph()
+    graph.add('application', lambda r: create_application(application_name, client_token('application')))
+    graph.add('creator_mode', lambda r: enable_creator_mode(r['application']), ['application'])
+    # Application updates are serialized, concurrent updates of one application may conflict
+    graph.add('auto_subscription', lambda r: enable_auto_subscription(r['application']), ['creator_mode'])
+    graph.add('index', lambda r: create_index(r['application'], client_token('index')), ['application'])
+    graph.add('index_active', lambda r: require_active(
+        'Index', wait_for_index_completion(r['application'], r['index'], deadline)), ['index'])
+    graph.add('retriever', lambda r: create_retriever(r['application'], r['index'], client_token('retriever')), ['index_active'])
+
+    for data_source in data_sources:
+        name = data_source['name']
+        graph.add(f'{name}:create', lambda r, ds=data_source, name=name: create_data_source(
+            r['application'], r['index'], ds, client_token(f'{name}:create')), ['index_active'])
+        graph.add(f'{name}:active', lambda r, name=name: require_active(
+            name, wait_for_data_source(r['application'], r['index'], r[f'{name}:create'], deadline)), [f'{name}:create'])
+        if data_source.get('startSync', True):
+            graph.add(f'{name}:sync', lambda r, name=name: start_sync(r['application'], r['index'], r[f'{name}:create']), [f'{name}:active'])
+            if MONITOR_SYNC:
+                graph.add(f'{name}:synced', lambda r, name=name: monitor_sync(
+                    name, r['application'], r['index'], r[f'{name}:create'], r[f'{name}:sync'], deadline), [f'{name}:sync'])
+    return graph
+
+def collect_response_data(results, data_sources):
+    response_data = {}
+    if 'application' in results:
+        response_data['ApplicationId'] = results['application']
+    if 'retriever' in results:
+        response_data['RetrieverId'] = results['retriever']
+    for data_source in data_sources:
+        if f"{data_source['name']}:create" in results:
+            response_data[f"{data_source['name']}Id"] = results[f"{data_source['name']}:create"]
+    return response_data
+
+def provision(event, application_name, deadline):
+    """
+    Run the provisioning graph from the last checkpoint of the request
+
+    Returns:
+        tuple: Whether provisioning is complete, and the ids of the resources created so far
+    """
+    data_sources = get_data_sources()
+    checkpoint = ProvisioningCheckpoint(ssm_client, event, CHECKPOINT_PARAM_PREFIX)
+    completed = checkpoint.load()
+    if completed:
+        logger.info(f"Resuming provisioning, completed steps: {sorted(completed)}")
+    else:
+        logger.info(f"Creating Q Business application with name {application_name} and data sources {[ds['name'] for ds in data_sources]}")
+
+    def save_checkpoint(name, results):
         try:
-            response = qbusiness_client.get_data_source(
-                applicationId=application_id,
-                indexId=index_id,
-                dataSourceId=data_source_id
-            )
-            status = response['status']
-            logger.info(f"Polling attempt {attempt + 1}: Data source {data_source_id} status is '{status}'")
-
-            if status == "ACTIVE":
-                logger.info(f"Data source {data_source_id} is now ACTIVE.")
-                return data_source_id, "ACTIVE"
-            elif status == "FAILED":
-                logger.info(f"Data source {data_source_id} failed.")
-                return data_source_id, "FAILED"
+            checkpoint.save(results)
         except Exception as e:
-            logger.error(f"An error occurred for data source {data_source_id}: {e}")
-            raise e
-        time.sleep(delay)
-    logger.info(f"Data source {data_source_id} did not reach a terminal state within the timeout.")
-    return data_source_id, "TIMEOUT"
-  results = {}
-  with ThreadPoolExecutor(max_workers=len(data_sources)) as executor:
-      future_to_data_source = {executor.submit(wait_for_data_source, ds_id): ds_id for ds_id in data_sources}
-      for future in as_completed(future_to_data_source):
-          ds_id = future_to_data_source[future]
-          try:
-              ds_id, status = future.result()
-              results[ds_id] = status
-          except Exception as e:
-              print(f"An error occurred while waiting for data source {ds_id}: {e}")
-              results[ds_id] = "ERROR"
-  return results
-
-
-def wait_for_index_completion(application_id, index_id):          
-  max_retries=MAX_RETRIES
-  delay=DELAY
-  for attempt in range(max_retries):
-      try:
-          index_waiter = qbusiness_client.get_index(applicationId=application_id, indexId=index_id)
-          status = index_waiter['status']
-          logger.info(f"Polling attempt {attempt + 1}: Current status of index {index_id} is '{status}'")
-          if status == "ACTIVE":
-              print(f"Index {index_id} is now ACTIVE.")
-              return status
-          elif status == "FAILED":
-              print(f"Index {index_id} failed to reach ACTIVE status.")
-              return status                
-      except Exception as e:
-          logger.error(f"An error occurred while checking index status: {e}")
-          raise e
-      time.sleep(delay)
-
-  logger.info(f"Maximum retries reached. Index {index_id} did not reach a terminal state.")
-  return "TIMEOUT"  
+            # Create calls are idempotent, a missed checkpoint only means the step is replayed
+            logger.warning(f"Could not checkpoint step {name}: {e}")
+
+    graph = build_provisioning_graph(application_name, data_sources, deadline, checkpoint.client_token)
+    try:
+        results = graph.run(completed=completed, on_complete=save_checkpoint)
+    except TaskGraphError as e:
+        response_data = collect_response_data(e.results, data_sources)
+        if isinstance(e.error, StepPending):
+            logger.info(f"Provisioning in progress: {e.error}")
+            return False, response_data
+        raise
+    return True, collect_response_data(results, data_sources)
+
+def delete_application(event):
+    """Delete the application of the resource, including one left behind by a failed create."""
+    checkpoint = ProvisioningCheckpoint(ssm_client, event, CHECKPOINT_PARAM_PREFIX)
+    application_id = checkpoint.load(any_request=True).get('application') or event.get('PhysicalResourceId')
+    if application_id and application_id != 'FAILED':
+        try:
+            # Delete the Amazon Q Business Application
+            qbusiness_client.delete_application(applicationId=application_id)
+            logger.info(f'Application with ID {application_id} deleted.')
+        except qbusiness_client.exceptions.ResourceNotFoundException:
+            logger.info(f'Application with ID {application_id} not found, nothing to delete.')
+    checkpoint.delete()
 
 def lambda_handler(event, context):      
     application_name = os.environ.get('Q_BIZ_APP_NAME', 'my-test-q-business-app')
-    iam_idp_provier_arn = os.environ.get('IAM_PROVIDER_ARN', '')
-    iam_idp_client_ids = os.environ.get('IAM_PROVIDER_AUDIENCE', '')
-    s3_bucket_name = os.environ.get('Q_BIZ_S3_SOURCE_BKT', '')
-    s3_data_source_name = 'S3DataSource'
-    webcrawler_data_source_name = 'WebCrawlerDataSource'
-    webcrawler_seed_urls = os.environ.get('Q_BIZ_SEED_URL', '').split(",")
-    ds_role_arn = os.environ.get('DATA_SOURCE_ROLE', '')
 
     response_data = {}
-    logger.info(f"Creating Q Business application with name {application_name}, datasources bucket {s3_bucket_name} and URLS {webcrawler_seed_urls}")
+    # In async completion mode each resource is polled once, the isComplete handler finishes the waits
+    deadline = time.monotonic() if ASYNC_COMPLETION else deadline_from_context(context, DEADLINE_MARGIN)
 
     try:
         if event['RequestType'] == 'Create':
-            # Create Amazon Q Business Application
-            create_app_response = qbusiness_client.create_application(
-                displayName=application_name,
-                identityType= 'AWS_IAM_IDP_OIDC',
-                iamIdentityProviderArn=iam_idp_provier_arn,
-                clientIdsForOIDC=[iam_idp_client_ids],
-                attachmentsConfiguration={
-                    'attachmentsControlMode': 'DISABLED'
-                },
-                qAppsConfiguration={
-                    'qAppsControlMode': 'DISABLED'
-                }
-            )
-            application_id = create_app_response['applicationId']
-            response_data['ApplicationId'] = application_id
-            logger.info(f'Application created with ID: {application_id}')
-
-            logger.info(f'Turning on creator mode for application : {application_id}')
-            # This ensures auto subscription
-            qbusiness_client.update_chat_controls_configuration(
-                          applicationId=application_id,
-                          creatorModeConfiguration={
-                              'creatorModeControl': 'ENABLED'
-                          }
-                      )
-            
-            #create index
-            response_index = qbusiness_client.create_index(
-                    applicationId=application_id,
-                    displayName='amzn-q-biz-index',
-                    type='ENTERPRISE',
-                    capacityConfiguration={
-                        'units': 1
-                    }
-                )
-            index_id = response_index['indexId']
-            # Wait for index creation
-            index_status = wait_for_index_completion(application_id, index_id)
-
-            if index_status == "TIMEOUT" or index_status == "FAILED":
-              raise Exception(f"Index creation failed with status : {index_status}")
-            
-            # Create Retriever
-            retriever_response = qbusiness_client.create_retriever(
-                                        applicationId=application_id,
-                                        type='NATIVE_INDEX',
-                                        displayName='q-business-native-inex-retriever',
-                                        configuration={
-                                            'nativeIndexConfiguration': {
-                                                'indexId': index_id
-                                            }
-                                        }
-                                  )
-            logger.info(f"Successfully created retriever: {retriever_response['retrieverId']}")
-            response_data['RetrieverId'] = retriever_response['retrieverId']
-
-            # Create S3 Data Source
-            s3_data_source_config = {
-                "type": "S3",
-                "syncMode": "FULL_CRAWL",
-                "connectionConfiguration": {
-                    "repositoryEndpointMetadata": {
-                        "BucketName": s3_bucket_name
-                    }
-                },
-                "repositoryConfigurations": {
-                    "document": {
-                        "fieldMappings": [
-                          {
-                            "indexFieldName": "document_content",
-                            "indexFieldType": "STRING",
-                            "dataSourceFieldName": "content"
-                          }
-                        ]
-                    }
-                }
-            }
-            s3_data_source_response = qbusiness_client.create_data_source(
-                applicationId=application_id,
-                indexId=index_id,
-                displayName=s3_data_source_name,
-                configuration=s3_data_source_config,
-                syncSchedule='',
-                roleArn=ds_role_arn
-            )
-            s3_data_source_id = s3_data_source_response['dataSourceId']
-            response_data['S3DataSourceId'] = s3_data_source_id
-            logger.info(f'S3 data source created with ID: {s3_data_source_id}')
-
-            # Create Web Crawler Data Source
-            seedUrls = [{"seedUrl": i} for i in webcrawler_seed_urls]
-            web_data_source_config = {
-                  "type": "WEBCRAWLERV2",
-                  "syncMode": "FULL_CRAWL",
-                  "connectionConfiguration": {
-                    "repositoryEndpointMetadata": {      
-                      "seedUrlConnections": seedUrls,
-                      "authentication": "NoAuthentication"
-                    }
-                  },
-                  "repositoryConfigurations": {
-                    "webPage": {
-                      "fieldMappings": [
-                        {
-                          "indexFieldName": "title",
-                          "indexFieldType": "STRING",
-                          "dataSourceFieldName": "page_title",
-                          "dateFieldFormat": "yyyy-MM-dd'T'HH:mm:ss'Z'"
-                        }
-                      ]
-                    },
-                    "attachment": {
-                      "fieldMappings": [
-                        {
-                          "indexFieldName": "attachment_title",
-                          "indexFieldType": "STRING",
-                          "dataSourceFieldName": "attachment_name",
-                          "dateFieldFormat": "yyyy-MM-dd'T'HH:mm:ss'Z'"
-                        }
-                      ]
-                    }
-                  },
-                  "additionalProperties": {
-                    "rateLimit": "300",
-                    "maxFileSize": "50",
-                    "crawlDepth": "1",
-                    "maxLinksPerUrl": "1",
-                    "crawlSubDomain": "true",
-                    "crawlAllDomain": "true",
-                    "honorRobots": "true"
-                  }
-                }
-            webcrawler_data_source_response = qbusiness_client.create_data_source(
-                applicationId=application_id,
-                indexId=index_id,
-                displayName=webcrawler_data_source_name,
-                configuration=web_data_source_config,
-                syncSchedule='',
-                roleArn=ds_role_arn
-            )
-            webcrawler_data_source_id = webcrawler_data_source_response['dataSourceId']
-            response_data['WebCrawlerDataSourceId'] = webcrawler_data_source_id
-            logger.info(f'Web crawler data source created with ID: {webcrawler_data_source_id}')
-
-            # Check for status of the data sources
-            data_source_ids = [s3_data_source_id, webcrawler_data_source_id]
-            final_statuses = wait_for_all_data_sources(application_id, index_id, data_source_ids)
-
-            if all(status == "ACTIVE" for status in final_statuses.values()):
-                logger.info("Both data sources are ACTIVE. Proceeding to start S3 and Webcrawler sync...")
-                for ds_id in data_source_ids:
-                    qbusiness_client.start_data_source_sync_job(
-                        dataSourceId=ds_id,
-                        applicationId=application_id,
-                        indexId=index_id
-                    )
-                    logger.info(f"Started sync for: {ds_id}")
-                logger.info("Both Sync's initiated. Done...")   
-
-                logger.info(f'Turning on auto subscription for application : {application_id}')
-                # Ensures auto subscription is turned on for OIDC users
-                qbusiness_client.update_application(
-                            applicationId=application_id,
-                            autoSubscriptionConfiguration={
-                                'autoSubscribe': 'ENABLED',
-                                'defaultSubscriptionType': 'Q_BUSINESS'
-                            }
-                        )             
-            else:
-                raise Exception(f"One or more data sources failed or timed out: {final_statuses}")                
-            
+            complete, response_data = provision(event, application_name, deadline)
+            application_id = response_data['ApplicationId']
+            if not complete:
+                return {"PhysicalResourceId": application_id, "Data": response_data}
+            logger.info("Application, index, retriever and data sources ready, syncs initiated. Done...")
+
             cfnresponse.send(event, context, cfnresponse.SUCCESS, response_data, application_id)
-            return {"message": "Successfully created", "data": response_data}
+            return {"message": "Successfully created", "data": response_data, "PhysicalResourceId": application_id, "Data": response_data}
         elif event['RequestType'] == 'Delete':
-            # Retrieve the ApplicationId from the event's PhysicalResourceId
-            application_id = event.get('PhysicalResourceId')
-            if application_id and application_id != 'FAILED':
-                # Delete the Amazon Q Business Application
-                qbusiness_client.delete_application(applicationId=application_id)
-                logger.info(f'Application with ID {application_id} deleted.')
+            delete_application(event)
             cfnresponse.send(event, context, cfnresponse.SUCCESS, response_data)
             return {"message": "Successfully deleted"}
     except Exception as e:
         logger.error(f'An unexpected error occurred: {e}')
         cfnresponse.send(event, context, cfnresponse.FAILED, response_data)
+        # Fail the custom resource provider invocation. The Provider does not retry it, CloudFormation
+        # fails the resource and its Delete removes what the checkpoint recorded
+        raise
+
+def is_complete_handler(event, context):
+    """
+    isComplete handler of the CDK Provider in async completion mode, called
+    periodically until the waits of the Create request are over
+    """
+    if event['RequestType'] != 'Create':
+        return {"IsComplete": True}
+    complete, response_data = provision(event, os.environ.get('Q_BIZ_APP_NAME', 'my-test-q-business-app'), time.monotonic())
+    return {"IsComplete": complete, "Data": response_data}
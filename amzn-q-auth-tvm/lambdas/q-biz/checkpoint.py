@@ -0,0 +1,64 @@
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ProvisioningCheckpoint:
+    """
+    Results of the completed provisioning steps of a Create request, so that the
+    isComplete invocations of the request (which receive the same RequestId)
+    resume where the previous invocation stopped.
+
+    The SSM parameter is named after the stack and logical id of the custom
+    resource, so the Delete that follows a failed create finds what it recorded.
+    The record and the idempotency tokens carry the RequestId of the Create: a
+    later Create of the same logical resource, e.g. after a rollback, starts
+    over instead of resuming or replaying the previous request.
+    """
+
+    def __init__(self, ssm_client, event, prefix='/q-biz/provisioning'):
+        self._ssm_client = ssm_client
+        resource = f"{event.get('StackId', 'local')}/{event.get('LogicalResourceId', 'local')}"
+        self.request_id = event.get('RequestId', 'local')
+        self.name = f"{prefix}/{hashlib.sha256(resource.encode('utf-8')).hexdigest()[:32]}"
+        self.key = hashlib.sha256(f"{resource}/{self.request_id}".encode('utf-8')).hexdigest()[:32]
+
+    def load(self, any_request=False):
+        """
+        Return {step: result} of the completed steps, empty when nothing was recorded
+        or the record belongs to another request. With `any_request` the last record
+        is returned whichever request wrote it, as the Delete needs.
+        """
+        try:
+            response = self._ssm_client.get_parameter(Name=self.name)
+        except self._ssm_client.exceptions.ParameterNotFound:
+            return {}
+        record = json.loads(response['Parameter']['Value'])
+        if not any_request and record.get('requestId') != self.request_id:
+            logger.info(f"Ignoring the checkpoint of request {record.get('requestId')}")
+            return {}
+        return record['completed']
+
+    def save(self, results):
+        self._ssm_client.put_parameter(
+            Name=self.name,
+            Value=json.dumps({'requestId': self.request_id, 'completed': results}),
+            Type='String',
+            Overwrite=True
+        )
+
+    def delete(self):
+        try:
+            self._ssm_client.delete_parameter(Name=self.name)
+        except self._ssm_client.exceptions.ParameterNotFound:
+            pass
+
+    def client_token(self, step):
+        """
+        Idempotency token for a create call, identical across the invocations of a
+        request so a create that succeeded without being recorded returns the same
+        resource when replayed, and different for every Create request
+        """
+        return hashlib.sha256(f"{self.key}/{step}".encode('utf-8')).hexdigest()[:64]
@@ -0,0 +1,237 @@
+"""
+Bulk loader for the S3 bucket behind the Q Business S3 data source.
+
+Documents are streamed straight out of a zip archive or a directory, without
+extracting anything to disk, and uploaded on a bounded pool of threads. Objects
+at or above the multipart threshold are uploaded in parts. Objects whose content
+is already in the bucket are skipped: their ETag, or the sha256 stored in their
+metadata, is compared with the local content. Once the upload is done, a sync
+of the data source can be started (and followed with --wait).
+
+    python lambdas/q-biz/document_loader.py sample_tickets.zip --bucket <Q_BIZ_S3_SOURCE_BKT> --prefix tickets/ \\
+        [--sync --application-id <id> --index-id <id> --data-source-id <id> [--wait]]
+"""
+import os
+import time
+import zipfile
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+class DocumentLoader:
+    def __init__(self, s3_client, bucket, prefix='', workers=32, multipart_threshold=8 * MB, multipart_chunksize=8 * MB):
+        """
+        Args:
+            s3_client: boto3 S3 client, its max_pool_connections should be at least `workers`
+            bucket: Destination bucket
+            prefix: Key prefix prepended to the path of every document
+            workers: Number of documents uploaded concurrently
+            multipart_threshold: Size from which documents are uploaded in parts
+            multipart_chunksize: Size of the parts
+        """
+        self._s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.workers = workers
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+        self._local = threading.local()
+        # Archive handles opened by the worker threads of the current load, closed when it ends
+        self._archives = []
+        self._archives_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def load(self, source):
+        """
+        Upload every document of a zip archive or directory
+
+        Returns:
+            dict: Number of documents uploaded, skipped and failed, bytes uploaded and elapsed seconds
+        """
+        start = time.monotonic()
+        stats = {'uploaded': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+        existing = self._list_existing()
+        logger.info(f"{len(existing)} objects already under s3://{self.bucket}/{self.prefix}")
+
+        # Bound the documents in flight so a large corpus is not queued in memory at once
+        slots = threading.BoundedSemaphore(self.workers * 2)
+
+        def run(entry):
+            try:
+                outcome, size = self._load_entry(source, entry, existing)
+            except Exception as e:
+                logger.error(f"Failed to upload {entry[0]}: {e}")
+                outcome, size = 'failed', 0
+            finally:
+                slots.release()
+            with self._stats_lock:
+                stats[outcome] += 1
+                if outcome == 'uploaded':
+                    stats['bytes'] += size
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for entry in iter_entries(source):
+                    slots.acquire()
+                    executor.submit(run, entry)
+        finally:
+            self._close_archives()
+
+        stats['seconds'] = round(time.monotonic() - start, 2)
+        return stats
+
+    def _list_existing(self):
+        """Return {key: (etag, size)} of the objects under the prefix."""
+        existing = {}
+        paginator = self._s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                existing[obj['Key']] = (obj['ETag'].strip('"'), obj['Size'])
+        return existing
+
+    def _open(self, source, name):
+        if os.path.isdir(source):
+            return open(os.path.join(source, name), 'rb')
+        # One archive handle per thread, entries are then read without sharing a file position
+        archives = self._local.__dict__.setdefault('archives', {})
+        if source not in archives:
+            archives[source] = zipfile.ZipFile(source)
+            with self._archives_lock:
+                self._archives.append(archives[source])
+        return archives[source].open(name)
+
+    def _close_archives(self):
+        with self._archives_lock:
+            archives, self._archives = self._archives, []
+            # Threads of a later load must not find the closed handles
+            self._local = threading.local()
+        for archive in archives:
+            archive.close()
+
+    def _load_entry(self, source, entry, existing):
+        name, size = entry
+        key = self.prefix + name
+        if size < self.multipart_threshold:
+            with self._open(source, name) as f:
+                body = f.read()
+            etag = hashlib.md5(body, usedforsecurity=False).hexdigest()
+            sha256 = hashlib.sha256(body).hexdigest()
+        else:
+            body = None
+            with self._open(source, name) as f:
+                etag, sha256 = self._multipart_digests(f)
+
+        if self._unchanged(key, size, etag, sha256, existing):
+            return 'skipped', size
+
+        if body is not None:
+            self._s3.put_object(Bucket=self.bucket, Key=key, Body=body, Metadata={'sha256': sha256})
+        else:
+            with self._open(source, name) as f:
+                self._s3.upload_fileobj(
+                    f, self.bucket, key,
+                    ExtraArgs={'Metadata': {'sha256': sha256}},
+                    # Parallelism comes from the documents, each one is uploaded part after part
+                    Config=TransferConfig(
+                        multipart_threshold=self.multipart_threshold,
+                        multipart_chunksize=self.multipart_chunksize,
+                        max_concurrency=1,
+                        use_threads=False
+                    )
+                )
+        return 'uploaded', size
+
+    def _multipart_digests(self, f):
+        """Return the ETag S3 computes for a multipart upload with our part size, and the sha256 of the content."""
+        sha256 = hashlib.sha256()
+        part_digests = []
+        while True:
+            chunk = f.read(self.multipart_chunksize)
+            if not chunk:
+                break
+            sha256.update(chunk)
+            part_digests.append(hashlib.md5(chunk, usedforsecurity=False).digest())
+        etag = hashlib.md5(b''.join(part_digests), usedforsecurity=False).hexdigest()
+        return f"{etag}-{len(part_digests)}", sha256.hexdigest()
+
+    def _unchanged(self, key, size, etag, sha256, existing):
+        if key not in existing:
+            return False
+        existing_etag, existing_size = existing[key]
+        if existing_etag == etag:
+            return True
+        if existing_size != size:
+            return False
+        # ETags are not content hashes with SSE-KMS or another part size, fall back to the stored sha256
+        response = self._s3.head_object(Bucket=self.bucket, Key=key)
+        return response.get('Metadata', {}).get('sha256') == sha256
+
+
+def iter_entries(source):
+    """Yield (relative path, size) of the documents of a zip archive or directory, skipping hidden files."""
+    if not os.path.isdir(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and not _is_hidden(info.filename):
+                    yield info.filename, info.file_size
+        return
+    for root, dirs, files in os.walk(source):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            name = os.path.relpath(path, source).replace(os.sep, '/')
+            if not _is_hidden(name):
+                yield name, os.path.getsize(path)
+
+
+def _is_hidden(name):
+    # Also skips the __MACOSX resource forks macOS adds to archives
+    return any(part.startswith('.') or part == '__MACOSX' for part in name.split('/'))
+
+
+if __name__ == '__main__':
+    import argparse
+    import boto3
+    from botocore.config import Config
+    from sync_monitor import SyncJobMonitor, emit_metrics
+
+    parser = argparse.ArgumentParser(description='Upload documents to the S3 data source bucket')
+    parser.add_argument('source', help='zip archive or directory')
+    parser.add_argument('--bucket', default=os.environ.get('Q_BIZ_S3_SOURCE_BKT'))
+    parser.add_argument('--prefix', default='')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--endpoint-url', help='S3 endpoint override, e.g. a local stand-in')
+    parser.add_argument('--sync', action='store_true', help='start a sync of the data source when documents changed')
+    parser.add_argument('--wait', action='store_true', help='follow the sync and print its throughput')
+    parser.add_argument('--application-id')
+    parser.add_argument('--index-id')
+    parser.add_argument('--data-source-id')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    s3_client = boto3.client('s3', endpoint_url=args.endpoint_url, config=Config(
+        max_pool_connections=args.workers,
+        retries={'mode': 'standard'}
+    ))
+    stats = DocumentLoader(s3_client, args.bucket, args.prefix, args.workers).load(args.source)
+    print(f"{stats} ({(stats['uploaded'] + stats['skipped']) / max(stats['seconds'], 0.01):.0f} documents/s)")
+
+    if args.sync and stats['uploaded']:
+        # The data source syncMode decides whether this is a full or change log (incremental) sync
+        qbusiness_client = boto3.client('qbusiness')
+        execution_id = qbusiness_client.start_data_source_sync_job(
+            applicationId=args.application_id,
+            indexId=args.index_id,
+            dataSourceId=args.data_source_id
+        ).get('executionId')
+        logger.info(f"Started sync {execution_id} of data source {args.data_source_id}")
+        if args.wait:
+            monitor = SyncJobMonitor(qbusiness_client, args.application_id, args.index_id)
+            emit_metrics(monitor.wait(args.data_source_id, args.data_source_id, execution_id, time.monotonic() + 6 * 3600))
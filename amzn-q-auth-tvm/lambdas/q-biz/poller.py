@@ -0,0 +1,58 @@
+import time
+import random
+import logging
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Error codes worth polling through instead of aborting the deployment
+RETRYABLE_ERRORS = ('ThrottlingException', 'TooManyRequestsException', 'InternalServerException', 'ServiceUnavailableException')
+TERMINAL_STATUSES = ('ACTIVE', 'FAILED')
+
+
+def deadline_from_context(context, margin=30, default=840):
+    """
+    Return the monotonic time by which polling must stop, `margin` seconds before the
+    Lambda times out so there is still time to report the result to CloudFormation.
+    Without a Lambda context (local runs) polling stops after `default` seconds.
+    """
+    if context is None:
+        return time.monotonic() + default
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - margin
+
+
+def poll_until_terminal(describe, name, deadline, terminal=TERMINAL_STATUSES, initial_delay=2, max_delay=30, multiplier=2):
+    """
+    Call `describe()` until it returns one of the `terminal` statuses or the deadline passes.
+
+    Polls start `initial_delay` seconds apart and back off exponentially up to
+    `max_delay`, with jitter so parallel pollers do not hit the API together.
+    Throttling and transient server errors are retried with the same backoff,
+    any other error is raised.
+
+    Returns:
+        str: The terminal status, or "TIMEOUT"
+    """
+    start = time.monotonic()
+    delay = initial_delay
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            status = describe()
+        except ClientError as e:
+            if e.response['Error']['Code'] not in RETRYABLE_ERRORS:
+                raise
+            logger.warning(f"Polling attempt {attempt}: {name} status check failed, retrying: {e}")
+        else:
+            logger.info(f"Polling attempt {attempt}: {name} status is '{status}'")
+            if status in terminal:
+                logger.info(f"{name} reached {status} in {time.monotonic() - start:.1f}s after {attempt} polls")
+                return status
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.info(f"{name} did not reach a terminal state within {time.monotonic() - start:.1f}s")
+            return "TIMEOUT"
+        time.sleep(min(random.uniform(delay / 2, delay), remaining))
+        delay = min(delay * multiplier, max_delay)
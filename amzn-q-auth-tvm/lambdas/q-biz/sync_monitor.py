@@ -0,0 +1,115 @@
+import json
+import time
+import logging
+from poller import poll_until_terminal
+
+SYNC_TERMINAL_STATUSES = ('SUCCEEDED', 'FAILED', 'INCOMPLETE', 'STOPPED', 'ABORTED')
+METRICS_NAMESPACE = 'TVM/QBusiness'
+DOCUMENT_METRICS = ('documentsAdded', 'documentsModified', 'documentsDeleted', 'documentsFailed', 'documentsScanned')
+
+
+class SyncJobMonitor:
+    """
+    Follows data source sync jobs through ListDataSourceSyncJobs and reports their
+    ingestion throughput. The Q Business client is passed in so the monitor can be
+    driven by a botocore Stubber or any object with the same method.
+    """
+
+    def __init__(self, qbusiness_client, application_id, index_id, initial_delay=5, max_delay=60):
+        self._client = qbusiness_client
+        self.application_id = application_id
+        self.index_id = index_id
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+
+    def get_sync_job(self, data_source_id, execution_id=None):
+        """Return the sync job with `execution_id`, or the latest one, None when there is none."""
+        kwargs = {'applicationId': self.application_id, 'indexId': self.index_id, 'dataSourceId': data_source_id}
+        while True:
+            response = self._client.list_data_source_sync_jobs(**kwargs)
+            for job in response.get('history', []):
+                if execution_id is None or job['executionId'] == execution_id:
+                    return job
+            if not response.get('nextToken'):
+                return None
+            kwargs['nextToken'] = response['nextToken']
+
+    def wait(self, name, data_source_id, execution_id, deadline):
+        """
+        Poll the sync job with adaptive backoff until it ends or the deadline passes
+
+        Returns:
+            dict: Throughput metrics of the job, with status "TIMEOUT" if it is still running
+        """
+        jobs = {}
+
+        def describe():
+            job = self.get_sync_job(data_source_id, execution_id)
+            jobs['last'] = job
+            return job['status'] if job else 'PENDING'
+
+        status = poll_until_terminal(describe, f"Sync of {name}", deadline, terminal=SYNC_TERMINAL_STATUSES,
+                                     initial_delay=self.initial_delay, max_delay=self.max_delay)
+        return sync_metrics(name, data_source_id, jobs.get('last'), status)
+
+
+def sync_metrics(name, data_source_id, job, status):
+    """Document counts, duration and per minute rates of a sync job."""
+    metrics = {'name': name, 'dataSourceId': data_source_id, 'status': status}
+    if job is None:
+        return metrics
+    metrics['executionId'] = job.get('executionId')
+    counts = job.get('metrics') or {}
+    for key in DOCUMENT_METRICS:
+        metrics[key] = int(counts.get(key) or 0)
+
+    start = job.get('startTime')
+    end = job.get('endTime')
+    if start is not None:
+        duration = (end.timestamp() if end is not None else time.time()) - start.timestamp()
+        metrics['durationSeconds'] = round(duration, 1)
+        minutes = max(duration, 1) / 60
+        metrics['documentsAddedPerMinute'] = round(metrics['documentsAdded'] / minutes, 2)
+        metrics['documentsFailedPerMinute'] = round(metrics['documentsFailed'] / minutes, 2)
+    return metrics
+
+
+def emit_metrics(metrics, namespace=METRICS_NAMESPACE):
+    """
+    Print the metrics in CloudWatch Embedded Metric Format, Lambda ships the line
+    to CloudWatch Logs which extracts the metrics per data source
+    """
+    names = [key for key in (*DOCUMENT_METRICS, 'durationSeconds', 'documentsAddedPerMinute', 'documentsFailedPerMinute') if key in metrics]
+    if not names:
+        return
+    units = {'durationSeconds': 'Seconds', 'documentsAddedPerMinute': 'None', 'documentsFailedPerMinute': 'None'}
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [['DataSource']],
+                'Metrics': [{'Name': key, 'Unit': units.get(key, 'Count')} for key in names]
+            }]
+        },
+        'DataSource': metrics['name'],
+        **metrics
+    }))
+
+
+if __name__ == '__main__':
+    import argparse
+    import boto3
+
+    parser = argparse.ArgumentParser(description='Follow Q Business data source syncs and print their throughput')
+    parser.add_argument('--application-id', required=True)
+    parser.add_argument('--index-id', required=True)
+    parser.add_argument('--data-source-id', required=True, action='append')
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds to follow the syncs')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    monitor = SyncJobMonitor(boto3.client('qbusiness'), args.application_id, args.index_id)
+    deadline = time.monotonic() + args.timeout
+    for data_source_id in args.data_source_id:
+        emit_metrics(monitor.wait(data_source_id, data_source_id, None, deadline))
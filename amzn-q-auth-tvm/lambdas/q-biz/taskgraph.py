@@ -0,0 +1,76 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+
+class TaskGraphError(Exception):
+    def __init__(self, task, error, results):
+        super().__init__(f"Task {task} failed: {error}")
+        self.task = task
+        self.error = error
+        self.results = results
+
+
+class TaskGraph:
+    """
+    Small dependency graph of provisioning steps, each step starts as soon as
+    the steps it depends on have completed.
+
+    A step is a function taking the dict of results of the completed steps.
+    When a step fails no further step is started, the running ones are waited
+    for and a TaskGraphError carrying the results so far is raised.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    def add(self, name, fn, depends_on=()):
+        for dependency in depends_on:
+            if dependency not in self._tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dependency}")
+        self._tasks[name] = (fn, tuple(depends_on))
+
+    def run(self, max_workers=None, completed=None, on_complete=None):
+        """
+        Run every step with maximal concurrency and return {name: result}.
+
+        Steps found in `completed` (results of a previous run) are not run again.
+        `on_complete(name, results)` is called after every completed step, from
+        the calling thread, e.g. to checkpoint the progress.
+        """
+        results = dict(completed or {})
+        pending = {name: task for name, task in self._tasks.items() if name not in results}
+        running = {}
+        failure = None
+        with ThreadPoolExecutor(max_workers=max_workers or max(len(self._tasks), 1)) as executor:
+            while pending or running:
+                if failure is None:
+                    for name, (fn, depends_on) in list(pending.items()):
+                        if all(dependency in results for dependency in depends_on):
+                            del pending[name]
+                            running[executor.submit(self._run_task, name, fn, dict(results))] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        if failure is None:
+                            failure = (name, e)
+                        continue
+                    if on_complete is not None:
+                        on_complete(name, results)
+        if failure is not None:
+            raise TaskGraphError(failure[0], failure[1], results)
+        return results
+
+    @staticmethod
+    def _run_task(name, fn, results):
+        start = time.monotonic()
+        result = fn(results)
+        logger.info(f"Step {name} completed in {time.monotonic() - start:.1f}s")
+        return result
@@ -6,7 +6,8 @@ const ssm = require('aws-cdk-lib/aws-ssm');
 const iam = require('aws-cdk-lib/aws-iam');
 const custom_resources = require('aws-cdk-lib/custom-resources');
 const allowListedDomains = require("../allow-list-domains.json");
-const { randomBytes } = require('crypto');
+const clientRegistry = require("../client-registry.json");
+const { randomBytes, createHmac } = require('crypto');
 require('dotenv').config()
 
 class TVMOidcIssuerStack extends Stack {
@@ -15,17 +16,38 @@ class TVMOidcIssuerStack extends Stack {
 
     const region = this.region;
     const accountId = this.account;
-    const keyId = `${region}-kid`;
     const secretID = randomBytes(12).toString('hex');
+    // JWS algorithm for issued tokens: RS256 (default), ES256 or EdDSA
+    const signingAlg = process.env.TVM_SIGNING_ALG || 'RS256';
+    // Changing the rotation id generates a new signing key, older keys stay in the JWKS
+    const keyRotationId = process.env.TVM_KEY_ROTATION_ID || '0';
+    const retainedKeys = process.env.TVM_RETAINED_KEYS || '2';
+    // Seconds API Gateway caches authorizer decisions, 0 disables caching
+    const authorizerCacheTtl = parseInt(process.env.TVM_AUTHORIZER_CACHE_TTL || '0', 10);
+    // Emit per-phase latency and cache hit metrics (CloudWatch EMF) from the issuer and authorizer
+    const tvmMetrics = process.env.TVM_METRICS === 'true' ? 'true' : 'false';
+    // 'image' (default) ships the issuer as a container image, 'zip' as a slim zip package with faster cold starts
+    const issuerPackaging = process.env.TVM_ISSUER_PACKAGING || 'image';
 
     // Generate a deterministic Audience for the OIDC issuer
     const audience = `${this.region}-${this.account}-tvm`;
 
-    //Create allow-listed domains parameters in SSM
-    new ssm.StringParameter(this, 'OIDCAllowListParameter', {
-      parameterName: '/oidc/allow-list',
-      stringValue: allowListedDomains.allowList.join(','),
-      description: 'The Allow listed domains for TVM OIDC Provider'
+    //Create allow-listed domains parameters in SSM, split over numbered parameters below the 4 KB standard tier limit
+    const allowListChunks = [];
+    for (const origin of allowListedDomains.allowList) {
+      const last = allowListChunks[allowListChunks.length - 1];
+      if (last !== undefined && last.length + origin.length + 1 <= 4096) {
+        allowListChunks[allowListChunks.length - 1] = `${last},${origin}`;
+      } else {
+        allowListChunks.push(origin);
+      }
+    }
+    allowListChunks.forEach((chunk, i) => {
+      new ssm.StringParameter(this, `OIDCAllowListParameter${i}`, {
+        parameterName: `/oidc/allow-list-chunks/${i}`,
+        stringValue: chunk,
+        description: 'The Allow listed domains for TVM OIDC Provider'
+      });
     });
 
     //Client ID
@@ -42,6 +64,23 @@ class TVMOidcIssuerStack extends Stack {
       description: 'The Client ID for TVM provider'
     });
 
+    //Client registry: the default client plus the ones in client-registry.json, secrets are stored salted and hashed
+    const secretSalt = randomBytes(16).toString('hex');
+    const secretHash = createHmac('sha256', Buffer.from(secretSalt, 'hex')).update(secretID).digest('hex');
+    const clientRegistryValue = JSON.stringify({
+      clients: {
+        ...clientRegistry.clients,
+        [`oidc-tvm-${this.account}`]: { secret_hash: `sha256$${secretSalt}$${secretHash}` }
+      }
+    });
+    new ssm.StringParameter(this, 'OIDCClientRegistry', {
+      parameterName: '/oidc/clients',
+      stringValue: clientRegistryValue,
+      // Standard parameters are limited to 4 KB
+      tier: clientRegistryValue.length > 4096 ? ssm.ParameterTier.ADVANCED : ssm.ParameterTier.STANDARD,
+      description: 'The registered backend clients for TVM provider'
+    });
+
     // IAM Role for Key Generation Lambda
     const keyGenLambdaRole = new iam.Role(this, 'KeyGenLambdaRole', {
       roleName: 'tvm-key-gen-lambda-role',
@@ -53,9 +92,11 @@ class TVMOidcIssuerStack extends Stack {
 
     keyGenLambdaRole.addToPolicy(new iam.PolicyStatement({
       effect: iam.Effect.ALLOW,
-      actions: ['ssm:PutParameter', 'ssm:DeleteParameter', "ssm:DeleteParameters"],
+      actions: ['ssm:GetParameter', 'ssm:PutParameter', 'ssm:DeleteParameter', "ssm:DeleteParameters"],
       resources: [`arn:aws:ssm:${region}:${accountId}:parameter/oidc/private_key`,
                   `arn:aws:ssm:${region}:${accountId}:parameter/oidc/public_key`,
+                  `arn:aws:ssm:${region}:${accountId}:parameter/oidc/key_manifest`,
+                  `arn:aws:ssm:${region}:${accountId}:parameter/oidc/keys/*`,
                   `arn:aws:ssm:${region}:${accountId}:parameter/oidc/client_id`,
                   `arn:aws:ssm:${region}:${accountId}:parameter/oidc/client_secret`]
     }));
@@ -71,13 +112,15 @@ class TVMOidcIssuerStack extends Stack {
 
     oidcLambdaRole.addToPolicy(new iam.PolicyStatement({
       effect: iam.Effect.ALLOW,
-      actions: ['ssm:GetParameter'],
+      actions: ['ssm:GetParameter', 'ssm:GetParameters', 'ssm:GetParametersByPath'],
       resources: [
-        `arn:aws:ssm:${region}:${accountId}:parameter/oidc/private_key`,
-        `arn:aws:ssm:${region}:${accountId}:parameter/oidc/public_key`,
+        `arn:aws:ssm:${region}:${accountId}:parameter/oidc/key_manifest`,
+        `arn:aws:ssm:${region}:${accountId}:parameter/oidc/keys/*`,
         `arn:aws:ssm:${region}:${accountId}:parameter/oidc/client_id`,
         `arn:aws:ssm:${region}:${accountId}:parameter/oidc/client_secret`,
-        `arn:aws:ssm:${region}:${accountId}:parameter/oidc/allow-list`,
+        `arn:aws:ssm:${region}:${accountId}:parameter/oidc/clients`,
+        `arn:aws:ssm:${region}:${accountId}:parameter/oidc/allow-list-chunks`,
+        `arn:aws:ssm:${region}:${accountId}:parameter/oidc/allow-list-chunks/*`,
       ]
     }));
 
@@ -97,6 +140,18 @@ class TVMOidcIssuerStack extends Stack {
 
     new cdk.CustomResource(this, 'KeyGenCustomResource', {
       serviceToken: keyGenProvider.serviceToken,
+      properties: {
+        SigningAlgorithm: signingAlg,
+        RotationId: keyRotationId,
+        RetainedKeys: retainedKeys,
+      },
+    });
+
+    // Helpers shared by the issuer and authorizer (tvm_common)
+    const tvmCommonLayer = new lambda.LayerVersion(this, 'TvmCommonLayer', {
+      code: lambda.Code.fromAsset('lambdas/common'),
+      compatibleRuntimes: [lambda.Runtime.PYTHON_3_11],
+      description: 'Shared helpers of the TVM Lambdas'
     });
 
     // Lambda Authorizer function for API Gateway
@@ -107,8 +162,14 @@ class TVMOidcIssuerStack extends Stack {
       environment: {        
         CLIENT_ID_PARAM: '/oidc/client_id',
         CLIENT_SECRET_PARAM: '/oidc/client_secret',
-        OIDC_ALLOW_LIST: '/oidc/allow-list'
+        CLIENT_REGISTRY_PARAM: '/oidc/clients',
+        OIDC_ALLOW_LIST_PATH: '/oidc/allow-list-chunks',
+        CONFIG_CACHE_TTL: '300',
+        // Cached decisions are reused across routes, so grant the whole stage
+        POLICY_SCOPE: authorizerCacheTtl > 0 ? 'stage' : 'method',
+        TVM_METRICS: tvmMetrics
       },
+      layers: [tvmCommonLayer],
       runtime: lambda.Runtime.PYTHON_3_11,
       timeout: Duration.seconds(300),
       role: oidcLambdaRole
@@ -134,26 +195,62 @@ class TVMOidcIssuerStack extends Stack {
         cloudWatchRole: true,      
     });
 
-    const oidcLambda = new lambda.DockerImageFunction(this, 'OidcLambda', {
-      functionName: 'tvm-oidc-lambda',
-      code: lambda.DockerImageCode.fromImageAsset('lambdas/oidc-issuer'),
+    const oidcLambdaProps = {
       environment: {
-        PRIVATE_KEY_PARAM: '/oidc/private_key',
-        PUBLIC_KEY_PARAM: '/oidc/public_key',
-        KID: keyId,
+        KEY_MANIFEST_PARAM: '/oidc/key_manifest',
+        KEY_PARAM_PREFIX: '/oidc/keys',
         REGION: region,
         AUDIENCE: audience,
+        KEY_CACHE_TTL: '300',
+        WELL_KNOWN_MAX_AGE: '3600',
+        BATCH_TOKEN_LIMIT: '100',
+        TVM_METRICS: tvmMetrics,
       },
       runtime: lambda.Runtime.PYTHON_3_11,
       timeout: Duration.seconds(300),
       role: oidcLambdaRole
-    });
+    };
+
+    const oidcLambda = issuerPackaging === 'zip'
+      // Only authlib and its dependencies are bundled, boto3 comes with the Lambda runtime.
+      // Named differently from the image function as CloudFormation replaces it when switching.
+      ? new lambda.Function(this, 'OidcZipLambda', {
+          ...oidcLambdaProps,
+          functionName: 'tvm-oidc-lambda-zip',
+          handler: 'app.lambda_handler',
+          code: lambda.Code.fromAsset('lambdas', {
+            exclude: ['key-gen', 'lambda-authorizer', 'q-biz', '**/__pycache__'],
+            bundling: {
+              image: lambda.Runtime.PYTHON_3_11.bundlingImage,
+              command: ['bash', '-c', [
+                'pip install --no-cache-dir -r oidc-issuer/requirements-zip.txt -t /asset-output',
+                'cp oidc-issuer/app.py /asset-output/',
+                'cp -r common/python/tvm_common /asset-output/',
+                // The deployed code is read-only, ship the bytecode instead of compiling on every cold start
+                'python -m compileall -q /asset-output'
+              ].join(' && ')]
+            }
+          })
+        })
+      : new lambda.DockerImageFunction(this, 'OidcLambda', {
+          ...oidcLambdaProps,
+          functionName: 'tvm-oidc-lambda',
+          // Built from the lambdas directory so the image can include the shared tvm_common package
+          code: lambda.DockerImageCode.fromImageAsset('lambdas', {
+            file: 'oidc-issuer/Dockerfile',
+            exclude: ['key-gen', 'lambda-authorizer', 'q-biz', '**/__pycache__']
+          })
+        });
 
     // Set up API Gateway routes (without issuer URL yet)
     // Create the Lambda Authorizer
     const authorizer = new apigateway.RequestAuthorizer(this, 'OIDCLambdaAuthorizer', {
       handler: authorizerLambda,
-      identitySources: [apigateway.IdentitySource.header('Authorization')],
+      // Decisions depend on the origin as well as the credentials, so both are part of the cache key
+      identitySources: authorizerCacheTtl > 0
+        ? [apigateway.IdentitySource.header('Authorization'), apigateway.IdentitySource.header('Origin')]
+        : [apigateway.IdentitySource.header('Authorization')],
+      resultsCacheTtl: Duration.seconds(authorizerCacheTtl),
     });
 
     const tokenResource = api.root.addResource('token');
@@ -162,6 +259,12 @@ class TVMOidcIssuerStack extends Stack {
         authorizationType: apigateway.AuthorizationType.CUSTOM
     });
 
+    const tokenBatchResource = tokenResource.addResource('batch');
+    tokenBatchResource.addMethod('POST', new apigateway.LambdaIntegration(oidcLambda), {
+        authorizer,
+        authorizationType: apigateway.AuthorizationType.CUSTOM
+    });
+
     const wellknown = api.root.addResource('.well-known');
     const openidResource = wellknown.addResource('openid-configuration');
     openidResource.addMethod('GET', new apigateway.LambdaIntegration(oidcLambda));
@@ -352,6 +455,7 @@ class TVMOidcIssuerStack extends Stack {
           'qbusiness:CreateRetriever',
           'qbusiness:CreateDataSource',
           'qbusiness:StartDataSourceSyncJob',
+          'qbusiness:ListDataSourceSyncJobs',
           'qbusiness:GetIndex',
           'qbusiness:GetDataSource',
           'qbusiness:DeleteApplication',
@@ -361,6 +465,13 @@ class TVMOidcIssuerStack extends Stack {
         resources: ["*"]
       }));
 
+      // Checkpointed provisioning progress, lets retries and the isComplete handler resume
+      qBizLambdaRole.addToPolicy(new iam.PolicyStatement({
+        effect: iam.Effect.ALLOW,
+        actions: ['ssm:GetParameter', 'ssm:PutParameter', 'ssm:DeleteParameter'],
+        resources: [`arn:aws:ssm:${region}:${accountId}:parameter/q-biz/provisioning/*`]
+      }));
+
       qBizLambdaRole.addToPolicy(new iam.PolicyStatement({
         effect: iam.Effect.ALLOW,
         actions: [
@@ -377,6 +488,21 @@ class TVMOidcIssuerStack extends Stack {
         resources: ["*"]
       }));
 
+      // Finish waiting for the index and data sources in an isComplete handler instead of a single invocation
+      const qBizAsyncCompletion = process.env.Q_BIZ_ASYNC_COMPLETION === 'true';
+      const qBizEnvironment = {
+        DATA_SOURCE_ROLE: dataSourceRole.roleArn,
+        Q_BIZ_APP_NAME: process.env.Q_BIZ_APP_NAME,
+        IAM_PROVIDER_ARN: oidcIAMProvider.openIdConnectProviderArn,
+        IAM_PROVIDER_AUDIENCE: audience,
+        Q_BIZ_S3_SOURCE_BKT: process.env.Q_BIZ_S3_SOURCE_BKT,
+        Q_BIZ_SEED_URL: process.env.Q_BIZ_SEED_URLS,
+        // Optional JSON list of data sources replacing the S3 and web crawler defaults
+        Q_BIZ_DATA_SOURCES: process.env.Q_BIZ_DATA_SOURCES || '',
+        Q_BIZ_ASYNC_COMPLETION: qBizAsyncCompletion ? 'true' : 'false',
+        Q_BIZ_MONITOR_SYNC: process.env.Q_BIZ_MONITOR_SYNC === 'true' ? 'true' : 'false'
+      };
+
       const qBizCreationLambda = new lambda.DockerImageFunction(this, 'QBizCreationLambda', {
         functionName: 'tvm-q-biz-creation-lambda',
         code: lambda.DockerImageCode.fromImageAsset('lambdas/q-biz'),
@@ -384,19 +510,32 @@ class TVMOidcIssuerStack extends Stack {
         runtime: lambda.Runtime.PYTHON_3_10,
         timeout: Duration.minutes(15),
         role: qBizLambdaRole,
-        environment: {
-          DATA_SOURCE_ROLE: dataSourceRole.roleArn,
-          Q_BIZ_APP_NAME: process.env.Q_BIZ_APP_NAME,
-          IAM_PROVIDER_ARN: oidcIAMProvider.openIdConnectProviderArn,
-          IAM_PROVIDER_AUDIENCE: audience,
-          Q_BIZ_S3_SOURCE_BKT: process.env.Q_BIZ_S3_SOURCE_BKT,
-          Q_BIZ_SEED_URL: process.env.Q_BIZ_SEED_URLS
-        }
+        environment: qBizEnvironment
       });
 
-      const qBizAppProvider = new custom_resources.Provider(this, 'QBizAppProvider', {
-        onEventHandler: qBizCreationLambda,
-      });
+      let qBizAppProvider;
+      if (qBizAsyncCompletion) {
+        // Same image and settings, the isComplete handler resumes the provisioning every minute
+        // so waiting for the index and data sources is not bound by the 15 minutes Lambda timeout
+        const qBizIsCompleteLambda = new lambda.DockerImageFunction(this, 'QBizIsCompleteLambda', {
+          functionName: 'tvm-q-biz-is-complete-lambda',
+          code: lambda.DockerImageCode.fromImageAsset('lambdas/q-biz', { cmd: ['app.is_complete_handler'] }),
+          runtime: lambda.Runtime.PYTHON_3_10,
+          timeout: Duration.minutes(5),
+          role: qBizLambdaRole,
+          environment: qBizEnvironment
+        });
+        qBizAppProvider = new custom_resources.Provider(this, 'QBizAppProvider', {
+          onEventHandler: qBizCreationLambda,
+          isCompleteHandler: qBizIsCompleteLambda,
+          queryInterval: Duration.minutes(1),
+          totalTimeout: Duration.hours(2)
+        });
+      } else {
+        qBizAppProvider = new custom_resources.Provider(this, 'QBizAppProvider', {
+          onEventHandler: qBizCreationLambda,
+        });
+      }
   
       new cdk.CustomResource(this, 'QBizAppCustomResource', {
         serviceToken: qBizAppProvider.serviceToken,
@@ -0,0 +1,77 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+In-process API Gateway in front of the TVM Lambda handlers: loads the
+authorizer and issuer app.py modules and calls them with the events API
+Gateway builds, the REQUEST authorizer first on the token routes.
+
+Used by the standalone server and by the local stand-ins of the benchmarks.
+"""
+import os
+import sys
+import json
+import uuid
+import importlib.util
+
+DEFAULT_API_ARN = 'arn:aws:execute-api:us-east-1:123456789012:local'
+
+
+def load_lambda(directory, module_name):
+    """
+    Import the app.py of a Lambda directory under `module_name`. The issuer and
+    authorizer are both app.py, and loading one again under a new name gives a
+    fresh module with empty warm caches, as in a new execution environment.
+    """
+    lambdas = os.path.dirname(os.path.abspath(directory))
+    for path in (os.path.join(lambdas, 'common', 'python'), os.path.abspath(directory)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(directory, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def api_gateway_events(method, path, headers, body, stage='prod', domain='127.0.0.1', api_arn=DEFAULT_API_ARN):
+    """Return the REQUEST authorizer event and the proxy integration event API Gateway would build."""
+    # The request id correlates the authorizer and issuer log entries
+    request_context = {'resourcePath': path, 'httpMethod': method, 'domainName': domain, 'stage': stage,
+                       'requestId': str(uuid.uuid4())}
+    authorizer_event = {
+        'type': 'REQUEST',
+        'methodArn': f"{api_arn}/{stage}/{method}{path}",
+        'resource': path,
+        'path': path,
+        'httpMethod': method,
+        'headers': headers,
+        'requestContext': request_context
+    }
+    proxy_event = {
+        'resource': path,
+        'path': path,
+        'httpMethod': method,
+        'headers': headers,
+        'body': body,
+        'isBase64Encoded': False,
+        'requestContext': dict(request_context)
+    }
+    return authorizer_event, proxy_event
+
+
+def invoke(authorizer, issuer, method, path, headers, body, stage='prod', domain='127.0.0.1', api_arn=DEFAULT_API_ARN):
+    """
+    Route a request as API Gateway does and return the issuer's proxy response,
+    or API Gateway's 403 response when the authorizer denies a token route
+    """
+    authorizer_event, event = api_gateway_events(method, path, headers, body, stage, domain, api_arn)
+    if path.startswith('/token'):
+        policy = authorizer.lambda_handler(authorizer_event, None)
+        if policy['policyDocument']['Statement'][0]['Effect'] != 'Allow':
+            return {
+                'statusCode': 403,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'Message': 'User is not authorized to access this resource'})
+            }
+        event['requestContext']['authorizer'] = dict(policy.get('context') or {}, principalId=policy['principalId'])
+    return issuer.lambda_handler(event, None)
@@ -0,0 +1,342 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Standalone TVM server for container and on-prem deployments.
+
+Serves /token, /token/batch, /.well-known/openid-configuration and
+/.well-known/jwks.json from a single entry point, without API Gateway. The
+Lambda authorizer and issuer handlers are loaded in-process and called
+directly, the authorizer checks running inline before the token routes.
+
+The listening socket is shared by `--workers` pre-forked processes, each
+serving keep-alive HTTP/1.1 connections on threads and keeping its own warm
+key and config caches. Keys and client credentials are read from SSM, which
+can be a local stand-in through AWS_ENDPOINT_URL_SSM, or from a JSON file of
+SSM parameters (`--parameters-file`), which `--generate` creates:
+
+    python standalone/server.py --generate --parameters-file tvm-parameters.json --alg ES256 \\
+        --client-id my-backend --client-secret <secret> --allow-origin https://app.example.com
+    python standalone/server.py --parameters-file tvm-parameters.json --issuer-url https://tvm.example.com \\
+        --audience my-audience --port 8080 --workers 4
+
+The issuer URL must be the URL clients and token consumers reach the server
+at, its path (if any) is accepted as a prefix of the routes.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import logging
+import argparse
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lambda_gateway import invoke, load_lambda
+
+logger = logging.getLogger(__name__)
+
+LAMBDAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambdas')
+
+# Same parameter names as the CDK stack, overridable through the environment
+DEFAULT_ENVIRONMENT = {
+    'KEY_MANIFEST_PARAM': '/oidc/key_manifest',
+    'KEY_PARAM_PREFIX': '/oidc/keys',
+    'CLIENT_ID_PARAM': '/oidc/client_id',
+    'CLIENT_SECRET_PARAM': '/oidc/client_secret',
+    'OIDC_ALLOW_LIST_PATH': '/oidc/allow-list-chunks',
+    'LOG_LEVEL': 'WARNING'
+}
+
+ROUTES = ('/token', '/token/batch', '/.well-known/openid-configuration', '/.well-known/jwks.json')
+# Method ARN prefix of the authorizer events, the policies it returns are not enforced by anything else
+API_ARN = 'arn:aws:execute-api:local:local:tvm'
+# Largest request body accepted, well above a full /token/batch request and below the 10 MB of API Gateway
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class _ParameterStoreExceptions:
+    class ParameterNotFound(KeyError):
+        pass
+
+
+class FileParameterStore:
+    """
+    Serves the SSM calls of the handlers from a JSON file holding
+    {"parameters": {"<name>": "<value>"}}. The file is read once per worker.
+    """
+
+    # Caught by the handlers as on the boto3 client
+    exceptions = _ParameterStoreExceptions
+
+    def __init__(self, path):
+        with open(path) as f:
+            self._parameters = json.load(f)['parameters']
+
+    def _parameter(self, name):
+        if name not in self._parameters:
+            raise self.exceptions.ParameterNotFound(name)
+        return {'Name': name, 'Value': self._parameters[name], 'Version': 1}
+
+    def get_parameter(self, Name, WithDecryption=False):
+        return {'Parameter': self._parameter(Name)}
+
+    def get_parameters(self, Names, WithDecryption=False):
+        return {
+            'Parameters': [self._parameter(name) for name in Names if name in self._parameters],
+            'InvalidParameters': [name for name in Names if name not in self._parameters]
+        }
+
+    def get_parameters_by_path(self, Path, Recursive=False, WithDecryption=False, NextToken=None):
+        prefix = Path.rstrip('/') + '/'
+        names = sorted(name for name in self._parameters if name.startswith(prefix)
+                       and (Recursive or '/' not in name[len(prefix):]))
+        return {'Parameters': [self._parameter(name) for name in names]}
+
+
+def generate_parameters(alg, client_id, client_secret, allowed_origins):
+    """Return the parameters the key-gen Lambda and the stack store, with a new key pair."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
+
+    if alg == 'RS256':
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif alg == 'ES256':
+        private_key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    private_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL if alg == 'RS256' else serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    public_pem = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    kid = time.strftime('%Y%m%d%H%M%S', time.gmtime()) + '-' + os.urandom(4).hex()
+    key_prefix = DEFAULT_ENVIRONMENT['KEY_PARAM_PREFIX']
+    parameters = {
+        DEFAULT_ENVIRONMENT['KEY_MANIFEST_PARAM']: json.dumps({'keys': [{'kid': kid, 'alg': alg, 'activates_at': 0}]}),
+        f"{key_prefix}/{kid}/private_key": private_pem.decode('utf-8'),
+        f"{key_prefix}/{kid}/public_key": public_pem.decode('utf-8'),
+        DEFAULT_ENVIRONMENT['CLIENT_ID_PARAM']: client_id,
+        DEFAULT_ENVIRONMENT['CLIENT_SECRET_PARAM']: client_secret
+    }
+    if allowed_origins:
+        parameters[f"{DEFAULT_ENVIRONMENT['OIDC_ALLOW_LIST_PATH']}/0"] = ','.join(allowed_origins)
+    return parameters
+
+
+def _get_header(headers, name):
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+class TVMApplication:
+    """The authorizer and issuer handlers of one worker, routing plain HTTP requests to them."""
+
+    def __init__(self, issuer_url, parameter_store=None):
+        issuer = urlsplit(issuer_url)
+        self.domain = issuer.netloc
+        self.base_path = issuer.path.rstrip('/')
+        self.authorizer = load_lambda(os.path.join(LAMBDAS, 'lambda-authorizer'), 'tvm_authorizer')
+        self.issuer = load_lambda(os.path.join(LAMBDAS, 'oidc-issuer'), 'tvm_issuer')
+        if parameter_store is not None:
+            self.authorizer.ssm_client = parameter_store
+            self.issuer.ssm_client = parameter_store
+        # Warm the key and config caches before accepting requests
+        self.authorizer.prefetch()
+        self.issuer.prefetch()
+
+    def handle(self, method, target, headers, body):
+        """Return (status, headers, body) for a request."""
+        path = urlsplit(target).path
+        if self.base_path and path.startswith(self.base_path + '/'):
+            path = path[len(self.base_path):]
+        if path == '/health':
+            return 200, {'Content-Type': 'application/json'}, '{"status": "ok"}'
+        if path not in ROUTES or method != ('POST' if path.startswith('/token') else 'GET'):
+            return 404, {'Content-Type': 'application/json'}, json.dumps({'error': 'Not Found'})
+
+        # API Gateway passes the headers as sent, the authorizer looks up these two spellings
+        headers = dict(headers)
+        for name in ('Authorization', 'origin'):
+            value = _get_header(headers, name)
+            if value is not None:
+                headers[name] = value
+        response = invoke(self.authorizer, self.issuer, method, path, headers, body, stage='standalone',
+                          domain=self.domain, api_arn=API_ARN)
+        return response['statusCode'], response.get('headers') or {}, response.get('body') or ''
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests
+    protocol_version = 'HTTP/1.1'
+    # Idle keep-alive connections are closed after this many seconds
+    timeout = 60
+    # Headers and body are written separately, do not let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, method, body=None):
+        try:
+            status, headers, payload = self.server.app.handle(method, self.path, self.headers, body)
+        except Exception as e:
+            logger.exception(f"Error handling {method} {self.path}")
+            status, headers, payload = 500, {'Content-Type': 'application/json'}, json.dumps({'error': str(e)})
+        self._send(status, headers, payload)
+
+    def _reject(self, status, error):
+        # The body was not read, the connection cannot carry another request
+        self.close_connection = True
+        self._send(status, {'Content-Type': 'application/json', 'Connection': 'close'}, json.dumps({'error': error}))
+
+    def _send(self, status, headers, payload):
+        payload = payload.encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._respond('GET')
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._reject(400, 'invalid Content-Length header')
+            return
+        if length > MAX_BODY_SIZE:
+            self._reject(413, f'request body is larger than {MAX_BODY_SIZE} bytes')
+            return
+        try:
+            body = self.rfile.read(length).decode('utf-8')
+        except UnicodeDecodeError:
+            self._send(400, {'Content-Type': 'application/json'}, json.dumps({'error': 'request body is not UTF-8'}))
+            return
+        self._respond('POST', body)
+
+
+class _WorkerServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, listener, app):
+        super().__init__(listener.getsockname(), _Handler, bind_and_activate=False)
+        # Every worker accepts on the socket bound by the parent
+        self.socket.close()
+        self.socket = listener
+        self.app = app
+
+
+def run_worker(listener, issuer_url, parameters_file):
+    # Handlers and their boto3 clients are created after the fork, they are not fork-safe
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    # Ctrl-C reaches the whole process group, the parent stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    store = FileParameterStore(parameters_file) if parameters_file else None
+    server = _WorkerServer(listener, TVMApplication(issuer_url, store))
+    logger.info(f"Worker {os.getpid()} ready")
+    server.serve_forever()
+
+
+def serve(host, port, workers, issuer_url, parameters_file):
+    """Bind the socket and keep `workers` forked worker processes serving it until SIGTERM or SIGINT."""
+    listener = socket.create_server((host, port), backlog=1024)
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(listener, issuer_url, parameters_file)
+            except SystemExit as e:
+                code = e.code or 0
+            except BaseException:
+                logger.exception("Worker failed")
+                code = 1
+            os._exit(code)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    logger.info(f"Serving {issuer_url} on {host}:{port} with {workers} workers")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited with status {status}, restarting it")
+            # Do not spin when workers fail on start, e.g. on a missing parameter
+            time.sleep(1)
+            spawn()
+    listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Standalone TVM token server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes (default: one per CPU)')
+    parser.add_argument('--issuer-url', default=os.environ.get('ISSUER_URL'), help='public URL of the server, the iss claim')
+    parser.add_argument('--audience', default=os.environ.get('AUDIENCE'), help='aud claim of the tokens')
+    parser.add_argument('--parameters-file', help='JSON file of SSM parameters to serve keys and config from instead of SSM')
+    parser.add_argument('--generate', action='store_true', help='write a new --parameters-file and exit')
+    parser.add_argument('--alg', default='RS256', choices=('RS256', 'ES256', 'EdDSA'), help='signing algorithm with --generate')
+    parser.add_argument('--client-id', help='backend client id with --generate')
+    parser.add_argument('--client-secret', help='backend client secret with --generate')
+    parser.add_argument('--allow-origin', action='append', default=[], help='allow-listed origin with --generate')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(process)d %(levelname)s %(message)s')
+
+    if args.generate:
+        if not (args.parameters_file and args.client_id and args.client_secret):
+            parser.error('--generate requires --parameters-file, --client-id and --client-secret')
+        parameters = generate_parameters(args.alg, args.client_id, args.client_secret, args.allow_origin)
+        # Holds the private key and client secret
+        fd = os.open(args.parameters_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'parameters': parameters}, f, indent=2)
+        logger.info(f"Wrote {args.alg} key and client credentials to {args.parameters_file}")
+        return
+
+    if not (args.issuer_url and args.audience):
+        parser.error('--issuer-url and --audience (or ISSUER_URL and AUDIENCE) are required')
+    for name, value in DEFAULT_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    os.environ['ISSUER_URL'] = args.issuer_url.rstrip('/')
+    os.environ['AUDIENCE'] = args.audience
+    # The caches are warmed explicitly once the parameter store is set
+    os.environ['PREFETCH_ON_INIT'] = 'false'
+    serve(args.host, args.port, args.workers, args.issuer_url, args.parameters_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Cold start of the issuer and authorizer handlers: module import (the Lambda
+init phase) and first request, each in a fresh Python process.
+
+Three start-up modes are compared:
+
+- eager: boto3 and authlib imported and the SSM client created at module
+  load, nothing fetched before the first request (the former start-up)
+- lazy: heavy modules imported on first use, PREFETCH_ON_INIT=false
+- prefetch: lazy imports, and the SSM fetches made during init, overlapping
+  with the authlib import, and finished before init ends
+
+The headline is the total, init plus first request, with the first request
+arriving right after init (`--gap 0`, the default). That is what an
+invocation triggering a cold start waits for. A larger `--gap` lets a
+fetch started during init run before the request arrives. On Lambda the
+environment is frozen between init and the first invocation, so that
+overlap cannot happen there.
+
+The handlers' own boto3 clients talk to a local SSM stand-in with an injected
+latency per call, through AWS_ENDPOINT_URL_SSM. Interpreter start-up is the
+same in every mode and is not included.
+
+    pip install boto3 authlib cryptography requests
+    python benchmarks/bench_cold_start.py --runs 20 --ssm-latency 0.01
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from bench_end_to_end import CLIENT_ID, CLIENT_SECRET, ENVIRONMENT, LAMBDAS, seed_parameters
+from standins import LocalSSMServer, StubSSM, api_gateway_events
+
+# Runs in the fresh process: times the import of app.py, then its first request
+DRIVER = """
+import json, os, sys, time
+directory, mode, event, gap = sys.argv[1], sys.argv[2], json.loads(sys.argv[3]), float(sys.argv[4])
+sys.path[:0] = [directory, os.path.join(os.path.dirname(directory), 'common', 'python')]
+start = time.perf_counter()
+if mode == 'eager':
+    import boto3
+    if directory.endswith('oidc-issuer'):
+        import authlib.jose
+import app
+if mode == 'eager':
+    app.ssm_client = boto3.client('ssm')
+imported = time.perf_counter()
+# The runtime polls for the first event after init
+time.sleep(gap)
+invoked = time.perf_counter()
+response = app.lambda_handler(event, None)
+done = time.perf_counter()
+print(json.dumps({'init': (imported - start) * 1e3, 'first_request': (done - invoked) * 1e3, 'response': response}))
+"""
+
+MODES = ('eager', 'lazy', 'prefetch')
+
+
+def events():
+    """First request of each function: a backend client minting a token, and the authorizer checking it."""
+    authorization = 'Basic ' + base64.b64encode(f"{CLIENT_ID}:{CLIENT_SECRET}".encode('utf-8')).decode('utf-8')
+    authorizer_event, issuer_event = api_gateway_events('POST', '/token', {'Authorization': authorization},
+                                                        json.dumps({'email': 'user@example.com'}))
+    issuer_event['requestContext']['authorizer'] = {'callerType': 'client', 'clientId': CLIENT_ID, 'principalId': f"client:{CLIENT_ID}"}
+    return {'oidc-issuer': issuer_event, 'lambda-authorizer': authorizer_event}
+
+
+def run(directory, mode, event, gap, environment):
+    result = subprocess.run(
+        [sys.executable, '-c', DRIVER, directory, mode, json.dumps(event), str(gap)],
+        env=dict(environment, PREFETCH_ON_INIT='true' if mode == 'prefetch' else 'false'),
+        capture_output=True, text=True, check=True
+    )
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    response = sample.pop('response')
+    if 'policyDocument' in response:
+        allowed = response['policyDocument']['Statement'][0]['Effect'] == 'Allow'
+    else:
+        allowed = response['statusCode'] == 200
+    if not allowed:
+        raise RuntimeError(f"{os.path.basename(directory)} ({mode}) returned {response}")
+    return sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='fresh processes per function and mode')
+    parser.add_argument('--ssm-latency', type=float, default=0.01, help='seconds injected per SSM call')
+    parser.add_argument('--gap', type=float, default=0.0,
+                        help='seconds between the end of init and the first request, 0 as on Lambda')
+    parser.add_argument('--alg', default='RS256', choices=('RS256', 'ES256', 'EdDSA'))
+    args = parser.parse_args()
+
+    ssm = StubSSM(latency=args.ssm_latency)
+    seed_parameters(ssm, args.alg)
+
+    with LocalSSMServer(ssm) as server:
+        environment = dict(os.environ, **ENVIRONMENT)
+        environment.update({
+            'AWS_ENDPOINT_URL_SSM': server.url,
+            'AWS_ACCESS_KEY_ID': 'bench',
+            'AWS_SECRET_ACCESS_KEY': 'bench',
+            'AWS_EC2_METADATA_DISABLED': 'true'
+        })
+        print(f"SSM latency {args.ssm_latency * 1e3:.1f} ms, gap {args.gap * 1e3:.0f} ms, p50 (p95) over {args.runs} processes, ms")
+        print("total (init + gap + first request) is the cold latency of the invocation")
+        print(f"{'function':<20}{'mode':<10}{'init':>16}{'first request':>16}{'total':>16}")
+        for name, event in events().items():
+            directory = os.path.abspath(os.path.join(LAMBDAS, name))
+            for mode in MODES:
+                samples = [run(directory, mode, event, args.gap, environment) for _ in range(args.runs)]
+                columns = []
+                for values in ([s['init'] for s in samples], [s['first_request'] for s in samples],
+                               [s['init'] + args.gap + s['first_request'] for s in samples]):
+                    values.sort()
+                    columns.append(f"{statistics.median(values):.1f} ({values[int(len(values) * 0.95) - 1]:.1f})")
+                print(f"{name:<20}{mode:<10}" + ''.join(f"{column:>16}" for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Upload throughput of the Q Business document loader against a local S3 stand-in.
+
+A synthetic corpus of small documents (plus a few multipart-sized ones) is
+written to a zip archive and loaded with an increasing number of workers. A
+second pass over the same archive shows the cost of skipping unchanged documents.
+
+    pip install boto3
+    python benchmarks/bench_document_loader.py --documents 20000 --latency 0.01
+"""
+import argparse
+import os
+import sys
+import tempfile
+import zipfile
+
+import boto3
+from botocore.config import Config
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'amzn-q-auth-tvm', 'lambdas', 'q-biz'))
+from document_loader import DocumentLoader, MB  # noqa: E402
+from standins import LocalS3Server  # noqa: E402
+
+
+def build_corpus(path, documents, large):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for i in range(documents):
+            archive.writestr(f"tickets/ticket_{i}.txt", f"Ticket {i}\n" + "Customer reports an issue with the product. " * 40)
+        for i in range(large):
+            archive.writestr(f"manuals/manual_{i}.bin", os.urandom(20 * MB))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--large', type=int, default=2, help='documents large enough for multipart uploads')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds injected per stand-in upload')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 32, 64])
+    args = parser.parse_args()
+
+    # The stand-in does not check signatures, any credentials will do
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+
+    corpus = os.path.join(tempfile.mkdtemp(), 'corpus.zip')
+    build_corpus(corpus, args.documents, args.large)
+
+    print(f"{'workers':>8}{'pass':>8}{'uploaded':>10}{'skipped':>9}{'seconds':>9}{'docs/s':>9}")
+    for workers in args.workers:
+        with LocalS3Server(latency=args.latency) as server:
+            s3_client = boto3.client('s3', region_name='us-east-1', endpoint_url=server.url, config=Config(
+                max_pool_connections=workers,
+                s3={'addressing_style': 'path'}
+            ))
+            loader = DocumentLoader(s3_client, 'bench-bucket', workers=workers)
+            for run in ('first', 'repeat'):
+                stats = loader.load(corpus)
+                total = stats['uploaded'] + stats['skipped']
+                print(f"{workers:>8}{run:>8}{stats['uploaded']:>10}{stats['skipped']:>9}{stats['seconds']:>9.2f}{total / stats['seconds']:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
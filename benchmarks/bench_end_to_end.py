@@ -0,0 +1,250 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Offline throughput and latency of the TVM hot paths, with no AWS account or network.
+
+The authorizer and issuer handlers are loaded from `amzn-q-auth-tvm/lambdas`
+and driven in-process with synthetic API Gateway events, SSM being replaced by
+an in-memory stub with an injected latency per call. Three measurements are made:
+
+- cold: a fresh copy of each handler module is loaded (empty warm caches, as in a new
+  execution environment) and serves its first request. Interpreter start-up and
+  dependency imports are not included, they are shared by the process.
+- warm: the same handlers serving requests sequentially, as a Lambda
+  execution environment does, per endpoint.
+- client: TVMClient minting credentials for distinct users through a local
+  HTTP stand-in of API Gateway running the same handlers, and of STS. The
+  client and the stand-in share this process, so with --concurrency above 1
+  the per-call latencies include waiting for the GIL; use --concurrency 1 for
+  the latency of a single call and the default for throughput.
+
+    pip install boto3 requests authlib cryptography
+    python benchmarks/bench_end_to_end.py --requests 1000 --ssm-latency 0.005 --sts-latency 0.02
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+from cryptography.hazmat.primitives import serialization
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sample-tvm-backend-usage'))
+from tvm_client import TVMClient  # noqa: E402
+from bench_signing import generate_pem  # noqa: E402
+from standins import LocalApiGateway, StubSSM, api_gateway_events, load_lambda  # noqa: E402
+
+LAMBDAS = os.path.join(os.path.dirname(__file__), '..', 'amzn-q-auth-tvm', 'lambdas')
+ROLE_ARN = 'arn:aws:iam::123456789012:role/tvm'
+CLIENT_ID = 'bench-client'
+CLIENT_SECRET = 'bench-secret'
+ALLOWED_ORIGIN = 'https://app.example.com'
+
+# Same parameter names as the CDK stack
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'REGION': 'us-east-1',
+    'AUDIENCE': 'us-east-1-123456789012-tvm',
+    'KEY_MANIFEST_PARAM': '/oidc/key_manifest',
+    'KEY_PARAM_PREFIX': '/oidc/keys',
+    'CLIENT_ID_PARAM': '/oidc/client_id',
+    'CLIENT_SECRET_PARAM': '/oidc/client_secret',
+    'OIDC_ALLOW_LIST_PATH': '/oidc/allow-list-chunks',
+    'LOG_LEVEL': 'WARNING',
+    # The SSM stub is set on the modules once loaded, bench_cold_start.py measures the prefetch
+    'PREFETCH_ON_INIT': 'false'
+}
+
+
+def seed_parameters(ssm, alg):
+    """Store a signing key, the backend client credentials and the allow-list as the stack does."""
+    private_pem = generate_pem(alg)
+    public_pem = serialization.load_pem_private_key(private_pem.encode('utf-8'), password=None).public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode('utf-8')
+    ssm.put('/oidc/keys/bench/private_key', private_pem)
+    ssm.put('/oidc/keys/bench/public_key', public_pem)
+    ssm.put('/oidc/key_manifest', json.dumps({'keys': [{'kid': 'bench', 'alg': alg, 'activates_at': 0}]}))
+    ssm.put('/oidc/client_id', CLIENT_ID)
+    ssm.put('/oidc/client_secret', CLIENT_SECRET)
+    ssm.put('/oidc/allow-list-chunks/0', f"{ALLOWED_ORIGIN},https://*.example.org")
+
+
+def load_handlers(ssm, generation, with_authorizer=True):
+    """Load fresh handler modules backed by the SSM stub; the authorizer is None when not needed."""
+    authorizer = None
+    if with_authorizer:
+        authorizer = load_lambda(os.path.join(LAMBDAS, 'lambda-authorizer'), f"bench_authorizer_{generation}")
+        authorizer.ssm_client = ssm
+    issuer = load_lambda(os.path.join(LAMBDAS, 'oidc-issuer'), f"bench_issuer_{generation}")
+    issuer.ssm_client = ssm
+    return authorizer, issuer
+
+
+def basic_auth():
+    return 'Basic ' + base64.b64encode(f"{CLIENT_ID}:{CLIENT_SECRET}".encode('utf-8')).decode('utf-8')
+
+
+def invoke(authorizer, issuer, method, path, headers, body=None):
+    """Run one request through the authorizer (on /token routes) and the issuer, as API Gateway would."""
+    authorizer_event, event = api_gateway_events(method, path, headers, body)
+    if path.startswith('/token'):
+        policy = authorizer.lambda_handler(authorizer_event, None)
+        if policy['policyDocument']['Statement'][0]['Effect'] != 'Allow':
+            raise RuntimeError(f"{path} denied by the authorizer")
+        event['requestContext']['authorizer'] = dict(policy.get('context') or {}, principalId=policy['principalId'])
+    response = issuer.lambda_handler(event, None)
+    if response['statusCode'] not in (200, 304):
+        raise RuntimeError(f"{path} returned {response['statusCode']}: {response.get('body')}")
+    return response
+
+
+def scenarios(batch_size):
+    """(name, tokens per request, request factory) of the measured endpoints."""
+    client = {'Authorization': basic_auth()}
+    origin = {'origin': ALLOWED_ORIGIN}
+
+    def token(i):
+        return 'POST', '/token', client, json.dumps({'email': f"user{i}@example.com"})
+
+    def token_origin(i):
+        return 'POST', '/token', origin, json.dumps({'email': f"user{i}@example.com"})
+
+    def batch(i):
+        emails = [f"user{i}-{j}@example.com" for j in range(batch_size)]
+        return 'POST', '/token/batch', client, json.dumps({'emails': emails})
+
+    return [
+        ('/token (client)', 1, token),
+        ('/token (origin)', 1, token_origin),
+        (f"/token/batch x{batch_size}", batch_size, batch),
+        ('openid-configuration', 0, lambda i: ('GET', '/.well-known/openid-configuration', {}, None)),
+        ('jwks.json', 0, lambda i: ('GET', '/.well-known/jwks.json', {}, None)),
+    ]
+
+
+def percentiles(samples):
+    """p50, p95 and p99 of `samples`."""
+    if len(samples) < 2:
+        return samples[0], samples[0], samples[0]
+    quantiles = statistics.quantiles(samples, n=100, method='inclusive')
+    return quantiles[49], quantiles[94], quantiles[98]
+
+
+def print_row(name, samples, tokens_per_second=None):
+    p50, p95, p99 = percentiles(samples)
+    rate = f"{tokens_per_second:>12.0f}" if tokens_per_second is not None else f"{'-':>12}"
+    print(f"{name:<28}{len(samples):>8}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}{rate}")
+
+
+def bench_cold(ssm, batch_size, cold_starts):
+    """Module load and first request of fresh handlers, per endpoint; a new module generation for every sample."""
+    print("\ncold: first request of a new execution environment, ms")
+    print(f"{'endpoint':<28}{'samples':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'tokens/s':>12}")
+    generation = 0
+    for name, _, request in scenarios(batch_size):
+        method, path, headers, body = request(0)
+        samples = []
+        for _ in range(cold_starts):
+            generation += 1
+            start = time.perf_counter()
+            # The well-known routes do not go through the authorizer
+            authorizer, issuer = load_handlers(ssm, generation, with_authorizer=path.startswith('/token'))
+            invoke(authorizer, issuer, method, path, headers, body)
+            samples.append((time.perf_counter() - start) * 1e3)
+            for module in (authorizer, issuer):
+                if module is not None:
+                    del sys.modules[module.__name__]
+        print_row(name, samples)
+
+
+def bench_warm(ssm, batch_size, requests):
+    print("\nwarm: sequential requests to one execution environment, ms")
+    print(f"{'endpoint':<28}{'samples':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'tokens/s':>12}")
+    authorizer, issuer = load_handlers(ssm, 'warm')
+    for name, tokens, request in scenarios(batch_size):
+        # Fill the warm caches before measuring
+        for i in range(5):
+            invoke(authorizer, issuer, *request(i))
+        count = max(requests // max(tokens, 1), 10) if tokens > 1 else requests
+        samples = []
+        start = time.perf_counter()
+        for i in range(count):
+            request_start = time.perf_counter()
+            invoke(authorizer, issuer, *request(i))
+            samples.append((time.perf_counter() - request_start) * 1e3)
+        elapsed = time.perf_counter() - start
+        print_row(name, samples, count * tokens / elapsed if tokens else None)
+
+
+def bench_client(ssm, users, concurrency, sts_latency, use_batch):
+    """TVMClient minting credentials for `users` distinct users through the API Gateway stand-in."""
+    authorizer, issuer = load_handlers(ssm, 'client')
+    samples = {}
+    lock = threading.Lock()
+
+    def record(name, value, unit):
+        if unit == 'Milliseconds':
+            with lock:
+                samples.setdefault(name, []).append(value)
+
+    with LocalApiGateway(authorizer, issuer, sts_latency=sts_latency) as gateway:
+        with TVMClient(gateway.url, CLIENT_ID, CLIENT_SECRET, ROLE_ARN, sts_endpoint_url=gateway.url,
+                       pool_size=concurrency, metrics_callback=record) as client:
+            client.get_sigv4_credentials('warmup@example.com')
+            samples.clear()
+            emails = [f"user{i}@example.com" for i in range(users)]
+            start = time.perf_counter()
+            errors = [result for _, result in client.get_sigv4_credentials_many(
+                emails, max_concurrency=concurrency, use_batch=use_batch) if isinstance(result, Exception)]
+            elapsed = time.perf_counter() - start
+
+    mode = 'batch' if use_batch else 'token'
+    print(f"\nclient ({mode}): {users} users, {concurrency} concurrent calls, "
+          f"{(users - len(errors)) / elapsed:.0f} credentials/s, {len(errors)} errors")
+    if concurrency > 1:
+        print("latencies include GIL queueing, client and stand-in share the process")
+    print(f"{'call':<28}{'samples':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'tokens/s':>12}")
+    for name, values in sorted(samples.items()):
+        print_row(name, values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000, help='warm requests per endpoint')
+    parser.add_argument('--cold-starts', type=int, default=20, help='cold samples per endpoint')
+    parser.add_argument('--users', type=int, default=500, help='distinct users minted through TVMClient')
+    parser.add_argument('--concurrency', type=int, default=16, help='TVMClient calls in flight')
+    parser.add_argument('--batch-size', type=int, default=25, help='emails per /token/batch request')
+    parser.add_argument('--alg', default='RS256', choices=('RS256', 'ES256', 'EdDSA'))
+    parser.add_argument('--ssm-latency', type=float, default=0.005, help='seconds injected per SSM call')
+    parser.add_argument('--sts-latency', type=float, default=0.02, help='seconds injected per STS call')
+    parser.add_argument('--skip', nargs='*', default=[], choices=('cold', 'warm', 'client'))
+    args = parser.parse_args()
+
+    for name, value in ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    # The STS stand-in does not check signatures, any credentials will do
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+
+    ssm = StubSSM(latency=args.ssm_latency)
+    seed_parameters(ssm, args.alg)
+    print(f"{args.alg} signing, SSM latency {args.ssm_latency * 1e3:.1f} ms, STS latency {args.sts_latency * 1e3:.1f} ms")
+
+    if 'cold' not in args.skip:
+        bench_cold(ssm, args.batch_size, args.cold_starts)
+    if 'warm' not in args.skip:
+        bench_warm(ssm, args.batch_size, args.requests)
+    if 'client' not in args.skip:
+        bench_client(ssm, args.users, args.concurrency, args.sts_latency, use_batch=False)
+        bench_client(ssm, args.users, args.concurrency, args.sts_latency, use_batch=True)
+    print(f"\nSSM calls: {ssm.calls}")
+
+
+if __name__ == '__main__':
+    main()
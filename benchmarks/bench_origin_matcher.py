@@ -0,0 +1,72 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Origin allow-list lookup cost: the former comma-separated list scan against
+the compiled OriginMatcher used by the Lambda authorizer.
+
+    python benchmarks/bench_origin_matcher.py --origins 10000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'amzn-q-auth-tvm', 'lambdas', 'lambda-authorizer'))
+from origin_matcher import OriginMatcher  # noqa: E402
+
+
+def build_allow_list(count, wildcard_ratio):
+    wildcards = int(count * wildcard_ratio)
+    exact = [f"https://app{i}.tenant{i}.example.com" for i in range(count - wildcards)]
+    return exact + [f"https://*.customer{i}.example.net" for i in range(wildcards)]
+
+
+def per_lookup_us(fn, origins, number):
+    timer = timeit.Timer(lambda: [fn(origin) for origin in origins])
+    return min(timer.repeat(repeat=5, number=number)) / (number * len(origins)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--origins', type=int, default=10000, help='allow-list size')
+    parser.add_argument('--wildcard-ratio', type=float, default=0.2, help='share of wildcard entries')
+    args = parser.parse_args()
+
+    allow_list = build_allow_list(args.origins, args.wildcard_ratio)
+    raw = ','.join(allow_list)
+    exact_count = args.origins - int(args.origins * args.wildcard_ratio)
+
+    rng = random.Random(7)
+    hits = [f"https://app{i}.tenant{i}.example.com" for i in rng.sample(range(exact_count), 100)]
+    misses = [f"https://unknown{i}.example.org" for i in range(100)]
+    wildcard_hits = [f"https://portal.customer{i}.example.net" for i in rng.sample(range(args.origins - exact_count), 100)] if args.origins > exact_count else []
+
+    start = time.perf_counter()
+    matcher = OriginMatcher(raw.split(','))
+    build_ms = (time.perf_counter() - start) * 1e3
+
+    # Former authorizer behavior: split on every request, then a linear scan (exact matches only)
+    def list_scan(origin):
+        return origin in [domain.strip() for domain in raw.split(',')]
+
+    allow_list_stripped = [domain.strip() for domain in raw.split(',')]
+
+    def list_scan_parsed(origin):
+        return origin in allow_list_stripped
+
+    print(f"allow-list: {args.origins} entries ({args.origins - exact_count} wildcards), matcher build {build_ms:.1f} ms")
+    print(f"{'lookup':<16}{'split+scan':>14}{'scan only':>14}{'OriginMatcher':>16}   (us per lookup)")
+    for name, origins in (('exact hit', hits), ('miss', misses), ('wildcard hit', wildcard_hits)):
+        if not origins:
+            continue
+        print(f"{name:<16}"
+              f"{per_lookup_us(list_scan, origins[:10], 1):>14.2f}"
+              f"{per_lookup_us(list_scan_parsed, origins, 10):>14.2f}"
+              f"{per_lookup_us(matcher.matches, origins, 1000):>16.3f}")
+    print("list scans only support exact entries, their wildcard row is measured as a full miss")
+
+
+if __name__ == '__main__':
+    main()
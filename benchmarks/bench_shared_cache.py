@@ -0,0 +1,89 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Issuer calls made by several worker processes requesting the same users, with
+the per-process in-memory cache and with the shared SQLite and Redis backends.
+
+Each worker builds its own TVMClient, as a gunicorn or Celery worker would, and
+requests credentials for every user. With the in-memory cache every worker
+mints its own credentials; with a shared backend a user is minted about once
+per host. The Redis run uses the local stand-in and needs `pip install redis`.
+The script fails when a shared backend saves no issuer calls, which is what a
+backend falling back to minting on every error looks like.
+
+    pip install boto3 requests
+    python benchmarks/bench_shared_cache.py --workers 4 --users 200
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sample-tvm-backend-usage'))
+from tvm_client import TVMClient  # noqa: E402
+from credential_cache import RedisCredentialCache, SQLiteCredentialCache  # noqa: E402
+from standins import LocalRedisServer, LocalTVMServer  # noqa: E402
+
+ROLE_ARN = 'arn:aws:iam::123456789012:role/tvm'
+
+
+def worker(server_url, make_cache, users, seed):
+    emails = [f"user{i}@example.com" for i in range(users)]
+    random.Random(seed).shuffle(emails)
+    with TVMClient(server_url, 'bench', 'bench', ROLE_ARN, sts_endpoint_url=server_url, cache=make_cache()) as client:
+        for email in emails:
+            client.get_sigv4_credentials(email)
+
+
+def run(server, make_cache, workers, users):
+    before = server.calls.get('/token', 0)
+    start = time.perf_counter()
+    processes = [multiprocessing.Process(target=worker, args=(server.url, make_cache, users, seed)) for seed in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return server.calls.get('/token', 0) - before, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds injected per stand-in response')
+    args = parser.parse_args()
+
+    # The stand-in does not check signatures, any credentials will do
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    # Workers are forked so they can use the caches' factories below
+    multiprocessing.set_start_method('fork')
+
+    backends = [('memory', lambda: None)]
+    path = os.path.join(tempfile.mkdtemp(), 'credentials.db')
+    backends.append(('sqlite', lambda: SQLiteCredentialCache(path)))
+    redis_server = LocalRedisServer()
+    try:
+        import redis  # noqa: F401
+        backends.append(('redis', lambda: RedisCredentialCache(url=redis_server.url)))
+    except ImportError:
+        print("redis not installed, skipping the Redis backend")
+
+    with LocalTVMServer(latency=args.latency) as server, redis_server:
+        print(f"{'backend':<10}{'issuer calls':>14}{'per user':>10}{'seconds':>10}")
+        baseline = None
+        for name, make_cache in backends:
+            calls, elapsed = run(server, make_cache, args.workers, args.users)
+            print(f"{name:<10}{calls:>14}{calls / args.users:>10.2f}{elapsed:>10.2f}")
+            if baseline is None:
+                baseline = calls
+            elif args.workers > 1 and calls >= baseline:
+                # A backend that fails falls back to minting, which would look like a cache that shares nothing
+                raise SystemExit(f"{name}: {calls} issuer calls, no fewer than the per-process cache, credentials were not shared")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Signatures per second for each signing algorithm supported by the OIDC issuer.
+
+Keys are generated in memory the same way `lambdas/key-gen/app.py` does and
+tokens are signed with the same claims shape as `mint_token`, pinned to a
+single core where the platform allows it.
+
+    pip install authlib cryptography
+    python benchmarks/bench_signing.py --seconds 3
+"""
+import argparse
+import datetime
+import os
+import time
+
+from authlib.jose import jwt, JsonWebKey
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519
+
+ALGS = ('RS256', 'ES256', 'EdDSA')
+
+
+def generate_pem(alg):
+    if alg == 'RS256':
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif alg == 'ES256':
+        key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        key = ed25519.Ed25519PrivateKey.generate()
+    return key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    ).decode('utf-8')
+
+
+def claims_for(email):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return {
+        "sub": email,
+        "aud": "bench-audience",
+        "iss": "https://issuer.example.com/prod",
+        "iat": now,
+        "exp": now + datetime.timedelta(hours=1),
+        "email": email,
+        "https://aws.amazon.com/tags": {"principal_tags": {"Email": [email]}}
+    }
+
+
+def bench(alg, seconds):
+    key = JsonWebKey.import_key(generate_pem(alg), {'kid': 'bench'})
+    header = {"alg": alg, "kid": "bench", "typ": "JWS"}
+    # Warm up before measuring
+    for i in range(10):
+        jwt.encode(header=header, payload=claims_for(f"warmup{i}@example.com"), key=key)
+
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        jwt.encode(header=header, payload=claims_for(f"user{count}@example.com"), key=key)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=3.0, help='measurement time per algorithm')
+    parser.add_argument('--algs', nargs='+', default=list(ALGS), choices=ALGS)
+    args = parser.parse_args()
+
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+    baseline = None
+    print(f"{'alg':<8}{'signatures/s':>14}{'vs RS256':>10}")
+    for alg in args.algs:
+        rate = bench(alg, args.seconds)
+        if alg == 'RS256':
+            baseline = rate
+        ratio = f"{rate / baseline:.1f}x" if baseline else '-'
+        print(f"{alg:<8}{rate:>14.0f}{ratio:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Tokens per second of the standalone TVM server (amzn-q-auth-tvm/standalone/server.py)
+for a number of worker processes.
+
+The server is started with a freshly generated parameters file and loaded
+by client processes, each reusing one keep-alive connection for /token calls
+authenticated with the backend client credentials.
+
+    pip install authlib boto3
+    python benchmarks/bench_standalone_server.py --workers 1 2 4 --connections 16 --seconds 5
+"""
+import argparse
+import base64
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SERVER = os.path.join(os.path.dirname(__file__), '..', 'amzn-q-auth-tvm', 'standalone', 'server.py')
+CLIENT_ID = 'bench-client'
+CLIENT_SECRET = 'bench-secret'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start')
+
+
+def client(args):
+    """Call /token on one keep-alive connection until the deadline, return the latencies in ms."""
+    port, index, deadline = args
+    headers = {
+        'Authorization': 'Basic ' + base64.b64encode(f"{CLIENT_ID}:{CLIENT_SECRET}".encode('utf-8')).decode('utf-8'),
+        'Content-Type': 'application/json'
+    }
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    samples = []
+    i = 0
+    while time.time() < deadline:
+        start = time.perf_counter()
+        connection.request('POST', '/token', body=json.dumps({'email': f"user{index}-{i}@example.com"}), headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"/token returned {response.status}")
+        samples.append((time.perf_counter() - start) * 1e3)
+        i += 1
+    connection.close()
+    return samples
+
+
+def bench(parameters_file, workers, connections, seconds):
+    port = free_port()
+    server = subprocess.Popen([
+        sys.executable, SERVER, '--parameters-file', parameters_file, '--issuer-url', f"http://127.0.0.1:{port}",
+        '--audience', 'bench', '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers)
+    ], stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(port)
+        deadline = time.time() + seconds
+        with multiprocessing.Pool(connections) as pool:
+            results = pool.map(client, [(port, index, deadline) for index in range(connections)])
+    finally:
+        server.terminate()
+        server.wait()
+
+    samples = sorted(sample for result in results for sample in result)
+    quantiles = statistics.quantiles(samples, n=100, method='inclusive')
+    return len(samples) / seconds, quantiles[49], quantiles[94], quantiles[98]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    parser.add_argument('--connections', type=int, default=16, help='concurrent keep-alive client connections')
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--alg', default='ES256', choices=('RS256', 'ES256', 'EdDSA'))
+    args = parser.parse_args()
+
+    parameters_file = os.path.join(tempfile.mkdtemp(), 'tvm-parameters.json')
+    subprocess.run([
+        sys.executable, SERVER, '--generate', '--parameters-file', parameters_file, '--alg', args.alg,
+        '--client-id', CLIENT_ID, '--client-secret', CLIENT_SECRET
+    ], check=True, stderr=subprocess.DEVNULL)
+
+    print(f"{args.alg} signing, {args.connections} connections, {os.cpu_count()} CPUs")
+    print(f"{'workers':<10}{'tokens/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for workers in args.workers:
+        rate, p50, p95, p99 = bench(parameters_file, workers, args.connections, args.seconds)
+        print(f"{workers:<10}{rate:>10.0f}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
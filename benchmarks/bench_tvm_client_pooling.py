@@ -0,0 +1,73 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Per-call latency of TVMClient's token + STS path with and without connection
+and client reuse, against a local stand-in of the issuer and STS.
+
+The "per-call" mode reproduces the former behavior: a module-level
+`requests.post` and a new `boto3.client('sts')` for every call. Credential
+caching is disabled so every call goes over the network. The stand-in speaks
+plain HTTP, so the measured savings exclude the TLS handshake a real issuer
+and STS add on top.
+
+    pip install boto3 requests
+    python benchmarks/bench_tvm_client_pooling.py --calls 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import boto3
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sample-tvm-backend-usage'))
+from tvm_client import TVMClient  # noqa: E402
+from standins import LocalTVMServer  # noqa: E402
+
+ROLE_ARN = 'arn:aws:iam::123456789012:role/tvm'
+
+
+def per_call(server, email):
+    response = requests.post(f"{server.url}/token", json={'email': email}, headers={'Authorization': 'Basic eDp5'})
+    response.raise_for_status()
+    sts = boto3.client('sts', region_name='us-east-1', endpoint_url=server.url)
+    sts.assume_role_with_web_identity(RoleArn=ROLE_ARN, RoleSessionName='bench', WebIdentityToken=response.json()['id_token'])
+
+
+def measure(fn, calls):
+    samples = []
+    for i in range(calls):
+        start = time.perf_counter()
+        fn(f"user{i}@example.com")
+        samples.append((time.perf_counter() - start) * 1e3)
+    samples.sort()
+    return statistics.mean(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds injected per stand-in response')
+    args = parser.parse_args()
+
+    # The stand-in does not check signatures, any credentials will do
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+
+    with LocalTVMServer(latency=args.latency) as server:
+        client = TVMClient(server.url, 'bench', 'bench', ROLE_ARN, cache_size=0, sts_endpoint_url=server.url)
+        client.get_sigv4_credentials('warmup@example.com')
+        per_call(server, 'warmup@example.com')
+
+        print(f"{'mode':<10}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'connections':>13}")
+        for name, fn in (('per-call', lambda email: per_call(server, email)), ('pooled', client.get_sigv4_credentials)):
+            connections = server.connections
+            mean, p50, p99 = measure(fn, args.calls)
+            print(f"{name:<10}{mean:>10.2f}{p50:>10.2f}{p99:>10.2f}{server.connections - connections:>13}")
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
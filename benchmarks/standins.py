@@ -0,0 +1,611 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Local stand-ins for the TVM issuer, AWS STS and Redis used by the benchmarks.
+
+`LocalTVMServer` answers `POST /token`, `POST /token/batch` and the STS
+`AssumeRoleWithWebIdentity` query API on a single loopback port, with an
+optional injected latency per call, so `TVMClient` can be pointed at it via
+`issuer=server.url` and `sts_endpoint_url=server.url`.
+
+`LocalS3Server` implements the S3 calls used by the document loader
+(ListObjectsV2, HeadObject, PutObject and multipart uploads) with path-style
+addressing, keeping the objects in memory.
+
+`StubSSM` serves SSM parameters from memory with an optional injected latency
+(including the PutParameter and DeleteParameter(s) calls of key-gen and q-biz),
+and `LocalApiGateway` runs the authorizer and issuer Lambda handlers (loaded
+with `load_lambda`) behind synthetic API Gateway events, answering STS like
+`LocalTVMServer`, so `TVMClient` can run against the real handler code. `LocalSSMServer` serves a
+`StubSSM` over the SSM JSON protocol, for boto3 clients created by the Lambdas
+themselves (`AWS_ENDPOINT_URL_SSM=server.url`).
+
+`LocalRedisServer` speaks enough of the Redis protocol (HELLO with RESP2 or
+RESP3, AUTH, PING, GET, SET with EX/PX, DEL) for `RedisCredentialCache` to be exercised without a Redis install.
+"""
+import datetime
+import hashlib
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+# Shared with the standalone server, re-exported for the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'amzn-q-auth-tvm', 'standalone'))
+from lambda_gateway import api_gateway_events, invoke, load_lambda  # noqa: E402,F401
+
+STS_RESPONSE = """<AssumeRoleWithWebIdentityResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <AssumeRoleWithWebIdentityResult>
+    <Credentials>
+      <AccessKeyId>ASIA{key}</AccessKeyId>
+      <SecretAccessKey>secret{key}</SecretAccessKey>
+      <SessionToken>token{key}</SessionToken>
+      <Expiration>{expiration}</Expiration>
+    </Credentials>
+    <SubjectFromWebIdentityToken>{subject}</SubjectFromWebIdentityToken>
+    <AssumedRoleUser>
+      <Arn>arn:aws:sts::123456789012:assumed-role/tvm/{session}</Arn>
+      <AssumedRoleId>AROA{key}:{session}</AssumedRoleId>
+    </AssumedRoleUser>
+    <Audience>tvm</Audience>
+  </AssumeRoleWithWebIdentityResult>
+  <ResponseMetadata>
+    <RequestId>{request_id}</RequestId>
+  </ResponseMetadata>
+</AssumeRoleWithWebIdentityResponse>"""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes, with Nagle the second waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server.count(self.path)
+        if server.latency:
+            time.sleep(server.latency)
+
+        if self.path.endswith('/token'):
+            email = json.loads(body)['email']
+            self._send(200, json.dumps({'id_token': f"token-{email}"}), 'application/json')
+        elif self.path.endswith('/token/batch'):
+            emails = json.loads(body)['emails']
+            self._send(200, json.dumps({'tokens': {email: f"token-{email}" for email in emails}, 'errors': {}}), 'application/json')
+        else:
+            params = parse_qs(body.decode('utf-8'))
+            session = params.get('RoleSessionName', ['session'])[0]
+            expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=server.credential_ttl)
+            self._send(200, STS_RESPONSE.format(
+                key=uuid.uuid4().hex[:16].upper(),
+                expiration=expiration.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                subject=params.get('WebIdentityToken', [''])[0],
+                session=session,
+                request_id=uuid.uuid4()
+            ), 'text/xml')
+
+
+class LocalTVMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 drops connections opened together by a pool, which retry a second later
+    request_queue_size = 128
+
+    def __init__(self, latency=0.0, credential_ttl=3600):
+        """
+        Args:
+            latency: Seconds added to every response, to emulate a network hop
+            credential_ttl: Lifetime of the STS credentials returned
+        """
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.latency = latency
+        self.credential_ttl = credential_ttl
+        self.calls = {}
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, path):
+        with self._lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class _RedisHandler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        """Read one RESP array of bulk strings, or an inline command."""
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _bulk(self, value):
+        if value is None:
+            # RESP3 has a distinct null type
+            return b'_\r\n' if self.protocol == 3 else b'$-1\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def _hello(self, args):
+        """Switch to the requested protocol version and describe the server, as HELLO [protover [AUTH user pass]] does."""
+        if len(args) > 1:
+            version = int(args[1])
+            if version not in (2, 3):
+                return b'-NOPROTO unsupported protocol version\r\n'
+            self.protocol = version
+        info = [('server', 'redis'), ('version', '7.2.0'), ('proto', self.protocol), ('id', 1),
+                ('mode', 'standalone'), ('role', 'master')]
+        fields = b''.join(self._bulk(key) + self._bulk(value) for key, value in info) + self._bulk('modules') + b'*0\r\n'
+        # A map in RESP3, a flat array of keys and values in RESP2
+        count = len(info) + 1
+        return (b'%%%d\r\n' % count if self.protocol == 3 else b'*%d\r\n' % (2 * count)) + fields
+
+    def handle(self):
+        server = self.server
+        # Connections start in RESP2 until HELLO 3
+        self.protocol = 2
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            if not args:
+                continue
+            command = args[0].upper()
+            server.count(command.decode())
+            if command == b'PING':
+                reply = b'+PONG\r\n'
+            elif command == b'HELLO':
+                reply = self._hello(args)
+            elif command == b'GET':
+                reply = self._bulk(server.get(args[1]))
+            elif command == b'SET':
+                ttl = None
+                options = [arg.upper() for arg in args[3:]]
+                if b'EX' in options:
+                    ttl = float(args[3 + options.index(b'EX') + 1])
+                elif b'PX' in options:
+                    ttl = float(args[3 + options.index(b'PX') + 1]) / 1000
+                server.set(args[1], args[2], ttl)
+                reply = b'+OK\r\n'
+            elif command == b'DEL':
+                reply = b':%d\r\n' % sum(server.delete(key) for key in args[1:])
+            elif command in (b'CLIENT', b'SELECT', b'AUTH'):
+                reply = b'+OK\r\n'
+            else:
+                reply = b'-ERR unknown command\r\n'
+            self.wfile.write(reply)
+
+
+class LocalRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _RedisHandler)
+        self.calls = {}
+        self._data = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+    def count(self, command):
+        with self._lock:
+            self.calls[command] = self.calls.get(command, 0) + 1
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self._data.get(key, (None, None))
+            if expires_at is not None and time.time() >= expires_at:
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl is not None else None)
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class _S3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _target(self):
+        url = urlsplit(self.path)
+        bucket, _, key = url.path.lstrip('/').partition('/')
+        return unquote(bucket), unquote(key), parse_qs(url.query, keep_blank_values=True)
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            raw = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    # Skip the trailers up to the closing blank line
+                    while self.rfile.readline().strip():
+                        pass
+                    break
+                raw += self.rfile.read(size)
+                self.rfile.readline()
+        else:
+            raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if 'aws-chunked' not in self.headers.get('Content-Encoding', ''):
+            return raw
+        # aws-chunked framing: <hex size>[;chunk-signature=...]\r\n<data>\r\n ... 0\r\n<trailers>
+        body, position = b'', 0
+        while True:
+            end = raw.index(b'\r\n', position)
+            size = int(raw[position:end].split(b';')[0], 16)
+            if size == 0:
+                return body
+            body += raw[end + 2:end + 2 + size]
+            position = end + 2 + size + 2
+
+    def do_HEAD(self):
+        bucket, key, _ = self._target()
+        self.server.count('HeadObject')
+        obj = self.server.objects.get((bucket, key))
+        if obj is None:
+            return self._send(404)
+        headers = {'ETag': f'"{obj["etag"]}"', 'Content-Type': 'binary/octet-stream'}
+        headers.update({f'x-amz-meta-{name}': value for name, value in obj['metadata'].items()})
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(obj['body'])))
+        self.end_headers()
+
+    def do_GET(self):
+        bucket, key, query = self._target()
+        if key:
+            self.server.count('GetObject')
+            obj = self.server.objects.get((bucket, key))
+            return self._send(200, obj['body'], {'ETag': f'"{obj["etag"]}"'}) if obj else self._send(404)
+
+        self.server.count('ListObjectsV2')
+        prefix = query.get('prefix', [''])[0]
+        start_after = query.get('continuation-token', [''])[0]
+        keys = sorted(k for b, k in self.server.objects if b == bucket and k.startswith(prefix) and k > start_after)
+        page, truncated = keys[:1000], len(keys) > 1000
+        contents = ''.join(
+            f"<Contents><Key>{escape(k)}</Key><ETag>&quot;{self.server.objects[(bucket, k)]['etag']}&quot;</ETag>"
+            f"<Size>{len(self.server.objects[(bucket, k)]['body'])}</Size><LastModified>2024-01-01T00:00:00.000Z</LastModified>"
+            f"<StorageClass>STANDARD</StorageClass></Contents>"
+            for k in page
+        )
+        token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ''
+        body = (f'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                f"<Name>{bucket}</Name><Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount><MaxKeys>1000</MaxKeys>"
+                f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>{contents}{token}</ListBucketResult>")
+        self._send(200, body.encode('utf-8'), {'Content-Type': 'application/xml'})
+
+    def do_PUT(self):
+        bucket, key, query = self._target()
+        body = self._read_body()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        etag = hashlib.md5(body).hexdigest()
+        if 'uploadId' in query:
+            self.server.count('UploadPart')
+            self.server.uploads[query['uploadId'][0]]['parts'][int(query['partNumber'][0])] = body
+        else:
+            self.server.count('PutObject')
+            metadata = {name[len('x-amz-meta-'):]: value for name, value in self.headers.items() if name.lower().startswith('x-amz-meta-')}
+            self.server.objects[(bucket, key)] = {'body': body, 'etag': etag, 'metadata': metadata}
+        self._send(200, headers={'ETag': f'"{etag}"'})
+
+    def do_POST(self):
+        bucket, key, query = self._target()
+        self._read_body()
+        if 'uploads' in query:
+            self.server.count('CreateMultipartUpload')
+            upload_id = uuid.uuid4().hex
+            metadata = {name[len('x-amz-meta-'):]: value for name, value in self.headers.items() if name.lower().startswith('x-amz-meta-')}
+            self.server.uploads[upload_id] = {'parts': {}, 'metadata': metadata}
+            body = (f'<?xml version="1.0" encoding="UTF-8"?><InitiateMultipartUploadResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                    f"<Bucket>{bucket}</Bucket><Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+        else:
+            self.server.count('CompleteMultipartUpload')
+            upload = self.server.uploads.pop(query['uploadId'][0])
+            parts = [upload['parts'][number] for number in sorted(upload['parts'])]
+            digest = hashlib.md5(b''.join(hashlib.md5(part).digest() for part in parts)).hexdigest()
+            etag = f"{digest}-{len(parts)}"
+            self.server.objects[(bucket, key)] = {'body': b''.join(parts), 'etag': etag, 'metadata': upload['metadata']}
+            body = (f'<?xml version="1.0" encoding="UTF-8"?><CompleteMultipartUploadResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                    f"<Bucket>{bucket}</Bucket><Key>{escape(key)}</Key><ETag>&quot;{etag}&quot;</ETag></CompleteMultipartUploadResult>")
+        self._send(200, body.encode('utf-8'), {'Content-Type': 'application/xml'})
+
+
+class LocalS3Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        """
+        Args:
+            latency: Seconds added to every upload, to emulate a network hop
+        """
+        super().__init__(('127.0.0.1', 0), _S3Handler)
+        self.latency = latency
+        self.objects = {}
+        self.uploads = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class _SSMExceptions:
+    class ParameterNotFound(KeyError):
+        pass
+
+
+class StubSSM:
+    """In-memory stand-in of the SSM client calls made by the Lambdas."""
+
+    # Raised as the boto3 client does, and a KeyError for LocalSSMServer
+    exceptions = _SSMExceptions
+
+    def __init__(self, latency=0.0):
+        """
+        Args:
+            latency: Seconds added to every call, to emulate the SSM round trip
+        """
+        self.latency = latency
+        self.calls = {}
+        self._parameters = {}
+        self._lock = threading.Lock()
+
+    def put(self, name, value):
+        with self._lock:
+            _, version = self._parameters.get(name, (None, 0))
+            self._parameters[name] = (value, version + 1)
+
+    def _call(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _parameter(self, name):
+        if name not in self._parameters:
+            raise self.exceptions.ParameterNotFound(name)
+        value, version = self._parameters[name]
+        return {'Name': name, 'Value': value, 'Version': version}
+
+    def get_parameter(self, Name, WithDecryption=False):
+        self._call('GetParameter')
+        return {'Parameter': self._parameter(Name)}
+
+    def get_parameters(self, Names, WithDecryption=False):
+        self._call('GetParameters')
+        return {
+            'Parameters': [self._parameter(name) for name in Names if name in self._parameters],
+            'InvalidParameters': [name for name in Names if name not in self._parameters]
+        }
+
+    def put_parameter(self, Name, Value, Type='String', Overwrite=False):
+        self._call('PutParameter')
+        self.put(Name, Value)
+        return {'Version': self._parameters[Name][1]}
+
+    def delete_parameter(self, Name):
+        self._call('DeleteParameter')
+        with self._lock:
+            if self._parameters.pop(Name, None) is None:
+                raise self.exceptions.ParameterNotFound(Name)
+        return {}
+
+    def delete_parameters(self, Names):
+        self._call('DeleteParameters')
+        with self._lock:
+            deleted = [name for name in Names if self._parameters.pop(name, None) is not None]
+        return {'DeletedParameters': deleted, 'InvalidParameters': [name for name in Names if name not in deleted]}
+
+    def get_parameters_by_path(self, Path, Recursive=False, WithDecryption=False, NextToken=None):
+        self._call('GetParametersByPath')
+        prefix = Path.rstrip('/') + '/'
+        names = sorted(name for name in self._parameters if name.startswith(prefix)
+                       and (Recursive or '/' not in name[len(prefix):]))
+        return {'Parameters': [self._parameter(name) for name in names]}
+
+
+class _GatewayHandler(_Handler):
+    def _invoke(self, method, body=None):
+        server = self.server
+        path = urlsplit(self.path).path
+        server.count(path)
+        try:
+            response = invoke(server.authorizer, server.issuer, method, path, dict(self.headers), body, server.stage)
+        except Exception as e:
+            self._send(500, json.dumps({'message': str(e)}), 'application/json')
+            return
+
+        payload = response.get('body', '').encode('utf-8')
+        self.send_response(response['statusCode'])
+        for name, value in (response.get('headers') or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._invoke('GET')
+
+    def do_POST(self):
+        if not urlsplit(self.path).path.startswith('/token'):
+            # STS AssumeRoleWithWebIdentity
+            super().do_POST()
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._invoke('POST', body.decode('utf-8'))
+
+
+class LocalApiGateway(LocalTVMServer):
+    """
+    HTTP stand-in of the TVM API: /token and /token/batch go through the
+    authorizer then the issuer handler, the well-known routes straight to the
+    issuer, and any other POST is answered as STS.
+    """
+
+    def __init__(self, authorizer, issuer, stage='prod', sts_latency=0.0, credential_ttl=3600):
+        """
+        Args:
+            authorizer: Loaded lambda-authorizer module
+            issuer: Loaded oidc-issuer module
+            stage: API Gateway stage passed in the events
+            sts_latency: Seconds added to every STS response
+            credential_ttl: Lifetime of the STS credentials returned
+        """
+        super().__init__(latency=sts_latency, credential_ttl=credential_ttl)
+        self.RequestHandlerClass = _GatewayHandler
+        self.authorizer = authorizer
+        self.issuer = issuer
+        self.stage = stage
+
+
+class _SSMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # X-Amz-Target operation -> StubSSM method, the request members are passed as keyword arguments
+    OPERATIONS = {
+        'AmazonSSM.GetParameter': 'get_parameter',
+        'AmazonSSM.GetParameters': 'get_parameters',
+        'AmazonSSM.GetParametersByPath': 'get_parameters_by_path',
+        'AmazonSSM.PutParameter': 'put_parameter',
+        'AmazonSSM.DeleteParameter': 'delete_parameter',
+        'AmazonSSM.DeleteParameters': 'delete_parameters',
+    }
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, document):
+        payload = json.dumps(document).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        operation = self.OPERATIONS.get(self.headers.get('X-Amz-Target'))
+        if operation is None:
+            self._send(400, {'__type': 'UnknownOperationException', 'message': self.headers.get('X-Amz-Target')})
+            return
+        try:
+            self._send(200, getattr(self.server.ssm, operation)(**body))
+        except KeyError as e:
+            self._send(400, {'__type': 'ParameterNotFound', 'message': f"Parameter {e} not found"})
+
+
+class LocalSSMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, ssm):
+        """
+        Args:
+            ssm: StubSSM holding the parameters, its latency applies to every call
+        """
+        super().__init__(('127.0.0.1', 0), _SSMHandler)
+        self.ssm = ssm
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,361 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import asyncio
+import base64
+import datetime
+import random
+import time
+import xml.etree.ElementTree as ET
+from typing import AsyncIterator, Callable, Iterable, Optional, Tuple, Union
+import aiohttp
+from credential_cache import CredentialCache
+
+STS_NAMESPACE = {'sts': 'https://sts.amazonaws.com/doc/2011-06-15/'}
+# STS error codes worth retrying, AssumeRoleWithWebIdentity also fails transiently while fetching the JWKS
+RETRYABLE_STS_ERRORS = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'IDPCommunicationError', 'ServiceUnavailable')
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+class TVMRequestError(Exception):
+    def __init__(self, status: int, message: str, retryable: bool = False):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.retryable = retryable
+
+class TVMTokenError(Exception):
+    """
+    The issuer refused to mint a token for an email of a batch
+    """
+
+class AsyncTVMClient:
+    def __init__(self, issuer: str, client_id: str, client_secret: str, role_arn: str, region: str = 'us-east-1',
+                 cache_size: int = 1024, refresh_skew: float = 300, pool_size: int = 100, max_retries: int = 3,
+                 timeout: float = 10, sts_endpoint_url: Optional[str] = None,
+                 metrics_callback: Optional[Callable[[str, float, str], None]] = None):
+        """
+        asyncio counterpart of TVMClient, the issuer and STS calls never block the event loop.
+        get_sigv4_credentials, get_sigv4_credentials_many, invalidate, stats and
+        metrics_callback match TVMClient, the calls are awaited. Not available:
+        background_refresh (and the refresh counts of stats stay 0) and shared
+        cache backends, whose SQLite and Redis calls would block the event loop.
+
+        Args:
+            issuer: The token issuer URL
+            role_arn: The ARN of the role to assume
+            region: AWS region (default: us-east-1)
+            cache_size: Maximum number of users whose credentials are cached, 0 disables caching (default: 1024)
+            refresh_skew: Seconds before the STS expiration at which cached credentials are renewed (default: 300)
+            pool_size: Maximum number of concurrent connections shared by the issuer and STS calls (default: 100)
+            max_retries: Retries for throttled, failed or unreachable issuer and STS calls (default: 3)
+            timeout: Seconds to wait for each issuer or STS call (default: 10)
+            sts_endpoint_url: Override the STS endpoint, e.g. a VPC endpoint (default: regional endpoint)
+            metrics_callback: Called as metrics_callback(name, value, unit) with the duration of every
+                issuer call (IdTokenFetch, IdTokenBatchFetch) and STS exchange (StsExchange) in
+                Milliseconds, and a CacheHit or CacheMiss Count per lookup. It runs on the event
+                loop and must not block (default: None, nothing is measured)
+        """
+        self.issuer = issuer
+        self.role_arn = role_arn
+        self.region = region
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_skew = refresh_skew
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.sts_endpoint_url = sts_endpoint_url or f"https://sts.{region}.amazonaws.com/"
+        self._cache = CredentialCache(cache_size)
+        self._metrics_callback = metrics_callback
+        self._hits = 0
+        self._misses = 0
+        # Fetches in flight per email, concurrent callers for the same email await the same one
+        self._inflight = {}
+        # Created on first use, aiohttp sessions must be created inside the running event loop
+        self._session = None
+
+        # Create basic auth header
+        auth_string = f"{self.client_id}:{self.client_secret}"
+        auth_bytes = auth_string.encode('utf-8')
+        self._auth = base64.b64encode(auth_bytes).decode('utf-8')
+
+    async def close(self):
+        """
+        Close the pooled connections
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def stats(self) -> dict:
+        """
+        Cache hits and misses of the get_sigv4_credentials calls, refreshes are always 0 without background refresh
+        """
+        return {'hits': self._hits, 'misses': self._misses, 'refreshes': 0, 'refresh_failures': 0}
+
+    def _record(self, hit: bool):
+        # Only called on the event loop, no lock needed
+        if hit:
+            self._hits += 1
+        else:
+            self._misses += 1
+        if self._metrics_callback is not None:
+            self._metrics_callback('CacheHit' if hit else 'CacheMiss', 1, 'Count')
+
+    async def _timed(self, name: str, call):
+        """
+        Run _with_retries(call), reporting its duration, retries included, as `name`
+        """
+        if self._metrics_callback is None:
+            return await self._with_retries(call)
+        start = time.perf_counter()
+        try:
+            return await self._with_retries(call)
+        finally:
+            self._metrics_callback(name, (time.perf_counter() - start) * 1000, 'Milliseconds')
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Return the HTTP session whose connection pool is shared by the issuer and STS calls
+        """
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def _with_retries(self, call):
+        """
+        Run call, retrying retryable failures with jittered exponential backoff
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await call()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError, TVMRequestError) as e:
+                retryable = not isinstance(e, TVMRequestError) or e.retryable
+                if not retryable or attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(random.uniform(0, 0.2 * 2 ** attempt))
+
+    async def _fetch_id_token(self, email: str) -> str:
+        """
+        Fetch ID token from the issuer
+
+        Args:
+            email: Email address for token request
+
+        Returns:
+            str: The ID token
+
+        Raises:
+            TVMRequestError: If the issuer rejects the request
+        """
+        async def call():
+            async with self._get_session().post(
+                f"{self.issuer}/token",
+                headers={
+                    'Authorization': f'Basic {self._auth}',
+                    # With authorizer caching enabled API Gateway requires the Origin
+                    # header, a non allow-listed origin falls back to the credentials
+                    'Origin': self.issuer,
+                },
+                json={'email': email}
+            ) as response:
+                if response.status != 200:
+                    raise TVMRequestError(response.status, await response.text(), response.status in RETRYABLE_STATUS)
+                return (await response.json())['id_token']
+        return await self._timed('IdTokenFetch', call)
+
+    async def _fetch_id_tokens(self, emails: list) -> Tuple[dict, dict]:
+        """
+        Fetch ID tokens for several emails with one call to the issuer's batch endpoint
+
+        Args:
+            emails: Email addresses, at most the issuer's batch limit (100 by default)
+
+        Returns:
+            tuple: {email: id_token} and {email: error message} for the emails the issuer refused
+
+        Raises:
+            TVMRequestError: If the batch call fails as a whole
+        """
+        async def call():
+            async with self._get_session().post(
+                f"{self.issuer}/token/batch",
+                headers={'Authorization': f'Basic {self._auth}', 'Origin': self.issuer},
+                json={'emails': emails}
+            ) as response:
+                if response.status != 200:
+                    raise TVMRequestError(response.status, await response.text(), response.status in RETRYABLE_STATUS)
+                body = await response.json()
+                return body['tokens'], body['errors']
+        return await self._timed('IdTokenBatchFetch', call)
+
+    async def _assume_role_with_web_identity(self, email: str, id_token: str) -> Tuple[dict, float]:
+        """
+        Call STS AssumeRoleWithWebIdentity over the query API, the action is not SigV4 signed
+
+        Returns:
+            tuple: The SigV4 credentials and their expiration as epoch seconds
+
+        Raises:
+            TVMRequestError: If STS rejects the request
+        """
+        async def call():
+            async with self._get_session().post(
+                self.sts_endpoint_url,
+                data={
+                    'Action': 'AssumeRoleWithWebIdentity',
+                    'Version': '2011-06-15',
+                    'RoleArn': self.role_arn,
+                    'RoleSessionName': f"session-{email}",
+                    'WebIdentityToken': id_token
+                }
+            ) as response:
+                body = await response.text()
+                if response.status != 200:
+                    try:
+                        code = ET.fromstring(body).findtext('.//sts:Error/sts:Code', default='', namespaces=STS_NAMESPACE)
+                    except ET.ParseError:
+                        code = ''
+                    raise TVMRequestError(response.status, body, response.status in RETRYABLE_STATUS or code in RETRYABLE_STS_ERRORS)
+                return body
+        body = await self._timed('StsExchange', call)
+
+        credentials = ET.fromstring(body).find('.//sts:Credentials', STS_NAMESPACE)
+        expiration = datetime.datetime.fromisoformat(credentials.findtext('sts:Expiration', namespaces=STS_NAMESPACE).replace('Z', '+00:00'))
+        return {
+            "aws_access_key_id": credentials.findtext('sts:AccessKeyId', namespaces=STS_NAMESPACE),
+            "aws_secret_access_key": credentials.findtext('sts:SecretAccessKey', namespaces=STS_NAMESPACE),
+            "aws_session_token": credentials.findtext('sts:SessionToken', namespaces=STS_NAMESPACE)
+        }, expiration.timestamp()
+
+    async def _assume_role(self, email: str) -> Tuple[dict, float]:
+        id_token = await self._fetch_id_token(email)
+        return await self._assume_role_with_web_identity(email, id_token)
+
+    async def get_sigv4_credentials(self, email: str) -> dict:
+        """
+        Get SigV4 credentials for the user, served from the cache until they are
+        within refresh_skew seconds of their STS expiration
+
+        Args:
+            email: Email for token request
+
+        Returns:
+            dict: aws_access_key_id, aws_secret_access_key and aws_session_token, ready to pass to boto3.client
+        """
+        credentials = self._cache.get(email, self.refresh_skew)
+        self._record(credentials is not None)
+        if credentials is not None:
+            return dict(credentials)
+
+        # Single-threaded event loop: no await between the lookup and the registration
+        task = self._inflight.get(email)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_cache(email))
+            self._inflight[email] = task
+        # Shield so a cancelled caller does not cancel the fetch other callers are waiting on
+        return dict(await asyncio.shield(task))
+
+    async def _fetch_and_cache(self, email: str) -> dict:
+        try:
+            credentials, expiration = await self._assume_role(email)
+            self._cache.put(email, credentials, expiration)
+            return credentials
+        finally:
+            self._inflight.pop(email, None)
+
+    def invalidate(self, email: str):
+        """
+        Drop the cached credentials for the user, e.g. after an access denied error
+        """
+        self._cache.invalidate(email)
+
+    async def get_sigv4_credentials_many(self, emails: Iterable[str], max_concurrency: int = 16, use_batch: bool = True,
+                                         batch_size: int = 100) -> AsyncIterator[Tuple[str, Union[dict, Exception]]]:
+        """
+        Get SigV4 credentials for many users, yielding each result as soon as it is available,
+        as TVMClient.get_sigv4_credentials_many does: `async for email, result in ...`
+
+        Args:
+            emails: Emails to get credentials for, duplicates are fetched once
+            max_concurrency: Maximum number of issuer and STS calls in flight (default: 16)
+            use_batch: Use the issuer's /token/batch endpoint (default: True)
+            batch_size: Emails per batch call, must not exceed the issuer's batch limit (default: 100)
+
+        Yields:
+            tuple: The email and either its credentials dict or the exception raised for it
+        """
+        pending = []
+        for email in dict.fromkeys(emails):
+            credentials = self._cache.get(email, self.refresh_skew)
+            self._record(credentials is not None)
+            if credentials is not None:
+                yield email, dict(credentials)
+            else:
+                pending.append(email)
+        if not pending:
+            return
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+        # task -> (kind of call, email or batch of emails)
+        tasks = {}
+
+        def submit(kind, key, call, *args):
+            async def limited():
+                async with semaphore:
+                    return await call(*args)
+            tasks[asyncio.ensure_future(limited())] = (kind, key)
+
+        if use_batch:
+            for i in range(0, len(pending), batch_size):
+                batch = pending[i:i + batch_size]
+                submit('batch', batch, self._fetch_id_tokens, batch)
+        else:
+            for email in pending:
+                submit('token', email, self._fetch_id_token, email)
+
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    kind, key = tasks.pop(task)
+                    if kind == 'batch':
+                        try:
+                            tokens, errors = task.result()
+                        except (aiohttp.ClientError, asyncio.TimeoutError, TVMRequestError):
+                            # Issuer without a batch endpoint or failed batch, fetch the tokens one by one
+                            for email in key:
+                                submit('token', email, self._fetch_id_token, email)
+                            continue
+                        for email in key:
+                            if email in tokens:
+                                submit('credentials', email, self._assume_role_with_web_identity, email, tokens[email])
+                            else:
+                                yield email, TVMTokenError(errors.get(email, 'no token returned'))
+                    elif kind == 'token':
+                        try:
+                            id_token = task.result()
+                        except Exception as e:
+                            yield key, e
+                            continue
+                        submit('credentials', key, self._assume_role_with_web_identity, key, id_token)
+                    else:
+                        try:
+                            credentials, expiration = task.result()
+                        except Exception as e:
+                            yield key, e
+                            continue
+                        self._cache.put(key, credentials, expiration)
+                        yield key, dict(credentials)
+        finally:
+            # Do not wait for or start remaining calls if the caller stopped iterating
+            for task in tasks:
+                task.cancel()
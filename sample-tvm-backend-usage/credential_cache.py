@@ -0,0 +1,233 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class CredentialCache:
+    def __init__(self, max_size: int = 1024):
+        """
+        Thread-safe LRU cache of SigV4 credentials keyed by email
+        
+        Args:
+            max_size: Maximum number of users kept, the least recently used is evicted first
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, email: str, min_ttl: float = 0) -> Optional[dict]:
+        """
+        Return the cached credentials for email if they stay valid for more than min_ttl seconds
+        """
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None:
+                return None
+            credentials, expiration = entry
+            if expiration - time.time() <= min_ttl:
+                return None
+            self._entries.move_to_end(email)
+            return credentials
+
+    def put(self, email: str, credentials: dict, expiration: float):
+        """
+        Store credentials expiring at the given epoch time
+        """
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[email] = (credentials, expiration)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def contains(self, email: str) -> bool:
+        """
+        Whether unexpired credentials are cached for email, without counting as a use
+        """
+        with self._lock:
+            entry = self._entries.get(email)
+            return entry is not None and entry[1] > time.time()
+
+    def invalidate(self, email: str):
+        with self._lock:
+            self._entries.pop(email, None)
+
+
+class SQLiteCredentialCache:
+    def __init__(self, path: str, purge_interval: float = 60, busy_timeout: float = 5):
+        """
+        Credential cache in a SQLite file shared by the worker processes of a host,
+        so a user's credentials are minted once per host instead of once per process
+        
+        The file holds live credentials and is created readable by its owner only.
+        Put it on a tmpfs such as /dev/shm to keep it off disk.
+        
+        Args:
+            path: Database file, created if missing
+            purge_interval: Minimum seconds between two deletions of expired entries (default: 60)
+            busy_timeout: Seconds to wait for a write lock held by another process (default: 5)
+        """
+        self.path = path
+        self.purge_interval = purge_interval
+        self.busy_timeout = busy_timeout
+        self._next_purge = 0.0
+        # sqlite3 connections must not be shared across threads nor inherited across fork
+        self._local = threading.local()
+        os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS credentials (email TEXT PRIMARY KEY, credentials TEXT NOT NULL, expiration REAL NOT NULL)'
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            # Autocommit, every statement is its own atomic transaction
+            connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            # WAL lets readers proceed while another process writes
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, email: str, min_ttl: float = 0) -> Optional[dict]:
+        """
+        Return the cached credentials for email if they stay valid for more than min_ttl seconds
+        """
+        try:
+            row = self._connect().execute(
+                'SELECT credentials FROM credentials WHERE email = ? AND expiration > ?',
+                (email, time.time() + min_ttl)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Credential cache lookup failed: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def contains(self, email: str) -> bool:
+        """
+        Whether unexpired credentials are cached for email
+        """
+        return self.get(email) is not None
+
+    def put(self, email: str, credentials: dict, expiration: float):
+        """
+        Store credentials expiring at the given epoch time
+        """
+        try:
+            connection = self._connect()
+            connection.execute(
+                'INSERT OR REPLACE INTO credentials (email, credentials, expiration) VALUES (?, ?, ?)',
+                (email, json.dumps(credentials), expiration)
+            )
+            now = time.time()
+            if now >= self._next_purge:
+                self._next_purge = now + self.purge_interval
+                connection.execute('DELETE FROM credentials WHERE expiration <= ?', (now,))
+        except sqlite3.Error as e:
+            logger.warning(f"Credential cache update failed: {e}")
+
+    def invalidate(self, email: str):
+        try:
+            self._connect().execute('DELETE FROM credentials WHERE email = ?', (email,))
+        except sqlite3.Error as e:
+            logger.warning(f"Credential cache invalidation failed: {e}")
+
+class RedisCredentialCache:
+    def __init__(self, client=None, url: str = 'redis://localhost:6379/0', prefix: str = 'tvm:credentials:'):
+        """
+        Credential cache in Redis, or any server speaking the Redis protocol, shared by
+        all the processes and hosts pointing at it. Entries expire with the credentials.
+        
+        Args:
+            client: A redis.Redis compatible client, created from url when omitted (requires `pip install redis`)
+            url: Server URL used when no client is given (default: redis://localhost:6379/0)
+            prefix: Prefix of the keys holding the credentials (default: tvm:credentials:)
+        """
+        if client is None:
+            # Optional dependency, only needed by this backend
+            import redis
+            client = redis.Redis.from_url(url)
+        self._client = client
+        self.prefix = prefix
+        # Number of failed calls since the cache was last reachable, 0 while it works
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _failed(self, operation: str, error: Exception):
+        """Log the first failure of an outage as an error and the next ones at debug level."""
+        with self._lock:
+            self.failures += 1
+            first = self.failures == 1
+        if first:
+            logger.error(f"Redis credential cache {operation} failed, minting without the shared cache until it recovers: {error!r}")
+        else:
+            logger.debug(f"Redis credential cache {operation} failed: {error!r}")
+
+    def _succeeded(self):
+        if self.failures:
+            with self._lock:
+                failures, self.failures = self.failures, 0
+            if failures:
+                logger.info(f"Redis credential cache reachable again after {failures} failed calls")
+
+    def get(self, email: str, min_ttl: float = 0) -> Optional[dict]:
+        """
+        Return the cached credentials for email if they stay valid for more than min_ttl seconds
+        """
+        try:
+            raw = self._client.get(self.prefix + email)
+        except Exception as e:
+            # Fall back to minting when the cache is unreachable
+            self._failed('lookup', e)
+            return None
+        self._succeeded()
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        if entry['expiration'] - time.time() <= min_ttl:
+            return None
+        return entry['credentials']
+
+    def contains(self, email: str) -> bool:
+        """
+        Whether credentials are cached for email, Redis expires them with the credentials
+        """
+        try:
+            found = bool(self._client.exists(self.prefix + email))
+        except Exception as e:
+            self._failed('lookup', e)
+            return False
+        self._succeeded()
+        return found
+
+    def put(self, email: str, credentials: dict, expiration: float):
+        """
+        Store credentials expiring at the given epoch time
+        """
+        ttl = int(expiration - time.time())
+        if ttl <= 0:
+            return
+        try:
+            self._client.set(self.prefix + email, json.dumps({'credentials': credentials, 'expiration': expiration}), ex=ttl)
+        except Exception as e:
+            self._failed('update', e)
+            return
+        self._succeeded()
+
+    def invalidate(self, email: str):
+        try:
+            self._client.delete(self.prefix + email)
+        except Exception as e:
+            self._failed('invalidation', e)
+            return
+        self._succeeded()
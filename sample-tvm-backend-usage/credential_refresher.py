@@ -0,0 +1,150 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+import heapq
+import logging
+import random
+import threading
+import time
+from typing import Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+class CredentialRefresher:
+    def __init__(self, fetch: Callable[[str], Tuple[dict, float]], cache, refresh_skew: float,
+                 refresh_ahead: float = 600, active_window: float = 900, max_refresh_rate: float = 10,
+                 retry_delay: float = 30):
+        """
+        Background thread renewing the cached credentials of recently active users
+        before they expire, so their requests never wait on the issuer and STS
+
+        Args:
+            fetch: Returns fresh credentials and their expiration epoch for an email
+            cache: CredentialCache the renewed credentials are stored in, users it no longer holds
+                (evicted or expired) are not refreshed
+            refresh_skew: Seconds before expiration at which callers would renew credentials themselves
+            refresh_ahead: Refreshes are spread at random over this many seconds before that point, so
+                users whose credentials were minted together are not renewed together (default: 600)
+            active_window: Users not seen for this many seconds are no longer refreshed (default: 900)
+            max_refresh_rate: Maximum refreshes per second sent to the issuer (default: 10)
+            retry_delay: Seconds before a failed refresh is retried (default: 30)
+        """
+        self._fetch = fetch
+        self._cache = cache
+        self.refresh_skew = refresh_skew
+        self.refresh_ahead = refresh_ahead
+        self.active_window = active_window
+        self.max_refresh_rate = max_refresh_rate
+        self.retry_delay = retry_delay
+        self.refreshes = 0
+        self.failures = 0
+        # Min-heap of (refresh_at epoch, email); _scheduled holds the current time per email,
+        # heap entries that no longer match it are stale and skipped
+        self._heap = []
+        self._scheduled = {}
+        # Last use per scheduled email, users inactive for longer than active_window are pruned
+        self._last_used = {}
+        self._next_prune = time.monotonic() + active_window
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='tvm-credential-refresher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def touch(self, email: str):
+        """
+        Record that the user's credentials were just used. Users not scheduled yet start being
+        tracked when their credentials are stored, a failed fetch leaves nothing behind.
+        """
+        with self._condition:
+            if email in self._last_used:
+                self._last_used[email] = time.monotonic()
+
+    def schedule(self, email: str, expiration: float):
+        """
+        Plan the next refresh of credentials expiring at the given epoch time
+        """
+        self._push(email, expiration - self.refresh_skew - random.uniform(0, self.refresh_ahead))
+
+    def _push(self, email: str, refresh_at: float):
+        with self._condition:
+            now = time.monotonic()
+            if now >= self._next_prune:
+                self._prune(now)
+            self._last_used.setdefault(email, now)
+            self._scheduled[email] = refresh_at
+            heapq.heappush(self._heap, (refresh_at, email))
+            self._condition.notify()
+
+    def _forget(self, email: str):
+        self._last_used.pop(email, None)
+        self._scheduled.pop(email, None)
+
+    def _prune(self, now: float):
+        """
+        Forget the users inactive for longer than active_window and drop their stale heap
+        entries, called with the condition held at most once per active_window
+        """
+        self._next_prune = now + self.active_window
+        for email in [email for email, last_used in self._last_used.items() if now - last_used > self.active_window]:
+            self._forget(email)
+        if len(self._heap) > 2 * len(self._scheduled):
+            self._heap = [(refresh_at, email) for refresh_at, email in self._heap if self._scheduled.get(email) == refresh_at]
+            heapq.heapify(self._heap)
+
+    def _next_due(self, not_before: float):
+        """
+        Block until a refresh is due and the rate limit allows it, return its email or None once stopped
+        """
+        with self._condition:
+            while not self._stopped:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                refresh_at, email = self._heap[0]
+                if self._scheduled.get(email) != refresh_at:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = max(refresh_at - time.time(), not_before - time.monotonic())
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._scheduled[email]
+                if time.monotonic() - self._last_used.get(email, 0) > self.active_window:
+                    # Inactive user, let the credentials expire
+                    self._forget(email)
+                    continue
+                return email
+        return None
+
+    def _run(self):
+        not_before = 0.0
+        while True:
+            email = self._next_due(not_before)
+            if email is None:
+                return
+            if not self._cache.contains(email):
+                # Evicted from the cache, a refresh would bring the user back in
+                with self._condition:
+                    if email not in self._scheduled:
+                        self._forget(email)
+                continue
+            not_before = time.monotonic() + 1 / self.max_refresh_rate
+            try:
+                credentials, expiration = self._fetch(email)
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Background refresh failed for {email}, retrying in {self.retry_delay}s: {e}")
+                self._push(email, time.time() + self.retry_delay)
+                continue
+            self._cache.put(email, credentials, expiration)
+            self.refreshes += 1
+            self.schedule(email, expiration)
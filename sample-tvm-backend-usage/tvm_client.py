@@ -1,11 +1,43 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 import base64
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, Iterator, Optional, Tuple, Union
 import requests
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+# Copy credential_cache.py next to this file, and credential_refresher.py for background_refresh
+from credential_cache import CredentialCache
+
+# STS error codes retried with backoff, AssumeRoleWithWebIdentity also fails transiently while fetching the JWKS
+RETRYABLE_STS_ERRORS = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'IDPCommunicationError')
+
+def _is_retryable_sts_error(error: Exception) -> bool:
+    """Throttling, transient IdP and server errors, and failed connections are worth another attempt."""
+    if isinstance(error, (BotocoreConnectionError, HTTPClientError)):
+        return True
+    if isinstance(error, ClientError):
+        return (error.response['Error']['Code'] in RETRYABLE_STS_ERRORS
+                or error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500)
+    return False
+
+class TVMTokenError(Exception):
+    """
+    The issuer refused to mint a token for an email of a batch
+    """
 
 class TVMClient:
-    def __init__(self, issuer: str, client_id: str, client_secret:str, role_arn: str, region: str = 'us-east-1'):
+    def __init__(self, issuer: str, client_id: str, client_secret:str, role_arn: str, region: str = 'us-east-1',
+                 cache_size: int = 1024, refresh_skew: float = 300, pool_size: int = 10, max_retries: int = 3,
+                 timeout: float = 10, sts_endpoint_url: Optional[str] = None, background_refresh: bool = False,
+                 refresh_ahead: float = 600, active_window: float = 900, max_refresh_rate: float = 10, cache=None,
+                 metrics_callback: Optional[Callable[[str, float, str], None]] = None):
         """
         Initialize the token client
         
@@ -13,12 +45,147 @@ class TVMClient:
             issuer: The token issuer URL
             role_arn: The ARN of the role to assume
             region: AWS region (default: us-east-1)
+            cache_size: Maximum number of users whose credentials are cached, 0 disables caching (default: 1024)
+            refresh_skew: Seconds before the STS expiration at which cached credentials are renewed (default: 300)
+            pool_size: Maximum number of kept-alive connections to the issuer and to STS (default: 10)
+            max_retries: Retries for throttled, failed or unreachable issuer and STS calls (default: 3)
+            timeout: Seconds to wait for the issuer to respond (default: 10)
+            sts_endpoint_url: Override the STS endpoint, e.g. a VPC endpoint (default: regional endpoint)
+            background_refresh: Renew the credentials of active users on a background thread before they
+                expire, so their requests are always served from the cache (default: False)
+            refresh_ahead: Background refreshes are spread at random over this many seconds before
+                refresh_skew, so users who logged in together are not refreshed together (default: 600)
+            active_window: Seconds after their last request during which users are kept refreshed (default: 900)
+            max_refresh_rate: Maximum background refreshes per second (default: 10)
+            cache: Cache backend shared with other processes, such as SQLiteCredentialCache or
+                RedisCredentialCache from credential_cache.py (default: in-memory cache of cache_size users)
+            metrics_callback: Called as metrics_callback(name, value, unit) with the duration of every
+                issuer call (IdTokenFetch, IdTokenBatchFetch) and STS exchange (StsExchange) in
+                Milliseconds, and a CacheHit or CacheMiss Count per lookup. It runs on the calling or
+                worker thread and must be thread-safe and quick (default: None, nothing is measured)
         """
         self.issuer = issuer
         self.role_arn = role_arn
         self.region = region
         self.client_id = client_id
         self.client_secret = client_secret
+        self.refresh_skew = refresh_skew
+        self._cache = cache if cache is not None else CredentialCache(cache_size)
+        # Fetches in flight per email, concurrent callers for the same email wait on the same one
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.sts_endpoint_url = sts_endpoint_url
+        self._metrics_callback = metrics_callback
+
+        # Create basic auth header
+        auth_string = f"{self.client_id}:{self.client_secret}"
+        auth_bytes = auth_string.encode('utf-8')
+        auth = base64.b64encode(auth_bytes).decode('utf-8')
+
+        # Keep-alive connection pool to the issuer shared by all calls
+        self._session = requests.Session()
+        self._session.headers.update({
+            'Authorization': f'Basic {auth}',
+            # With authorizer caching enabled API Gateway requires the Origin
+            # header, a non allow-listed origin falls back to the credentials
+            'Origin': self.issuer,
+            'Content-Type': 'application/json'
+        })
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=0.2,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['POST'])
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+        # Created on first use, boto3 clients are thread-safe once created
+        self._sts = None
+        self._sts_lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._stats_lock = threading.Lock()
+        self._refresher = None
+        if background_refresh and (cache is not None or cache_size > 0):
+            # Only needed with background_refresh
+            from credential_refresher import CredentialRefresher
+            self._refresher = CredentialRefresher(
+                self._assume_role,
+                self._cache,
+                refresh_skew,
+                refresh_ahead=refresh_ahead,
+                active_window=active_window,
+                max_refresh_rate=max_refresh_rate
+            )
+            self._refresher.start()
+
+    def close(self):
+        """
+        Stop the background refresher and close the pooled connections
+        """
+        if self._refresher is not None:
+            self._refresher.stop()
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def stats(self) -> dict:
+        """
+        Cache hits and misses of the get_sigv4_credentials calls, and background refreshes done and failed
+        """
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'refreshes': self._refresher.refreshes if self._refresher else 0,
+            'refresh_failures': self._refresher.failures if self._refresher else 0
+        }
+
+    def _record(self, email: str, hit: bool):
+        with self._stats_lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+        if self._metrics_callback is not None:
+            self._metrics_callback('CacheHit' if hit else 'CacheMiss', 1, 'Count')
+        if self._refresher is not None:
+            self._refresher.touch(email)
+
+    def _store(self, email: str, credentials: dict, expiration: float):
+        self._cache.put(email, credentials, expiration)
+        if self._refresher is not None:
+            self._refresher.schedule(email, expiration)
+
+    def _get_sts_client(self):
+        """
+        Return the STS client, created once and reused across calls and threads
+        """
+        if self._sts is None:
+            with self._sts_lock:
+                if self._sts is None:
+                    self._sts = boto3.session.Session().client(
+                        'sts',
+                        region_name=self.region,
+                        endpoint_url=self.sts_endpoint_url,
+                        config=Config(
+                            max_pool_connections=self.pool_size,
+                            # Retries are made by _exchange_token only, botocore retrying each of its
+                            # attempts too would multiply the calls made while STS throttles
+                            retries={'total_max_attempts': 1, 'mode': 'standard'}
+                        )
+                    )
+        return self._sts
 
     def _fetch_id_token(self, email: str) -> str:
         """
@@ -33,47 +200,209 @@ class TVMClient:
         Raises:
             requests.RequestException: If the token fetch fails
         """
-        # Create basic auth header
-        auth_string = f"{self.client_id}:{self.client_secret}"
-        auth_bytes = auth_string.encode('utf-8')
-        auth = base64.b64encode(auth_bytes).decode('utf-8')
-        
-        response = requests.post(
+        start = time.perf_counter() if self._metrics_callback is not None else None
+        response = self._session.post(
             f"{self.issuer}/token",
-            headers={
-                'Authorization': f'Basic {auth}',
-                'Content-Type': 'application/json'
-            },
-            json={'email': email}
+            json={'email': email},
+            timeout=self.timeout
         )
+        if start is not None:
+            self._metrics_callback('IdTokenFetch', (time.perf_counter() - start) * 1000, 'Milliseconds')
         
         response.raise_for_status()  # Raise exception for non-200 status codes
         return response.json()['id_token']
 
-    def get_sigv4_credentials(self, email: str) -> boto3.client:
+    def _fetch_id_tokens(self, emails: list) -> Tuple[dict, dict]:
         """
-        Get an AWS client using the ID token for role assumption
+        Fetch ID tokens for several emails with one call to the issuer's batch endpoint
+        
+        Args:
+            emails: Email addresses, at most the issuer's batch limit (100 by default)
+            
+        Returns:
+            tuple: {email: id_token} and {email: error message} for the emails the issuer refused
+            
+        Raises:
+            requests.RequestException: If the batch call fails as a whole
+        """
+        start = time.perf_counter() if self._metrics_callback is not None else None
+        response = self._session.post(
+            f"{self.issuer}/token/batch",
+            json={'emails': emails},
+            timeout=self.timeout
+        )
+        if start is not None:
+            self._metrics_callback('IdTokenBatchFetch', (time.perf_counter() - start) * 1000, 'Milliseconds')
+        
+        response.raise_for_status()
+        body = response.json()
+        return body['tokens'], body['errors']
+
+    def get_sigv4_credentials(self, email: str) -> dict:
+        """
+        Get SigV4 credentials for the user, served from the cache until they are
+        within refresh_skew seconds of their STS expiration
         
         Args:
             email: Email for token request
-            service_name: AWS service to create client for (e.g., 's3', 'dynamodb')
             
         Returns:
-            boto3.client: Initialized AWS client with assumed role credentials
+            dict: aws_access_key_id, aws_secret_access_key and aws_session_token, ready to pass to boto3.client
+        """
+        credentials = self._cache.get(email, self.refresh_skew)
+        self._record(email, credentials is not None)
+        if credentials is not None:
+            return dict(credentials)
+
+        with self._inflight_lock:
+            # Re-check under the lock, a fetch may have completed since the first lookup
+            credentials = self._cache.get(email, self.refresh_skew)
+            if credentials is not None:
+                return dict(credentials)
+            future = self._inflight.get(email)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[email] = future
+
+        if not owner:
+            return dict(future.result())
+
+        try:
+            credentials, expiration = self._assume_role(email)
+            self._store(email, credentials, expiration)
+            future.set_result(credentials)
+            return dict(credentials)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[email]
+
+    def invalidate(self, email: str):
+        """
+        Drop the cached credentials for the user, e.g. after an access denied error
+        """
+        self._cache.invalidate(email)
+
+    def get_sigv4_credentials_many(self, emails: Iterable[str], max_concurrency: int = 16, use_batch: bool = True,
+                                   batch_size: int = 100) -> Iterator[Tuple[str, Union[dict, Exception]]]:
+        """
+        Get SigV4 credentials for many users, yielding each result as soon as it is available
+        
+        Cached credentials are yielded first. ID tokens for the others are fetched
+        through the issuer's /token/batch endpoint (falling back to parallel /token
+        calls when it is unavailable) and exchanged for STS credentials on a
+        bounded worker pool. A failure is yielded for its email and does not stop
+        the others.
+        
+        Args:
+            emails: Emails to get credentials for, duplicates are fetched once
+            max_concurrency: Maximum number of issuer and STS calls in flight (default: 16)
+            use_batch: Use the issuer's /token/batch endpoint (default: True)
+            batch_size: Emails per batch call, must not exceed the issuer's batch limit (default: 100)
+            
+        Yields:
+            tuple: The email and either its credentials dict or the exception raised for it
+        """
+        pending = []
+        for email in dict.fromkeys(emails):
+            credentials = self._cache.get(email, self.refresh_skew)
+            self._record(email, credentials is not None)
+            if credentials is not None:
+                yield email, dict(credentials)
+            else:
+                pending.append(email)
+        if not pending:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        try:
+            # future -> (kind of call, email or batch of emails)
+            futures = {}
+            if use_batch:
+                for i in range(0, len(pending), batch_size):
+                    batch = pending[i:i + batch_size]
+                    futures[executor.submit(self._fetch_id_tokens, batch)] = ('batch', batch)
+            else:
+                for email in pending:
+                    futures[executor.submit(self._fetch_id_token, email)] = ('token', email)
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, key = futures.pop(future)
+                    if kind == 'batch':
+                        try:
+                            tokens, errors = future.result()
+                        except requests.RequestException:
+                            # Issuer without a batch endpoint or failed batch, fetch the tokens one by one
+                            for email in key:
+                                futures[executor.submit(self._fetch_id_token, email)] = ('token', email)
+                            continue
+                        for email in key:
+                            if email in tokens:
+                                futures[executor.submit(self._exchange_token, email, tokens[email])] = ('credentials', email)
+                            else:
+                                yield email, TVMTokenError(errors.get(email, 'no token returned'))
+                    elif kind == 'token':
+                        try:
+                            id_token = future.result()
+                        except Exception as e:
+                            yield key, e
+                            continue
+                        futures[executor.submit(self._exchange_token, key, id_token)] = ('credentials', key)
+                    else:
+                        try:
+                            credentials, expiration = future.result()
+                        except Exception as e:
+                            yield key, e
+                            continue
+                        self._store(key, credentials, expiration)
+                        yield key, dict(credentials)
+        finally:
+            # Do not wait for or start remaining calls if the caller stopped iterating
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _assume_role(self, email: str) -> Tuple[dict, float]:
+        """
+        Mint an ID token and exchange it for STS credentials
+        
+        Returns:
+            tuple: The SigV4 credentials and their expiration as epoch seconds
         """
         # Get the ID token
         id_token = self._fetch_id_token(email)
+        return self._exchange_token(email, id_token)
+
+    def _exchange_token(self, email: str, id_token: str) -> Tuple[dict, float]:
+        """
+        Exchange an ID token for STS credentials, backing off while STS throttles
         
-        # Create STS client
-        sts = boto3.client('sts', region_name=self.region)
-        
-        # Assume role with web identity
-        response = sts.assume_role_with_web_identity(
-            RoleArn=self.role_arn,
-            RoleSessionName=f"session-{email}",
-            WebIdentityToken=id_token
-        )
+        Returns:
+            tuple: The SigV4 credentials and their expiration as epoch seconds
+        """
+        # Includes the backoff between retries, it is part of the latency seen by callers
+        start = time.perf_counter() if self._metrics_callback is not None else None
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Assume role with web identity
+                response = self._get_sts_client().assume_role_with_web_identity(
+                    RoleArn=self.role_arn,
+                    RoleSessionName=f"session-{email}",
+                    WebIdentityToken=id_token
+                )
+                break
+            except (ClientError, BotocoreConnectionError, HTTPClientError) as e:
+                if not _is_retryable_sts_error(e) or attempt == self.max_retries:
+                    raise
+                # Full jitter so parallel workers do not retry in lockstep
+                time.sleep(random.uniform(0, 0.5 * 2 ** attempt))
         
+        if start is not None:
+            self._metrics_callback('StsExchange', (time.perf_counter() - start) * 1000, 'Milliseconds')
+
         # Extract credentials from response
         credentials = response['Credentials']
         
@@ -82,4 +411,4 @@ class TVMClient:
             "aws_access_key_id": credentials['AccessKeyId'],
             "aws_secret_access_key": credentials['SecretAccessKey'],
             "aws_session_token" : credentials['SessionToken']
-        }
\ No newline at end of file
+        }, credentials['Expiration'].timestamp()
@@ -0,0 +1,69 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+AsyncTVMClient against the local TVM and STS stand-in of the benchmarks.
+
+    pip install aiohttp pytest
+    python -m pytest tests/test_async_tvm_client.py
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('aiohttp')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'sample-tvm-backend-usage'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from async_tvm_client import AsyncTVMClient  # noqa: E402
+from standins import LocalTVMServer  # noqa: E402
+
+ROLE_ARN = 'arn:aws:iam::123456789012:role/tvm'
+
+
+@pytest.fixture
+def server():
+    with LocalTVMServer() as server:
+        yield server
+
+
+def make_client(server, **kwargs):
+    return AsyncTVMClient(server.url, 'client', 'secret', ROLE_ARN, sts_endpoint_url=server.url, **kwargs)
+
+
+def test_get_sigv4_credentials_many(server):
+    emails = [f"user{i}@example.com" for i in range(5)]
+    measured = []
+
+    async def run():
+        async with make_client(server, metrics_callback=lambda *metric: measured.append(metric)) as client:
+            await client.get_sigv4_credentials(emails[0])
+            results = [result async for result in client.get_sigv4_credentials_many(emails + emails[:1])]
+            return client.stats, results
+
+    stats, results = asyncio.run(run())
+
+    assert [email for email, _ in results][0] == emails[0]
+    assert sorted(email for email, _ in results) == sorted(emails)
+    assert all('aws_session_token' in credentials for _, credentials in results)
+    assert stats == {'hits': 1, 'misses': 5, 'refreshes': 0, 'refresh_failures': 0}
+    assert server.calls['/token/batch'] == 1
+    names = [name for name, _, _ in measured]
+    assert names.count('IdTokenFetch') == 1
+    assert names.count('IdTokenBatchFetch') == 1
+    assert names.count('StsExchange') == 5
+    assert names.count('CacheHit') == 1 and names.count('CacheMiss') == 5
+
+
+def test_get_sigv4_credentials_many_without_batch(server):
+    emails = [f"user{i}@example.com" for i in range(3)]
+
+    async def run():
+        async with make_client(server) as client:
+            return [result async for result in client.get_sigv4_credentials_many(emails, use_batch=False)]
+
+    results = asyncio.run(run())
+
+    assert sorted(email for email, _ in results) == emails
+    assert server.calls['/token'] == 3
+    assert '/token/batch' not in server.calls
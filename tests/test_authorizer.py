@@ -0,0 +1,101 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Lambda authorizer against the in-memory SSM stand-in of the benchmarks.
+
+    pip install boto3 pytest
+    python -m pytest tests/test_authorizer.py
+"""
+import base64
+import json
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from standins import StubSSM, api_gateway_events, load_lambda  # noqa: E402
+
+AUTHORIZER_DIR = os.path.join(os.path.dirname(__file__), '..', 'amzn-q-auth-tvm', 'lambdas', 'lambda-authorizer')
+
+
+def load_authorizer(monkeypatch, ssm, registry=False):
+    monkeypatch.setenv('PREFETCH_ON_INIT', 'false')
+    monkeypatch.setenv('OIDC_ALLOW_LIST', '/tvm/allow-list')
+    if registry:
+        monkeypatch.setenv('CLIENT_REGISTRY_PARAM', '/tvm/clients')
+    else:
+        monkeypatch.setenv('CLIENT_ID_PARAM', '/tvm/client-id')
+        monkeypatch.setenv('CLIENT_SECRET_PARAM', '/tvm/client-secret')
+    authorizer = load_lambda(AUTHORIZER_DIR, f"authorizer_{uuid.uuid4().hex}")
+    authorizer.ssm_client = ssm
+    return authorizer
+
+
+def authorize(authorizer, client_id='backend', client_secret='secret'):
+    credentials = base64.b64encode(f"{client_id}:{client_secret}".encode('utf-8')).decode('utf-8')
+    event, _ = api_gateway_events('POST', '/token', {'Authorization': f"Basic {credentials}"}, '{}')
+    return authorizer.lambda_handler(event, None)['policyDocument']['Statement'][0]['Effect']
+
+
+@pytest.fixture
+def ssm():
+    ssm = StubSSM()
+    ssm.put('/tvm/allow-list', '')
+    return ssm
+
+
+def test_client_credentials(monkeypatch, ssm):
+    ssm.put('/tvm/client-id', 'backend')
+    ssm.put('/tvm/client-secret', 'secret')
+    authorizer = load_authorizer(monkeypatch, ssm)
+
+    assert authorize(authorizer) == 'Allow'
+    assert authorize(authorizer, client_secret='wrong') == 'Deny'
+
+
+def test_missing_client_credentials_deny(monkeypatch, ssm):
+    ssm.put('/tvm/client-id', 'backend')
+    authorizer = load_authorizer(monkeypatch, ssm)
+
+    assert authorize(authorizer) == 'Deny'
+    assert authorize(authorizer) == 'Deny'
+    # The missing secret is cached like the values SSM returned
+    assert ssm.calls['GetParameters'] == 1
+
+
+def test_client_registry(monkeypatch, ssm):
+    authorizer = load_authorizer(monkeypatch, ssm, registry=True)
+    ssm.put('/tvm/clients', json.dumps({'clients': {'backend': {'secret_hash': authorizer.hash_client_secret('secret')}}}))
+
+    assert authorize(authorizer) == 'Allow'
+    assert authorize(authorizer, client_id='other') == 'Deny'
+
+
+def test_missing_client_registry_denies(monkeypatch, ssm):
+    authorizer = load_authorizer(monkeypatch, ssm, registry=True)
+
+    assert authorize(authorizer) == 'Deny'
+
+
+def test_malformed_registry_entry_only_denies_that_client(monkeypatch, ssm):
+    authorizer = load_authorizer(monkeypatch, ssm, registry=True)
+    ssm.put('/tvm/clients', json.dumps({'clients': {
+        'broken': {'secret_hash': 'sha256$not-hex'},
+        'backend': {'secret_hash': authorizer.hash_client_secret('secret')}
+    }}))
+
+    assert authorize(authorizer) == 'Allow'
+    assert authorize(authorizer, client_id='broken') == 'Deny'
+
+
+def test_missing_allow_list_is_cached(monkeypatch):
+    ssm = StubSSM()
+    ssm.put('/tvm/client-id', 'backend')
+    ssm.put('/tvm/client-secret', 'secret')
+    authorizer = load_authorizer(monkeypatch, ssm)
+
+    assert authorize(authorizer) == 'Allow'
+    assert authorize(authorizer) == 'Allow'
+    assert ssm.calls['GetParameter'] == 1
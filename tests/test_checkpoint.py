@@ -0,0 +1,64 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+ProvisioningCheckpoint against the SSM stand-in of the benchmarks.
+
+    pip install boto3 pytest
+    python -m pytest tests/test_checkpoint.py
+"""
+import os
+import sys
+
+import boto3
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'amzn-q-auth-tvm', 'lambdas', 'q-biz'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from checkpoint import ProvisioningCheckpoint  # noqa: E402
+from standins import LocalSSMServer, StubSSM  # noqa: E402
+
+STACK_ID = 'arn:aws:cloudformation:us-east-1:123456789012:stack/tvm/1'
+
+
+def event(request_type, request_id):
+    return {'RequestType': request_type, 'RequestId': request_id, 'StackId': STACK_ID, 'LogicalResourceId': 'QBusiness'}
+
+
+@pytest.fixture
+def ssm_client():
+    with LocalSSMServer(StubSSM()) as server:
+        yield boto3.client('ssm', region_name='us-east-1', endpoint_url=server.url,
+                           aws_access_key_id='test', aws_secret_access_key='test')
+
+
+def test_is_complete_polls_resume_the_create(ssm_client):
+    create = ProvisioningCheckpoint(ssm_client, event('Create', 'request-1'))
+    create.save({'application': 'app-1'})
+
+    # isComplete receives the event of the Create request
+    poll = ProvisioningCheckpoint(ssm_client, event('Create', 'request-1'))
+
+    assert poll.load() == {'application': 'app-1'}
+    assert poll.client_token('index') == create.client_token('index')
+
+
+def test_a_new_create_starts_over(ssm_client):
+    first = ProvisioningCheckpoint(ssm_client, event('Create', 'request-1'))
+    first.save({'application': 'app-1'})
+
+    second = ProvisioningCheckpoint(ssm_client, event('Create', 'request-2'))
+
+    assert second.load() == {}
+    assert second.client_token('application') != first.client_token('application')
+    assert second.client_token('index') != first.client_token('index')
+
+
+def test_delete_finds_the_last_create(ssm_client):
+    ProvisioningCheckpoint(ssm_client, event('Create', 'request-1')).save({'application': 'app-1'})
+
+    delete = ProvisioningCheckpoint(ssm_client, event('Delete', 'request-2'))
+
+    assert delete.load(any_request=True) == {'application': 'app-1'}
+    delete.delete()
+    assert delete.load(any_request=True) == {}
+    delete.delete()
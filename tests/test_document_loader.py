@@ -0,0 +1,108 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+DocumentLoader against the local S3 stand-in of the benchmarks.
+
+    pip install boto3 pytest
+    python -m pytest tests/test_document_loader.py
+"""
+import os
+import sys
+import zipfile
+
+import boto3
+import pytest
+from botocore.config import Config
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'amzn-q-auth-tvm', 'lambdas', 'q-biz'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from document_loader import DocumentLoader, MB  # noqa: E402
+from standins import LocalS3Server  # noqa: E402
+
+BUCKET = 'test-bucket'
+DOCUMENTS = 20
+# S3 parts are at least 5 MB, the large document is uploaded in 3 parts
+LARGE_SIZE = 12 * MB
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = tmp_path / 'corpus.zip'
+    with zipfile.ZipFile(path, 'w') as archive:
+        for i in range(DOCUMENTS):
+            archive.writestr(f"tickets/ticket_{i}.txt", f"Ticket {i}\n" * 50)
+        archive.writestr('manuals/manual.bin', os.urandom(LARGE_SIZE))
+        archive.writestr('.hidden/skipped.txt', 'not uploaded')
+    return str(path)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # The stand-in does not check signatures
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    with LocalS3Server() as server:
+        yield server
+
+
+def make_loader(server, prefix='docs/'):
+    s3_client = boto3.client('s3', region_name='us-east-1', endpoint_url=server.url, config=Config(
+        max_pool_connections=8,
+        s3={'addressing_style': 'path'}
+    ))
+    return DocumentLoader(s3_client, BUCKET, prefix, workers=8, multipart_threshold=5 * MB, multipart_chunksize=5 * MB)
+
+
+def open_handles(path):
+    """Number of file descriptors of this process open on path."""
+    handles = 0
+    for fd in os.listdir('/proc/self/fd'):
+        try:
+            handles += os.readlink(f"/proc/self/fd/{fd}") == path
+        except OSError:
+            pass
+    return handles
+
+
+def test_first_pass_uploads_everything(server, corpus):
+    stats = make_loader(server).load(corpus)
+
+    assert stats['uploaded'] == DOCUMENTS + 1
+    assert stats['skipped'] == 0
+    assert stats['failed'] == 0
+    keys = {key for _, key in server.objects}
+    assert keys == {f"docs/tickets/ticket_{i}.txt" for i in range(DOCUMENTS)} | {'docs/manuals/manual.bin'}
+    with zipfile.ZipFile(corpus) as archive:
+        assert server.objects[(BUCKET, 'docs/tickets/ticket_3.txt')]['body'] == archive.read('tickets/ticket_3.txt')
+        assert server.objects[(BUCKET, 'docs/manuals/manual.bin')]['body'] == archive.read('manuals/manual.bin')
+
+
+def test_large_documents_use_multipart(server, corpus):
+    make_loader(server).load(corpus)
+
+    assert server.calls.get('CreateMultipartUpload') == 1
+    assert server.calls.get('UploadPart') == 3
+    assert server.calls.get('CompleteMultipartUpload') == 1
+    assert server.calls.get('PutObject') == DOCUMENTS
+
+
+def test_repeat_pass_skips_unchanged(server, corpus):
+    loader = make_loader(server)
+    loader.load(corpus)
+    uploads = dict(server.calls)
+
+    stats = loader.load(corpus)
+
+    assert stats['uploaded'] == 0
+    assert stats['skipped'] == DOCUMENTS + 1
+    for operation in ('PutObject', 'UploadPart', 'CreateMultipartUpload'):
+        assert server.calls.get(operation) == uploads.get(operation)
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='needs /proc')
+def test_archives_are_closed(server, corpus):
+    loader = make_loader(server)
+    loader.load(corpus)
+    loader.load(corpus)
+
+    assert open_handles(os.path.realpath(corpus)) == 0
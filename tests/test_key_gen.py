@@ -0,0 +1,130 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Key rotation and retirement of key-gen, and the issuer JWKS after a retirement,
+against the SSM stand-in of the benchmarks.
+
+    pip install boto3 cryptography authlib pytest
+    python -m pytest tests/test_key_gen.py
+"""
+import json
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from standins import LocalSSMServer, StubSSM, api_gateway_events, load_lambda  # noqa: E402
+
+LAMBDAS = os.path.join(os.path.dirname(__file__), '..', 'amzn-q-auth-tvm', 'lambdas')
+
+
+@pytest.fixture
+def ssm(monkeypatch):
+    # key-gen creates its boto3 clients at import, pointed at the stand-in
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    monkeypatch.setenv('PREFETCH_ON_INIT', 'false')
+    ssm = StubSSM()
+    with LocalSSMServer(ssm) as server:
+        monkeypatch.setenv('AWS_ENDPOINT_URL_SSM', server.url)
+        yield ssm
+
+
+@pytest.fixture
+def key_gen(ssm):
+    return load_lambda(os.path.join(LAMBDAS, 'key-gen'), f"key_gen_{uuid.uuid4().hex}")
+
+
+def manifest(ssm):
+    return json.loads(ssm.get_parameter(Name='/oidc/key_manifest')['Parameter']['Value'])['keys']
+
+
+def has_key_pair(ssm, kid):
+    names = [f"/oidc/keys/{kid}/private_key", f"/oidc/keys/{kid}/public_key"]
+    return not ssm.get_parameters(Names=names)['InvalidParameters']
+
+
+def update(key_gen, retained_keys, old_retained_keys=2):
+    properties = {'SigningAlgorithm': 'ES256', 'RotationId': '0', 'RetainedKeys': str(retained_keys)}
+    old_properties = dict(properties, RetainedKeys=str(old_retained_keys))
+    event = {'RequestType': 'Update', 'ResourceProperties': properties, 'OldResourceProperties': old_properties}
+    return key_gen.lambda_handler(event, None)
+
+
+def test_split_retired(key_gen):
+    keys = [{'kid': 'pending', 'activates_at': 200}, {'kid': 'signing', 'activates_at': 50},
+            {'kid': 'previous', 'activates_at': 20}, {'kid': 'oldest', 'activates_at': 0}]
+
+    kept, retired = key_gen.split_retired(keys, 2, now=100)
+
+    assert [key['kid'] for key in kept] == ['pending', 'signing', 'previous']
+    assert [key['kid'] for key in retired] == ['oldest']
+
+
+def test_split_retired_keeps_the_signing_key_while_its_successors_are_pending(key_gen):
+    keys = [{'kid': 'pending2', 'activates_at': 300}, {'kid': 'pending1', 'activates_at': 200},
+            {'kid': 'signing', 'activates_at': 50}]
+
+    kept, retired = key_gen.split_retired(keys, 1, now=100)
+
+    assert [key['kid'] for key in kept] == ['pending2', 'pending1', 'signing']
+    assert retired == []
+
+
+def test_rotate_keys(ssm, key_gen):
+    first = key_gen.rotate_keys('ES256', retained_keys=1, activation_delay=3600)
+    second = key_gen.rotate_keys('ES256', retained_keys=1, activation_delay=3600)
+
+    # The first key keeps signing until the second one activates
+    keys = manifest(ssm)
+    assert [key['kid'] for key in keys] == [second, first]
+    assert keys[1]['activates_at'] < keys[0]['activates_at']
+    assert has_key_pair(ssm, first) and has_key_pair(ssm, second)
+
+    # The second key is still pending and kept, the first one is now beyond the retained count
+    third = key_gen.rotate_keys('ES256', retained_keys=1, activation_delay=0)
+
+    assert [key['kid'] for key in manifest(ssm)] == [third, second]
+    assert not has_key_pair(ssm, first)
+    assert has_key_pair(ssm, second) and has_key_pair(ssm, third)
+
+
+def test_update_applies_retained_keys(ssm, key_gen):
+    kids = [key_gen.rotate_keys('ES256', retained_keys=3, activation_delay=0) for _ in range(3)]
+
+    response = update(key_gen, retained_keys=1, old_retained_keys=3)
+
+    assert response['statusCode'] == 200
+    assert [key['kid'] for key in manifest(ssm)] == [kids[-1]]
+    assert not has_key_pair(ssm, kids[0]) and not has_key_pair(ssm, kids[1])
+
+
+def test_update_without_changes_keeps_keys(ssm, key_gen):
+    kids = [key_gen.rotate_keys('ES256', retained_keys=2, activation_delay=0) for _ in range(2)]
+    version = ssm.get_parameter(Name='/oidc/key_manifest')['Parameter']['Version']
+
+    update(key_gen, retained_keys=2)
+
+    assert [key['kid'] for key in manifest(ssm)] == kids[::-1]
+    assert ssm.get_parameter(Name='/oidc/key_manifest')['Parameter']['Version'] == version
+
+
+def test_jwks_skips_keys_retired_after_the_manifest_was_cached(ssm, key_gen):
+    issuer = load_lambda(os.path.join(LAMBDAS, 'oidc-issuer'), f"issuer_{uuid.uuid4().hex}")
+    issuer.ssm_client = ssm
+    first = key_gen.rotate_keys('ES256', retained_keys=2, activation_delay=0)
+    second = key_gen.rotate_keys('ES256', retained_keys=2, activation_delay=0)
+    _, event = api_gateway_events('GET', '/.well-known/openid-configuration', {}, None)
+    issuer.lambda_handler(event, None)
+
+    # The issuer still holds the manifest listing the first key
+    key_gen.rotate_keys('ES256', retained_keys=2, activation_delay=0)
+    _, event = api_gateway_events('GET', '/.well-known/jwks.json', {}, None)
+    response = issuer.lambda_handler(event, None)
+
+    assert response['statusCode'] == 200
+    assert [key['kid'] for key in json.loads(response['body'])['keys']] == [second]
+    assert first not in response['body']
@@ -0,0 +1,70 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+OIDC issuer request handling against the in-memory SSM stand-in of the benchmarks.
+
+    pip install boto3 pytest
+    python -m pytest tests/test_oidc_issuer.py
+"""
+import json
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+from standins import StubSSM, api_gateway_events, load_lambda  # noqa: E402
+
+ISSUER_DIR = os.path.join(os.path.dirname(__file__), '..', 'amzn-q-auth-tvm', 'lambdas', 'oidc-issuer')
+
+
+@pytest.fixture
+def issuer(monkeypatch):
+    monkeypatch.setenv('PREFETCH_ON_INIT', 'false')
+    ssm = StubSSM()
+    ssm.put('/oidc/key_manifest', json.dumps({'keys': [{'kid': 'test', 'alg': 'RS256', 'activates_at': 0}]}))
+    issuer = load_lambda(ISSUER_DIR, f"issuer_{uuid.uuid4().hex}")
+    issuer.ssm_client = ssm
+    return issuer
+
+
+def request(issuer, method, path, headers=None, body=None):
+    _, event = api_gateway_events(method, path, headers or {}, body)
+    return issuer.lambda_handler(event, None)
+
+
+@pytest.mark.parametrize('path', ['/token', '/token/batch'])
+@pytest.mark.parametrize('body', [None, '', 'null', '[]', '"email"', '{"email": '])
+def test_token_body_must_be_an_object(issuer, path, body):
+    response = request(issuer, 'POST', path, body=body)
+
+    assert response['statusCode'] == 400
+    assert json.loads(response['body']) == {'error': 'request body must be a JSON object'}
+
+
+def test_token_email_is_required(issuer):
+    response = request(issuer, 'POST', '/token', body='{}')
+
+    assert response['statusCode'] == 400
+    assert json.loads(response['body']) == {'error': 'email parameter is required'}
+
+
+@pytest.mark.parametrize('if_none_match', ['{etag}', 'W/{etag}', '"other", W/{etag}', '"other",{etag}', '*'])
+def test_well_known_not_modified(issuer, if_none_match):
+    etag = request(issuer, 'GET', '/.well-known/openid-configuration')['headers']['ETag']
+
+    response = request(issuer, 'GET', '/.well-known/openid-configuration',
+                       headers={'if-none-match': if_none_match.format(etag=etag)})
+
+    assert response['statusCode'] == 304
+    assert response['body'] == ''
+    assert response['headers']['ETag'] == etag
+
+
+@pytest.mark.parametrize('if_none_match', ['"other"', 'W/"other", "stale"'])
+def test_well_known_modified(issuer, if_none_match):
+    response = request(issuer, 'GET', '/.well-known/openid-configuration', headers={'If-None-Match': if_none_match})
+
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['id_token_signing_alg_values_supported'] == ['RS256']
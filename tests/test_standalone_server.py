@@ -0,0 +1,79 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Request handling of the standalone server, a worker serving a generated parameters file.
+
+    pip install boto3 authlib cryptography pytest
+    python -m pytest tests/test_standalone_server.py
+"""
+import base64
+import http.client
+import json
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'amzn-q-auth-tvm', 'standalone'))
+import server  # noqa: E402
+
+CLIENT_ID = 'backend'
+CLIENT_SECRET = 'secret'
+
+
+@pytest.fixture(scope='module')
+def address(tmp_path_factory):
+    parameters_file = tmp_path_factory.mktemp('standalone') / 'parameters.json'
+    parameters_file.write_text(json.dumps({'parameters': server.generate_parameters('ES256', CLIENT_ID, CLIENT_SECRET, [])}))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        for name, value in server.DEFAULT_ENVIRONMENT.items():
+            monkeypatch.setenv(name, value)
+        monkeypatch.setenv('ISSUER_URL', 'http://127.0.0.1')
+        monkeypatch.setenv('AUDIENCE', 'test')
+        monkeypatch.setenv('PREFETCH_ON_INIT', 'false')
+        app = server.TVMApplication('http://127.0.0.1', server.FileParameterStore(str(parameters_file)))
+    listener = socket.create_server(('127.0.0.1', 0))
+    worker = server._WorkerServer(listener, app)
+    threading.Thread(target=worker.serve_forever, daemon=True).start()
+    yield listener.getsockname()
+    worker.shutdown()
+    listener.close()
+
+
+def post(address, body, content_length):
+    connection = http.client.HTTPConnection(*address, timeout=10)
+    connection.putrequest('POST', '/token')
+    credentials = base64.b64encode(f"{CLIENT_ID}:{CLIENT_SECRET}".encode('utf-8')).decode('utf-8')
+    connection.putheader('Authorization', f"Basic {credentials}")
+    connection.putheader('Content-Length', content_length)
+    connection.endheaders(body)
+    response = connection.getresponse()
+    status, payload = response.status, json.loads(response.read())
+    connection.close()
+    return status, payload
+
+
+def test_token(address):
+    body = json.dumps({'email': 'user@example.com'}).encode('utf-8')
+
+    status, payload = post(address, body, str(len(body)))
+
+    assert status == 200
+    assert 'id_token' in payload
+
+
+@pytest.mark.parametrize('content_length', ['abc', '-1'])
+def test_invalid_content_length(address, content_length):
+    status, payload = post(address, b'', content_length)
+
+    assert status == 400
+    assert payload == {'error': 'invalid Content-Length header'}
+
+
+def test_body_too_large(address):
+    status, payload = post(address, b'', str(server.MAX_BODY_SIZE + 1))
+
+    assert status == 413
+    assert 'larger than' in payload['error']
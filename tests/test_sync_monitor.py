@@ -0,0 +1,108 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+SyncJobMonitor against a botocore Stubber of the Q Business client.
+
+    pip install boto3 pytest
+    python -m pytest tests/test_sync_monitor.py
+"""
+import datetime
+import os
+import sys
+import time
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'amzn-q-auth-tvm', 'lambdas', 'q-biz'))
+from sync_monitor import SyncJobMonitor  # noqa: E402
+
+APPLICATION_ID = 'a' * 36
+INDEX_ID = 'b' * 36
+DATA_SOURCE_ID = 'c' * 36
+EXECUTION_ID = 'd' * 36
+REQUEST = {'applicationId': APPLICATION_ID, 'indexId': INDEX_ID, 'dataSourceId': DATA_SOURCE_ID}
+START = datetime.datetime(2026, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def job(status, added, failed=0, minutes=None):
+    entry = {
+        'executionId': EXECUTION_ID,
+        'status': status,
+        'startTime': START,
+        'metrics': {'documentsAdded': str(added), 'documentsModified': '0', 'documentsDeleted': '0',
+                    'documentsFailed': str(failed), 'documentsScanned': str(added + failed)}
+    }
+    if minutes is not None:
+        entry['endTime'] = START + datetime.timedelta(minutes=minutes)
+    return entry
+
+
+@pytest.fixture
+def client():
+    qbusiness = boto3.client('qbusiness', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+    with Stubber(qbusiness) as stubber:
+        yield qbusiness, stubber
+        stubber.assert_no_pending_responses()
+
+
+def wait(qbusiness, timeout=5):
+    monitor = SyncJobMonitor(qbusiness, APPLICATION_ID, INDEX_ID, initial_delay=0, max_delay=0)
+    return monitor.wait('S3DataSource', DATA_SOURCE_ID, EXECUTION_ID, time.monotonic() + timeout)
+
+
+def test_running_then_succeeded(client):
+    qbusiness, stubber = client
+    stubber.add_response('list_data_source_sync_jobs', {'history': []}, REQUEST)
+    stubber.add_response('list_data_source_sync_jobs', {'history': [job('SYNCING', 40)]}, REQUEST)
+    stubber.add_response('list_data_source_sync_jobs', {'history': [job('SYNCING_INDEXING', 90)]}, REQUEST)
+    stubber.add_response('list_data_source_sync_jobs', {'history': [job('SUCCEEDED', 120, minutes=4)]}, REQUEST)
+
+    metrics = wait(qbusiness)
+
+    assert metrics['status'] == 'SUCCEEDED'
+    assert metrics['executionId'] == EXECUTION_ID
+    assert metrics['documentsAdded'] == 120
+    assert metrics['documentsScanned'] == 120
+    assert metrics['durationSeconds'] == 240.0
+    assert metrics['documentsAddedPerMinute'] == 30.0
+    assert metrics['documentsFailedPerMinute'] == 0.0
+
+
+def test_failed(client):
+    qbusiness, stubber = client
+    failed = dict(job('FAILED', 10, failed=30, minutes=2), error={'errorCode': 'InternalError', 'errorMessage': 'crawl failed'})
+    stubber.add_response('list_data_source_sync_jobs', {'history': [job('SYNCING', 5)]}, REQUEST)
+    stubber.add_response('list_data_source_sync_jobs', {'history': [failed]}, REQUEST)
+
+    metrics = wait(qbusiness)
+
+    assert metrics['status'] == 'FAILED'
+    assert metrics['documentsAdded'] == 10
+    assert metrics['documentsFailed'] == 30
+    assert metrics['documentsFailedPerMinute'] == 15.0
+
+
+def test_paginates_to_the_execution(client):
+    qbusiness, stubber = client
+    other = dict(job('SUCCEEDED', 1, minutes=1), executionId='e' * 36)
+    stubber.add_response('list_data_source_sync_jobs', {'history': [other], 'nextToken': 'page2'}, REQUEST)
+    stubber.add_response('list_data_source_sync_jobs', {'history': [job('SUCCEEDED', 60, minutes=2)]},
+                         dict(REQUEST, nextToken='page2'))
+
+    metrics = wait(qbusiness)
+
+    assert metrics['status'] == 'SUCCEEDED'
+    assert metrics['documentsAdded'] == 60
+
+
+def test_still_running_at_the_deadline(client):
+    qbusiness, stubber = client
+    stubber.add_response('list_data_source_sync_jobs', {'history': [job('SYNCING', 25)]}, REQUEST)
+
+    metrics = wait(qbusiness, timeout=0)
+
+    assert metrics['status'] == 'TIMEOUT'
+    assert metrics['documentsAdded'] == 25
+    assert 'durationSeconds' in metrics